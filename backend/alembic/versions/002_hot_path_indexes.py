@@ -0,0 +1,89 @@
+"""Indexes for hot query paths
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # Dashboard list: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+        op.create_index(
+            'ix_generations_user_id_created_at',
+            'generations',
+            ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # Per-status counts for a user
+        op.create_index(
+            'ix_generations_user_id_status',
+            'generations',
+            ['user_id', 'status'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # Retention sweep: keyset over (created_at, id) of completed rows
+        op.create_index(
+            'ix_generations_completed_created_at',
+            'generations',
+            ['created_at', 'id'],
+            postgresql_where=sa.text("status = 'completed'"),
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # Webhook sender lookup
+        op.create_index(
+            'ix_whatsapp_numbers_phone_number',
+            'whatsapp_numbers',
+            ['phone_number'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # Stripe webhooks look users up by customer id
+        op.create_index(
+            'ix_users_subscription_id',
+            'users',
+            ['subscription_id'],
+            postgresql_where=sa.text('subscription_id IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # check_expired_trials
+        op.create_index(
+            'ix_users_plan_type_trial_ends_at',
+            'users',
+            ['plan_type', 'trial_ends_at'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for index_name, table_name in [
+            ('ix_users_plan_type_trial_ends_at', 'users'),
+            ('ix_users_subscription_id', 'users'),
+            ('ix_whatsapp_numbers_phone_number', 'whatsapp_numbers'),
+            ('ix_generations_completed_created_at', 'generations'),
+            ('ix_generations_user_id_status', 'generations'),
+            ('ix_generations_user_id_created_at', 'generations'),
+        ]:
+            op.drop_index(
+                index_name,
+                table_name=table_name,
+                postgresql_concurrently=True,
+                if_exists=True
+            )
@@ -0,0 +1,62 @@
+"""Generation daily stats rollup
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generation_daily_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('generations', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('completed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('text_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('audio_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('web_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('credits_used', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('processing_time_sum', sa.Float(), server_default='0', nullable=False),
+        sa.Column('processing_time_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    
+    # Backfill from existing generations
+    op.execute("""
+        INSERT INTO generation_daily_stats (
+            user_id, day, generations, completed, failed,
+            text_count, audio_count, web_count,
+            credits_used, processing_time_sum, processing_time_count
+        )
+        SELECT
+            user_id,
+            CAST(created_at AS DATE),
+            count(*),
+            count(*) FILTER (WHERE status = 'completed'),
+            count(*) FILTER (WHERE status = 'failed'),
+            count(*) FILTER (WHERE input_type = 'text'),
+            count(*) FILTER (WHERE input_type = 'audio'),
+            count(*) FILTER (WHERE input_type = 'web'),
+            coalesce(sum(credits_used), 0),
+            coalesce(sum(processing_time), 0),
+            count(processing_time)
+        FROM generations
+        WHERE created_at IS NOT NULL
+        GROUP BY user_id, CAST(created_at AS DATE)
+    """)
+
+
+def downgrade():
+    op.drop_table('generation_daily_stats')
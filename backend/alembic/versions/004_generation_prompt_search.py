@@ -0,0 +1,59 @@
+"""Prompt search: trigram and Portuguese full-text indexes
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    
+    # Generated column: Postgres keeps it in sync with prompt.
+    # Adding it rewrites the table once.
+    op.add_column('generations', sa.Column(
+        'prompt_tsv',
+        postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('portuguese'::regconfig, coalesce(prompt, ''))", persisted=True),
+        nullable=True
+    ))
+    
+    with op.get_context().autocommit_block():
+        # Substring search (ILIKE '%...%')
+        op.create_index(
+            'ix_generations_prompt_trgm',
+            'generations',
+            ['prompt'],
+            postgresql_using='gin',
+            postgresql_ops={'prompt': 'gin_trgm_ops'},
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        # Word search with ranking
+        op.create_index(
+            'ix_generations_prompt_tsv',
+            'generations',
+            ['prompt_tsv'],
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_generations_prompt_tsv', table_name='generations', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_generations_prompt_trgm', table_name='generations', postgresql_concurrently=True, if_exists=True)
+    
+    op.drop_column('generations', 'prompt_tsv')
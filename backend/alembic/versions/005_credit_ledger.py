@@ -0,0 +1,52 @@
+"""Append-only credit ledger
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('credit_ledger',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('generation_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('credits_used_after', sa.Integer(), nullable=False),
+        sa.Column('credits_limit', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(length=200), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_credit_ledger_user_id_created_at', 'credit_ledger', ['user_id', 'created_at'])
+    
+    # Rows are never rewritten
+    op.execute("""
+        CREATE OR REPLACE FUNCTION credit_ledger_append_only() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'credit_ledger is append-only';
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER credit_ledger_no_update
+            BEFORE UPDATE ON credit_ledger
+            FOR EACH ROW EXECUTE FUNCTION credit_ledger_append_only()
+    """)
+
+
+def downgrade():
+    op.drop_table('credit_ledger')
+    op.execute("DROP FUNCTION IF EXISTS credit_ledger_append_only()")
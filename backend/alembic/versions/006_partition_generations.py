@@ -0,0 +1,129 @@
+"""Range-partition generations by created_at month
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 00:00:00.000000
+
+Rebuilds the table as a partitioned one and copies every row, under an
+exclusive lock: run it in a maintenance window. The primary key becomes
+(id, created_at), and whatsapp_messages.generation_id loses its foreign key
+(a partitioned table cannot have a unique key without the partition key).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def _copy_rows(source, target):
+    """INSERT ... SELECT of every column except generated ones (prompt_tsv)"""
+    op.execute(f"""
+        DO $$
+        DECLARE cols text;
+        BEGIN
+            SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = '{source}'
+              AND is_generated = 'NEVER';
+            EXECUTE format('INSERT INTO {target} (%1$s) SELECT %1$s FROM {source}', cols);
+        END $$
+    """)
+
+
+def _replace_table(partitioned):
+    """Swap generations for a copy, partitioned or plain"""
+    op.execute("UPDATE generations SET created_at = now() WHERE created_at IS NULL")
+    op.execute("ALTER TABLE generations RENAME TO generations_old")
+
+    op.execute(
+        "CREATE TABLE generations (LIKE generations_old INCLUDING DEFAULTS INCLUDING GENERATED)"
+        + (" PARTITION BY RANGE (created_at)" if partitioned else "")
+    )
+    op.execute("ALTER TABLE generations ALTER COLUMN created_at SET NOT NULL")
+
+    if partitioned:
+        # Monthly partitions from the oldest row through MONTHS_AHEAD months ahead
+        op.execute(f"""
+            DO $$
+            DECLARE
+                month date;
+                last_month date := (date_trunc('month', now()) + interval '{MONTHS_AHEAD} months')::date;
+            BEGIN
+                SELECT date_trunc('month', coalesce(min(created_at), now()))::date INTO month FROM generations_old;
+                WHILE month <= last_month LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF generations FOR VALUES FROM (%L) TO (%L)',
+                        'generations_' || to_char(month, '"y"YYYY"m"MM'),
+                        month,
+                        (month + interval '1 month')::date
+                    );
+                    month := (month + interval '1 month')::date;
+                END LOOP;
+            END $$
+        """)
+        op.execute("CREATE TABLE generations_default PARTITION OF generations DEFAULT")
+
+    _copy_rows('generations_old', 'generations')
+
+    # Keep the id sequence when the old table goes away
+    op.execute("ALTER SEQUENCE generations_id_seq OWNED BY generations.id")
+    op.execute("DROP TABLE generations_old")
+
+    op.create_primary_key(
+        'generations_pkey', 'generations',
+        ['id', 'created_at'] if partitioned else ['id']
+    )
+    op.create_foreign_key('generations_user_id_fkey', 'generations', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('generations_template_id_fkey', 'generations', 'templates', ['template_id'], ['id'])
+
+    # Same indexes as 001/002/004, built once after the copy
+    op.create_index('ix_generations_id', 'generations', ['id'])
+    op.create_index(
+        'ix_generations_user_id_created_at',
+        'generations',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')]
+    )
+    op.create_index('ix_generations_user_id_status', 'generations', ['user_id', 'status'])
+    op.create_index(
+        'ix_generations_completed_created_at',
+        'generations',
+        ['created_at', 'id'],
+        postgresql_where=sa.text("status = 'completed'")
+    )
+    op.create_index(
+        'ix_generations_prompt_trgm',
+        'generations',
+        ['prompt'],
+        postgresql_using='gin',
+        postgresql_ops={'prompt': 'gin_trgm_ops'}
+    )
+    op.create_index('ix_generations_prompt_tsv', 'generations', ['prompt_tsv'], postgresql_using='gin')
+
+    op.execute("ANALYZE generations")
+
+
+def upgrade():
+    op.drop_constraint('whatsapp_messages_generation_id_fkey', 'whatsapp_messages', type_='foreignkey')
+    _replace_table(partitioned=True)
+
+
+def downgrade():
+    _replace_table(partitioned=False)
+
+    # Links to generations that retention dropped with their partition
+    op.execute(
+        "UPDATE whatsapp_messages m SET generation_id = NULL "
+        "WHERE generation_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM generations g WHERE g.id = m.generation_id)"
+    )
+    op.create_foreign_key(
+        'whatsapp_messages_generation_id_fkey', 'whatsapp_messages', 'generations',
+        ['generation_id'], ['id']
+    )
@@ -0,0 +1,53 @@
+"""Hashed integration API keys
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 00:00:00.000000
+
+Existing users.api_key values move to api_keys as SHA-256 hashes and the
+plaintext column is dropped. A downgrade cannot bring the keys back.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_keys',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('prefix', sa.String(length=16), nullable=False),
+        sa.Column('key_hash', sa.String(length=64), nullable=False),
+        sa.Column('rate_limit_per_minute', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_api_keys_key_hash', 'api_keys', ['key_hash'], unique=True)
+    op.create_index('ix_api_keys_user_id', 'api_keys', ['user_id'])
+
+    # Same digest as core.security.hash_api_key
+    op.execute("""
+        INSERT INTO api_keys (user_id, name, prefix, key_hash)
+        SELECT id, 'default', left(api_key, 12), encode(sha256(convert_to(api_key, 'UTF8')), 'hex')
+        FROM users
+        WHERE api_key IS NOT NULL
+    """)
+
+    op.execute("DROP INDEX IF EXISTS ix_users_api_key")
+    op.drop_column('users', 'api_key')
+
+
+def downgrade():
+    op.add_column('users', sa.Column('api_key', sa.String(length=100), nullable=True))
+    op.drop_table('api_keys')
@@ -0,0 +1,40 @@
+"""Unique Twilio MessageSid on whatsapp_messages
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # Inbound dedup: one row per MessageSid (ON CONFLICT DO NOTHING)
+        op.create_index(
+            'ix_whatsapp_messages_message_sid',
+            'whatsapp_messages',
+            ['message_sid'],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_whatsapp_messages_message_sid',
+            table_name='whatsapp_messages',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -0,0 +1,28 @@
+"""Outbound delivery attempts on whatsapp_messages
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Constant default: no table rewrite on PostgreSQL 11+
+    op.add_column(
+        'whatsapp_messages',
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_column('whatsapp_messages', 'attempts')
@@ -0,0 +1,57 @@
+"""Retention sweep index over generations of every status
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 00:00:00.000000
+
+Retention now deletes expired generations whatever their status (a
+dropped partition cannot keep some of its rows), so the sweep's keyset
+index is no longer partial. The index is created on the parent only and
+built concurrently on each partition, then attached: no long lock on
+generations.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def _partitions():
+    return [
+        name for (name,) in op.get_bind().execute(sa.text(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'generations'::regclass
+            """
+        ))
+    ]
+
+
+def _build_index(name, columns, where=None):
+    """Parent index ON ONLY, per-partition indexes CONCURRENTLY, then ATTACH"""
+    predicate = f" WHERE {where}" if where else ""
+    op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY generations ({columns}){predicate}")
+    for partition in _partitions():
+        child = f"{name}_{partition.removeprefix('generations_')}"
+        op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child}" ON "{partition}" ({columns}){predicate}')
+        op.execute(f'ALTER INDEX {name} ATTACH PARTITION "{child}"')
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        _build_index('ix_generations_created_at_id', 'created_at, id')
+        op.drop_index('ix_generations_completed_created_at', table_name='generations', if_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        _build_index('ix_generations_completed_created_at', 'created_at, id', where="status = 'completed'")
+        op.drop_index('ix_generations_created_at_id', table_name='generations', if_exists=True)
@@ -1,26 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from typing import Dict, Any
+import redis
+from typing import Dict, Any, List
 
-from core.database import get_db
+from core.api_keys import forget_api_key
+from core.current_user import UserSnapshot, get_authenticated_user
+from core.database import get_db, get_async_db
 from core.security import (
-    verify_password, 
-    get_password_hash, 
+    hash_password,
+    verify_and_update_password,
     create_access_token,
-    get_current_user
+    get_current_user,
+    generate_api_key,
+    hash_api_key
 )
 from core.config import settings
-from models.user import User, PlanType
+from core.token_revocation import revoke_token, revoke_user_tokens
+from models.user import User, PlanType, ApiKey
 from schemas.user import (
     UserCreate, 
     UserResponse, 
     Token, 
     UserUpdate,
-    UserStats
+    UserStats,
+    ApiKeyCreate,
+    ApiKeyResponse,
+    ApiKeyCreated
 )
-import secrets
 
 router = APIRouter()
 
@@ -28,7 +38,7 @@ router = APIRouter()
 async def register(
     user_data: UserCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Registra um novo usuário.
@@ -37,10 +47,12 @@ async def register(
         Token de acesso e dados do usuário
     """
     # Verificar se usuário já existe
-    existing_user = db.query(User).filter(
-        (User.email == user_data.email) | 
-        (User.cpf_cnpj == user_data.cpf_cnpj)
-    ).first()
+    existing_user = await db.scalar(
+        select(User).where(
+            (User.email == user_data.email) | 
+            (User.cpf_cnpj == user_data.cpf_cnpj)
+        ).limit(1)
+    )
     
     if existing_user:
         if existing_user.email == user_data.email:
@@ -55,10 +67,7 @@ async def register(
             )
     
     # Criar novo usuário
-    hashed_password = get_password_hash(user_data.password)
-    
-    # Gerar chave API
-    api_key = secrets.token_urlsafe(32)
+    hashed_password = await hash_password(user_data.password)
     
     # Definir fim do período de trial (7 dias)
     trial_ends_at = datetime.utcnow() + timedelta(days=7)
@@ -73,14 +82,13 @@ async def register(
         business_sector=user_data.business_sector,
         plan_type=PlanType.TRIAL,
         credits_limit=10,  # 10 gerações no trial
-        api_key=api_key,
         trial_ends_at=trial_ends_at,
         is_active=True
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # Criar token de acesso
     access_token = create_access_token(
@@ -99,7 +107,7 @@ async def register(
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Login de usuário.
@@ -107,9 +115,13 @@ async def login(
     Returns:
         Token de acesso e dados do usuário
     """
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = await db.scalar(select(User).where(User.email == form_data.username))
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email ou senha incorretos",
@@ -122,9 +134,14 @@ async def login(
             detail="Conta desativada"
         )
     
+    # Hash com parâmetros antigos: regravar com os atuais
+    if new_hash:
+        user.hashed_password = new_hash
+    
     # Atualizar último login
     user.last_login_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    await db.refresh(user)
     
     # Criar token
     access_token = create_access_token(
@@ -139,24 +156,15 @@ async def login(
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_authenticated_user)
 ):
     """
-    Retorna informações do usuário atual.
+    Retorna informações do usuário atual (do cache de snapshots).
     """
-    user = db.query(User).filter(User.email == current_user.get("sub")).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Usuário não encontrado"
-        )
-    
-    return UserResponse.from_orm(user)
+    return UserResponse.from_orm(current_user)
 
 @router.put("/me", response_model=UserResponse)
-async def update_current_user(
+def update_current_user(
     user_data: UserUpdate,
     current_user: Dict[str, Any] = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -164,7 +172,7 @@ async def update_current_user(
     """
     Atualiza informações do usuário atual.
     """
-    user = db.query(User).filter(User.email == current_user.get("sub")).first()
+    user = db.get(User, current_user.get("user_id"))
     
     if not user:
         raise HTTPException(
@@ -183,14 +191,14 @@ async def update_current_user(
     return UserResponse.from_orm(user)
 
 @router.get("/me/stats", response_model=UserStats)
-async def get_user_stats(
+def get_user_stats(
     current_user: Dict[str, Any] = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Retorna estatísticas do usuário atual.
     """
-    user = db.query(User).filter(User.email == current_user.get("sub")).first()
+    user = db.get(User, current_user.get("user_id"))
     
     if not user:
         raise HTTPException(
@@ -208,18 +216,43 @@ async def get_user_stats(
         templates_count=len(user.templates)
     )
 
+def _revocation_failed():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Não foi possível encerrar a sessão, tente novamente"
+    )
+
 @router.post("/logout")
-async def logout(
+def logout(
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
-    Logout do usuário.
-    Em uma implementação real, invalidaríamos o token.
+    Logout do usuário: revoga o token usado na requisição.
     """
+    try:
+        revoke_token(current_user)
+    except redis.RedisError:
+        raise _revocation_failed()
+    
     return {"message": "Logout realizado com sucesso"}
 
+@router.post("/logout-all")
+def logout_all(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Encerra todas as sessões do usuário (todos os tokens emitidos até agora).
+    """
+    
+    try:
+        revoke_user_tokens(current_user.get("user_id"))
+    except redis.RedisError:
+        raise _revocation_failed()
+    
+    return {"message": "Todas as sessões foram encerradas"}
+
 @router.post("/reset-password")
-async def request_password_reset(
+def request_password_reset(
     email: str,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
@@ -243,4 +276,115 @@ async def validate_token(
     """
     Valida se o token atual é válido.
     """
-    return {"valid": True, "user_id": current_user.get("user_id")}
\ No newline at end of file
+    return {"valid": True, "user_id": current_user.get("user_id")}
+
+# Chaves de API para integrações
+def _active_api_keys(db: Session, user_id: int):
+    now = datetime.utcnow()
+    return db.query(ApiKey).filter(
+        ApiKey.user_id == user_id,
+        ApiKey.revoked_at.is_(None),
+        (ApiKey.expires_at.is_(None)) | (ApiKey.expires_at > now)
+    )
+
+def _get_api_key(db: Session, user_id: int, key_id: int) -> ApiKey:
+    api_key = _active_api_keys(db, user_id).filter(ApiKey.id == key_id).first()
+    
+    if not api_key:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chave de API não encontrada"
+        )
+    
+    return api_key
+
+def _new_api_key(user_id: int, name: str, rate_limit_per_minute=None):
+    """Cria a chave; retorna (linha, chave em texto claro)"""
+    key = generate_api_key()
+    api_key = ApiKey(
+        user_id=user_id,
+        name=name,
+        prefix=key[:12],
+        key_hash=hash_api_key(key),
+        rate_limit_per_minute=rate_limit_per_minute
+    )
+    return api_key, key
+
+@router.get("/api-keys", response_model=List[ApiKeyResponse])
+def list_api_keys(
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Lista as chaves de API ativas (incluindo as que estão em rotação).
+    """
+    
+    return _active_api_keys(db, current_user.get("user_id")).order_by(ApiKey.created_at).all()
+
+@router.post("/api-keys", response_model=ApiKeyCreated, status_code=status.HTTP_201_CREATED)
+def create_api_key(
+    key_data: ApiKeyCreate,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Cria uma chave de API. O valor só é retornado nesta resposta.
+    """
+    user_id = current_user.get("user_id")
+    
+    if _active_api_keys(db, user_id).count() >= settings.API_KEYS_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Limite de {settings.API_KEYS_PER_USER} chaves de API atingido"
+        )
+    
+    api_key, key = _new_api_key(user_id, key_data.name)
+    db.add(api_key)
+    db.commit()
+    db.refresh(api_key)
+    
+    return ApiKeyCreated(**ApiKeyResponse.from_orm(api_key).dict(), key=key)
+
+@router.post("/api-keys/{key_id}/rotate", response_model=ApiKeyCreated, status_code=status.HTTP_201_CREATED)
+def rotate_api_key(
+    key_id: int,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Substitui uma chave de API.
+    
+    A chave antiga continua válida por API_KEY_ROTATION_GRACE_HOURS,
+    tempo para a integração trocar de chave sem parar.
+    """
+    old_key = _get_api_key(db, current_user.get("user_id"), key_id)
+    
+    grace_ends_at = datetime.utcnow() + timedelta(hours=settings.API_KEY_ROTATION_GRACE_HOURS)
+    if old_key.expires_at is None or old_key.expires_at > grace_ends_at:
+        old_key.expires_at = grace_ends_at
+    
+    api_key, key = _new_api_key(old_key.user_id, old_key.name, old_key.rate_limit_per_minute)
+    db.add(api_key)
+    db.commit()
+    db.refresh(api_key)
+    forget_api_key(old_key.key_hash)
+    
+    return ApiKeyCreated(**ApiKeyResponse.from_orm(api_key).dict(), key=key)
+
+@router.delete("/api-keys/{key_id}", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_api_key(
+    key_id: int,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Revoga uma chave de API imediatamente.
+    
+    Outros processos da API podem aceitá-la por até API_KEY_CACHE_TTL
+    segundos.
+    """
+    api_key = _get_api_key(db, current_user.get("user_id"), key_id)
+    
+    api_key.revoked_at = datetime.utcnow()
+    db.commit()
+    forget_api_key(api_key.key_hash)
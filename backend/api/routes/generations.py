@@ -1,42 +1,110 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, BackgroundTasks
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse, Response
+from sqlalchemy.orm import Session, joinedload, undefer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, tuple_
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import io
+import os
+import time
 
-from core.database import get_db
-from core.security import get_current_user
-from models.user import User
+from core.config import settings
+from core.database import get_db, get_read_db, SessionLocal
+from core.pagination import (
+    encode_cursor,
+    decode_cursor,
+    exact_count,
+    cached_count,
+    estimated_count,
+    invalidate_count
+)
+from core.current_user import UserSnapshot, get_authenticated_user, get_authenticated_user_or_api_key
+from core.security import get_current_user, get_current_user_or_api_key
 from models.generation import Generation
+from services.storage_service import StorageService
+from services.media_service import MediaService
+from services.generation_stats import get_user_stats
+from services.generation_search import PromptSearch
+from services.credit_service import CreditService, InsufficientCredits
 from schemas.generation import (
     GenerationCreate,
     GenerationResponse,
+    GenerationListItem,
     GenerationListResponse,
     GenerationStats
 )
 
 router = APIRouter()
 
+# Columns behind a list card (GenerationListItem)
+LIST_COLUMNS = [
+    Generation.id,
+    Generation.prompt,
+    Generation.template_id,
+    Generation.style,
+    Generation.input_type,
+    Generation.status,
+    Generation.image_url,
+    Generation.thumbnail_url,
+    Generation.downloads,
+    Generation.shares,
+    Generation.created_at,
+    Generation.completed_at,
+]
+
+# Extra list fields available through fields=
+LIST_EXTRA_FIELDS = {
+    "user_id": Generation.user_id,
+    "credits_used": Generation.credits_used,
+    "processing_time": Generation.processing_time,
+    "error_message": Generation.error_message,
+    "meta": Generation.meta,
+    "updated_at": Generation.updated_at,
+}
+
 @router.post("/", response_model=GenerationResponse, status_code=status.HTTP_201_CREATED)
-async def create_generation(
+def create_generation(
     data: GenerationCreate,
-    current_user: dict = Depends(get_current_user),
+    user: UserSnapshot = Depends(get_authenticated_user_or_api_key),
     db: Session = Depends(get_db)
 ):
     """
     Create a new generation manually (via web dashboard)
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    if not user.has_active_subscription:
+        raise HTTPException(
+            status_code=400,
+            detail="No credits available. Please upgrade your plan."
+        )
     
-    # Check if user has credits
-    if not user.can_generate():
+    # Get user's preferred style
+    style = user.business_sector or "modern"
+    
+    # Create the record and reserve its credit in one short transaction
+    generation = Generation(
+        user_id=user.id,
+        prompt=data.prompt,
+        input_type="web",
+        status="processing",
+        template_id=data.template_id,
+        style=style,
+        credits_used=1
+    )
+    db.add(generation)
+    db.flush()
+    
+    credits = CreditService(db)
+    try:
+        credits.reserve(user.id, generation_id=generation.id, reason="web generation")
+    except InsufficientCredits:
+        db.rollback()
         raise HTTPException(
             status_code=400,
             detail="No credits available. Please upgrade your plan."
         )
+    db.commit()
+    invalidate_count("generations", user.id)
     
     # Generate art
     from services.gemini_service import GeminiService
@@ -45,34 +113,19 @@ async def create_generation(
     try:
         gemini_service = GeminiService(api_key=settings.GEMINI_API_KEY)
         
-        # Get user's preferred style
-        style = user.business_sector or "modern"
-        
         # Generate image (mock for now)
+        started = time.monotonic()
         result = gemini_service.generate_promotional_image(
             prompt=data.prompt,
             business_type=style,
             template_type=data.template_id
         )
         
-        # Create generation record
-        generation = Generation(
-            user_id=user.id,
-            prompt=data.prompt,
-            input_type="web",
-            status="completed",
-            image_url=result["image_url"],
-            template_id=data.template_id,
-            style=style,
-            credits_used=1,
-            meta=result
-        )
-        
-        db.add(generation)
-        
-        # Update user credits
-        user.credits_used += 1
-        user.updated_at = datetime.utcnow()
+        generation.status = "completed"
+        generation.image_url = result["image_url"]
+        generation.processing_time = time.monotonic() - started
+        generation.completed_at = datetime.utcnow()
+        generation.meta = result
         
         db.commit()
         db.refresh(generation)
@@ -80,16 +133,13 @@ async def create_generation(
         return GenerationResponse.from_orm(generation)
         
     except Exception as e:
-        # Create failed generation record
-        generation = Generation(
-            user_id=user.id,
-            prompt=data.prompt,
-            input_type="web",
-            status="failed",
-            error_message=str(e),
-            credits_used=0
-        )
-        db.add(generation)
+        db.rollback()
+        
+        # Mark the generation as failed and give the credit back
+        generation.status = "failed"
+        generation.error_message = str(e)
+        generation.credits_used = 0
+        credits.refund(user.id, generation_id=generation.id, reason="generation failed")
         db.commit()
         
         raise HTTPException(
@@ -97,78 +147,144 @@ async def create_generation(
             detail=f"Failed to generate art: {str(e)}"
         )
 
-@router.get("/", response_model=GenerationListResponse)
+@router.get("/", response_model=GenerationListResponse, response_model_exclude_unset=True)
 async def get_generations(
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: UserSnapshot = Depends(get_authenticated_user_or_api_key),
+    db: AsyncSession = Depends(get_read_db(get_current_user_or_api_key)),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from next_cursor; enables keyset pagination"),
+    pagination: str = Query("offset", regex="^(offset|cursor)$"),
+    count: str = Query("cached", regex="^(exact|cached|estimated|none)$"),
     status_filter: Optional[str] = Query(None),
-    search: Optional[str] = Query(None),
+    search: Optional[str] = Query(None, max_length=200),
+    sort: str = Query("recent", regex="^(recent|relevance)$"),
     start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None)
+    end_date: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated extra fields, e.g. meta,error_message")
 ):
     """
     Get user's generations with pagination and filters
+
+    Pass ``pagination=cursor`` (or any ``cursor``) to page by
+    ``(created_at, id)`` instead of OFFSET; follow ``next_cursor`` until
+    ``has_more`` is false. ``count`` picks how ``total`` is computed:
+    ``cached`` (default, exact count cached for a minute), ``exact``,
+    ``estimated`` (planner estimate) or ``none``.
+
+    ``search`` matches Portuguese words (stemmed, ranked) and substrings of
+    the prompt; each result then carries an HTML ``highlight``.
+    ``sort=relevance`` orders by rank and uses offset pagination.
+
+    Items only carry the columns a list card needs; ``fields`` adds any of
+    LIST_EXTRA_FIELDS (``meta`` is otherwise only on the detail endpoint).
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    extra_fields = _parse_fields(fields)
+    user_id = user.id
     
-    query = db.query(Generation).filter(Generation.user_id == user.id)
+    query = select(
+        *LIST_COLUMNS,
+        *[LIST_EXTRA_FIELDS[field] for field in extra_fields]
+    ).where(Generation.user_id == user_id)
     
     # Apply filters
     if status_filter:
-        query = query.filter(Generation.status == status_filter)
-    
-    if search:
-        query = query.filter(
-            (Generation.prompt.ilike(f"%{search}%")) |
-            (Generation.id == search if search.isdigit() else False)
+        query = query.where(Generation.status == status_filter)
+    
+    prompt_search = PromptSearch(search) if search else None
+    if prompt_search:
+        query = query.where(prompt_search.condition())
+    
+    start = _parse_datetime(start_date)
+    if start:
+        query = query.where(Generation.created_at >= start)
+    
+    end = _parse_datetime(end_date)
+    if end:
+        query = query.where(Generation.created_at <= end)
+    
+    # Total count (the filtered query, before any cursor/offset)
+    total = None
+    if count == "exact":
+        total = await exact_count(db, query, Generation.id)
+    elif count == "cached":
+        total = await cached_count(
+            db, query, Generation.id, "generations", user_id,
+            status=status_filter, search=search, start_date=start_date, end_date=end_date
+        )
+    elif count == "estimated":
+        total = await estimated_count(db, query)
+    
+    if prompt_search:
+        # Highlight fragments for the returned page only
+        query = query.add_columns(prompt_search.headline().label("headline"))
+    
+    if prompt_search and sort == "relevance":
+        if cursor or pagination == "cursor":
+            raise HTTPException(status_code=400, detail="Cursor pagination requires sort=recent")
+        ordered = query.order_by(prompt_search.rank().desc(), Generation.created_at.desc(), Generation.id.desc())
+    else:
+        ordered = query.order_by(Generation.created_at.desc(), Generation.id.desc())
+    
+    def to_response(row) -> GenerationListItem:
+        generation = GenerationListItem.from_orm(row)
+        if prompt_search:
+            generation.highlight = prompt_search.highlight(row.prompt, row.headline)
+        return generation
+    
+    if cursor or pagination == "cursor":
+        # Keyset pagination: seek past the last row of the previous page
+        if cursor:
+            position = decode_cursor(cursor)
+            if not position:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            ordered = ordered.where(tuple_(Generation.created_at, Generation.id) < position)
+        
+        # One extra row tells whether another page exists
+        rows = (await db.execute(ordered.limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last = rows[-1] if rows else None
+        
+        return GenerationListResponse(
+            generations=[to_response(row) for row in rows],
+            total=total,
+            total_is_estimate=count == "estimated",
+            page=None,
+            page_size=limit,
+            total_pages=None,
+            next_cursor=encode_cursor(last.created_at, last.id) if has_more else None,
+            has_more=has_more
         )
     
-    if start_date:
-        try:
-            start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            query = query.filter(Generation.created_at >= start)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            query = query.filter(Generation.created_at <= end)
-        except ValueError:
-            pass
-    
-    # Get total count
-    total = query.count()
-    
-    # Apply pagination
+    # Offset pagination (fallback for page-number UIs)
     offset = (page - 1) * limit
-    generations = query.order_by(Generation.created_at.desc()).offset(offset).limit(limit).all()
+    rows = (await db.execute(ordered.offset(offset).limit(limit))).all()
     
     return GenerationListResponse(
-        generations=[GenerationResponse.from_orm(g) for g in generations],
+        generations=[to_response(row) for row in rows],
         total=total,
+        total_is_estimate=count == "estimated",
         page=page,
         page_size=limit,
-        total_pages=(total + limit - 1) // limit
+        total_pages=(total + limit - 1) // limit if total is not None else None,
+        next_cursor=None,
+        has_more=len(rows) == limit and (total is None or offset + limit < total)
     )
 
 @router.get("/{generation_id}", response_model=GenerationResponse)
 async def get_generation(
     generation_id: int,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db(get_current_user))
 ):
     """
     Get a specific generation
     """
-    generation = db.query(Generation).filter(
+    generation = await db.scalar(select(Generation).options(undefer(Generation.meta)).where(
         Generation.id == generation_id,
         Generation.user_id == current_user.get("user_id")
-    ).first()
+    ))
     
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found")
@@ -178,17 +294,22 @@ async def get_generation(
 @router.get("/{generation_id}/download")
 async def download_generation(
     generation_id: int,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user_or_api_key),
+    db: AsyncSession = Depends(get_read_db(get_current_user_or_api_key))
 ):
     """
     Download generation image
+
+    Serves the file from local storage (with ETag / Range support) or
+    redirects to a presigned URL when S3 is in use.
     """
-    generation = db.query(Generation).filter(
+    generation = await db.scalar(select(Generation).where(
         Generation.id == generation_id,
         Generation.user_id == current_user.get("user_id"),
         Generation.status == "completed"
-    ).first()
+    ))
     
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found or not completed")
@@ -196,12 +317,73 @@ async def download_generation(
     if not generation.image_url:
         raise HTTPException(status_code=404, detail="Image not available")
     
-    # In production, download from S3/CDN
-    # For now, return the URL
-    return {"url": generation.image_url}
+    storage = StorageService()
+    cache_control = f"private, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+    download_name = f"nexusart-{generation.id}{os.path.splitext(generation.file_key or '')[1]}"
+    
+    # Images generated elsewhere (no storage key) or stored on S3 are never proxied
+    if not generation.file_key or storage.use_s3:
+        if generation.file_key:
+            url = storage.get_presigned_url(generation.file_key, download_name=download_name)
+        else:
+            url = generation.image_url
+        background_tasks.add_task(_increment_downloads, generation.id)
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    
+    response = MediaService(storage).serve(
+        request,
+        generation.file_key,
+        cache_control=cache_control,
+        download_name=download_name
+    )
+    
+    # Count a download once per transfer, not once per resumed chunk
+    content_range = response.headers.get("content-range", "")
+    if response.status_code == status.HTTP_200_OK or content_range.startswith("bytes 0-"):
+        background_tasks.add_task(_increment_downloads, generation.id)
+    
+    return response
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate the fields= list of extra list columns"""
+    if not fields:
+        return []
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in LIST_EXTRA_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(LIST_EXTRA_FIELDS)})"
+        )
+    return list(dict.fromkeys(requested))
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO date filter into a naive UTC datetime (None if invalid)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _increment_downloads(generation_id: int):
+    """Bump the download counter after the response has been sent"""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Generation)
+            .where(Generation.id == generation_id)
+            .values(downloads=func.coalesce(Generation.downloads, 0) + 1)
+        )
+        db.commit()
+    finally:
+        db.close()
 
 @router.post("/{generation_id}/share")
-async def share_generation(
+def share_generation(
     generation_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -232,7 +414,7 @@ async def share_generation(
     }
 
 @router.delete("/{generation_id}")
-async def delete_generation(
+def delete_generation(
     generation_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -250,22 +432,19 @@ async def delete_generation(
     
     db.delete(generation)
     db.commit()
+    invalidate_count("generations", generation.user_id)
     
     return {"success": True, "message": "Generation deleted"}
 
 @router.get("/stats/summary", response_model=GenerationStats)
 async def get_generation_stats(
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: UserSnapshot = Depends(get_authenticated_user),
+    db: AsyncSession = Depends(get_read_db(get_current_user)),
     period: str = Query("month", regex="^(day|week|month|year)$")
 ):
     """
     Get generation statistics for the user
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     now = datetime.utcnow()
     
     # Calculate time range
@@ -279,53 +458,14 @@ async def get_generation_stats(
     else:  # year
         start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # Query stats
-    total_generations = db.query(Generation).filter(
-        Generation.user_id == user.id
-    ).count()
-    
-    period_generations = db.query(Generation).filter(
-        Generation.user_id == user.id,
-        Generation.created_at >= start_date
-    ).count()
-    
-    successful_generations = db.query(Generation).filter(
-        Generation.user_id == user.id,
-        Generation.status == "completed"
-    ).count()
-    
-    failed_generations = db.query(Generation).filter(
-        Generation.user_id == user.id,
-        Generation.status == "failed"
-    ).count()
-    
-    # Average processing time (mock for now)
-    avg_processing_time = 5.2
-    
-    # Credits used
-    total_credits_used = db.query(db.func.sum(Generation.credits_used)).filter(
-        Generation.user_id == user.id
-    ).scalar() or 0
-    
-    # Most used input type
-    input_type_stats = db.query(
-        Generation.input_type,
-        db.func.count(Generation.id).label('count')
-    ).filter(
-        Generation.user_id == user.id
-    ).group_by(Generation.input_type).all()
+    # One range scan over the user's daily rollup rows
+    stats = await get_user_stats(db, user.id, start_date.date())
     
     return GenerationStats(
-        total_generations=total_generations,
-        period_generations=period_generations,
-        successful_generations=successful_generations,
-        failed_generations=failed_generations,
+        **stats,
         success_rate=(
-            (successful_generations / total_generations * 100) 
-            if total_generations > 0 else 0
+            (stats["successful_generations"] / stats["total_generations"] * 100)
+            if stats["total_generations"] > 0 else 0
         ),
-        avg_processing_time=avg_processing_time,
-        total_credits_used=total_credits_used,
-        input_type_stats={it: count for it, count in input_type_stats},
         period=period
     )
\ No newline at end of file
@@ -0,0 +1,20 @@
+import posixpath
+
+from fastapi import APIRouter, HTTPException, Request, status
+
+from core.config import settings
+from services.media_service import MediaService
+
+router = APIRouter()
+
+@router.api_route("/{file_key:path}", methods=["GET", "HEAD"])
+async def serve_media(file_key: str, request: Request):
+    """
+    Serve an uploaded file with immutable cache headers and ETag
+    """
+    # Data exports share the S3 bucket (and, before ARCHIVE_DIR, the upload
+    # dir) with images but are never public
+    normalized = posixpath.normpath(file_key).lstrip("/")
+    if normalized.startswith(settings.RETENTION_ARCHIVE_PREFIX.rstrip("/") + "/"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return MediaService().serve(request, file_key)
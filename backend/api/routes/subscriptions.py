@@ -5,6 +5,7 @@ import stripe
 from datetime import datetime
 
 from core.database import get_db
+from core.current_user import UserSnapshot, get_authenticated_user
 from core.security import get_current_user
 from core.config import settings
 from models.user import User, PlanType
@@ -20,6 +21,8 @@ router = APIRouter()
 
 # Initialize Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
 
 PLANS = {
     "basic_monthly": {
@@ -101,21 +104,16 @@ async def get_plans():
     return plans
 
 @router.get("/current", response_model=SubscriptionResponse)
-async def get_current_subscription(
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+def get_current_subscription(
+    user: UserSnapshot = Depends(get_authenticated_user)
 ):
     """
     Get current user's subscription
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Get plan details
     plan_details = None
     for plan_id, plan_data in PLANS.items():
-        if plan_id.startswith(user.plan_type.value):
+        if plan_id.startswith(user.plan_type):
             plan_details = plan_data
             break
     
@@ -130,7 +128,7 @@ async def get_current_subscription(
     )
 
 @router.post("/", response_model=SubscriptionResponse)
-async def create_subscription(
+def create_subscription(
     data: CreateSubscriptionRequest,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db),
@@ -139,7 +137,7 @@ async def create_subscription(
     """
     Create a new subscription
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
+    user = db.get(User, current_user.get("user_id"))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -231,14 +229,14 @@ async def create_subscription(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/cancel")
-async def cancel_subscription(
+def cancel_subscription(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Cancel current subscription
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
+    user = db.get(User, current_user.get("user_id"))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -268,14 +266,14 @@ async def cancel_subscription(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/reactivate")
-async def reactivate_subscription(
+def reactivate_subscription(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Reactivate cancelled subscription
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
+    user = db.get(User, current_user.get("user_id"))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -305,18 +303,13 @@ async def reactivate_subscription(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/payment-method")
-async def update_payment_method(
+def update_payment_method(
     data: UpdatePaymentMethodRequest,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: UserSnapshot = Depends(get_authenticated_user)
 ):
     """
     Update payment method
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     if not user.subscription_id:
         raise HTTPException(
             status_code=400,
@@ -335,17 +328,12 @@ async def update_payment_method(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/invoices", response_model=List[InvoiceResponse])
-async def get_invoices(
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+def get_invoices(
+    user: UserSnapshot = Depends(get_authenticated_user)
 ):
     """
     Get subscription invoices
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Mock invoices for now
     invoices = [
         InvoiceResponse(
@@ -420,7 +408,7 @@ def get_stripe_price_id(plan_id: str, billing_cycle: str) -> str:
     key = f"{plan_id}_{billing_cycle}"
     return price_ids.get(key, f"price_{plan_id}")
 
-async def handle_payment_succeeded(invoice):
+def handle_payment_succeeded(invoice):
     """
     Handle successful payment
     """
@@ -436,7 +424,7 @@ async def handle_payment_succeeded(invoice):
         )
         db.commit()
 
-async def handle_payment_failed(invoice):
+def handle_payment_failed(invoice):
     """
     Handle failed payment
     """
@@ -449,7 +437,7 @@ async def handle_payment_failed(invoice):
         user.subscription_status = "past_due"
         db.commit()
 
-async def handle_subscription_deleted(subscription):
+def handle_subscription_deleted(subscription):
     """
     Handle subscription deletion
     """
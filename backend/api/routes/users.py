@@ -16,13 +16,13 @@ class OnboardingPayload(BaseModel):
 
 
 @router.post('/onboarding')
-async def onboarding(
+def onboarding(
     payload: OnboardingPayload,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Save onboarding settings: add whatsapp number (if allowed) and optionally store preferred style."""
-    user = db.query(User).filter(User.email == current_user.get('sub')).first()
+    user = db.get(User, current_user.get('user_id'))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Usuário não encontrado')
 
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from fastapi import Request, Form
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from datetime import datetime
 from typing import List, Optional
 import os
-from twilio.rest import Client
+import redis
 from twilio.request_validator import RequestValidator
 
-from core.database import get_db
+from core.database import SessionLocal, get_db
+from core.current_user import UserSnapshot, get_authenticated_user
 from core.security import get_current_user
 from core.config import settings
+from core.redis_client import get_async_redis
 from models.user import User
+from services.storage_service import celery_app
+from services.whatsapp_delivery import apply_status_updates, buffer_status_update, status_update
+from services.whatsapp_routing import is_unregistered, normalize_phone
+from services.whatsapp_sender import OutboundMessage, WhatsAppSendError, get_whatsapp_sender
 from schemas.whatsapp import (
     WhatsAppNumberCreate, 
     WhatsAppNumberResponse,
@@ -21,26 +29,19 @@ from schemas.whatsapp import (
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
-# Initialize Twilio client
-twilio_client = None
-if settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN:
-    twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-
 @router.post("/connect", response_model=WhatsAppNumberResponse)
-async def connect_whatsapp_number(
+def connect_whatsapp_number(
     data: WhatsAppNumberCreate,
-    current_user: dict = Depends(get_current_user),
+    user: UserSnapshot = Depends(get_authenticated_user),
     db: Session = Depends(get_db)
 ):
     """
     Connect a WhatsApp number to the user's account
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    from models.whatsapp import WhatsAppNumber
     
     # Check if user has reached WhatsApp number limit
-    current_numbers_count = len(user.whatsapp_numbers)
+    current_numbers_count = db.query(WhatsAppNumber).filter(WhatsAppNumber.user_id == user.id).count()
     if current_numbers_count >= user.whatsapp_numbers_limit:
         raise HTTPException(
             status_code=400,
@@ -48,12 +49,11 @@ async def connect_whatsapp_number(
         )
     
     # Validate phone number format
-    phone_number = data.phone_number
+    phone_number = normalize_phone(data.phone_number)
     if not phone_number.startswith("+"):
         phone_number = f"+55{phone_number}"  # Default to Brazil
     
     # Check if number already exists
-    from models.whatsapp import WhatsAppNumber
     existing_number = db.query(WhatsAppNumber).filter(
         WhatsAppNumber.phone_number == phone_number
     ).first()
@@ -77,34 +77,46 @@ async def connect_whatsapp_number(
     db.refresh(whatsapp_number)
     
     # Send verification code via WhatsApp
-    if twilio_client:
-        try:
-            message = twilio_client.messages.create(
-                body=f"Seu código de verificação NexusArt é: 123456\n\nUse este código para verificar seu número.",
-                from_='whatsapp:+14155238886',  # Twilio sandbox number
-                to=f'whatsapp:{phone_number}'
-            )
+    sender = get_whatsapp_sender()
+    if sender.configured:
+        result, = sender.deliver(OutboundMessage(
+            to=phone_number,
+            body=f"Seu código de verificação NexusArt é: 123456\n\nUse este código para verificar seu número."
+        ))
+        if isinstance(result, WhatsAppSendError):
+            # Log error but don't fail - number still saved
+            print(f"Failed to send WhatsApp message: {result}")
+        else:
             # Store verification code (in production, store securely)
             whatsapp_number.verification_code = "123456"  # Mock code
             whatsapp_number.verification_sent_at = datetime.utcnow()
             db.commit()
-        except Exception as e:
-            # Log error but don't fail - number still saved
-            print(f"Failed to send WhatsApp message: {e}")
     
     return WhatsAppNumberResponse.from_orm(whatsapp_number)
 
+INBOUND_TASK = "tasks.whatsapp_tasks.handle_inbound_message"
+
+# Empty TwiML: Twilio only needs a fast 200, replies go out from the workers
+EMPTY_TWIML = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Response></Response>"
+
+def _inbound_key(message_sid: str) -> str:
+    return f"whatsapp:inbound:{message_sid}"
+
 @router.post("/webhook")
-async def whatsapp_webhook(
-    background_tasks: BackgroundTasks,
-    request: Request,
-    From: str = Form(None),
-    Body: str = Form(None),
-    MediaUrl0: str = Form(None),
-    NumMedia: int = Form(0)
-):
+async def whatsapp_webhook(request: Request):
     """
     Webhook endpoint for receiving WhatsApp messages from Twilio
+    
+    Only validates the signature and enqueues a compact event; routing,
+    commands, credit checks, acknowledgements, transcription and
+    generation all run on the Celery workers.
+    
+    Twilio redelivers on timeouts: a MessageSid already seen is
+    acknowledged without enqueuing again. The worker dedups a second time
+    on the whatsapp_messages row, in case this key is lost.
+    
+    Senders the routing cache knows to be unregistered (they already got
+    the welcome message) are acknowledged and dropped here.
     """
     # Validate Twilio signature
     validator = RequestValidator(settings.TWILIO_AUTH_TOKEN)
@@ -119,167 +131,119 @@ async def whatsapp_webhook(
     if not validator.validate(url, params, signature):
         raise HTTPException(status_code=403, detail="Invalid signature")
     
-    # Find user by phone number
-    from models.whatsapp import WhatsAppNumber
-    db = next(get_db())
+    event = {
+        "message_sid": params.get("MessageSid"),
+        "phone": normalize_phone(params.get("From")),
+        "body": params.get("Body"),
+        "num_media": int(params.get("NumMedia") or 0),
+        "media_url": params.get("MediaUrl0"),
+        "media_type": params.get("MediaContentType0"),
+        "received_at": datetime.utcnow().isoformat()
+    }
     
-    whatsapp_number = db.query(WhatsAppNumber).filter(
-        WhatsAppNumber.phone_number == From,
-        WhatsAppNumber.is_active == True,
-        WhatsAppNumber.is_verified == True
-    ).first()
+    if await is_unregistered(event["phone"]):
+        return Response(content=EMPTY_TWIML, media_type="application/xml")
     
-    if not whatsapp_number:
-        # Number not registered, send welcome message
-        if twilio_client:
-            try:
-                twilio_client.messages.create(
-                    body="Olá! Para usar o NexusArt, primeiro registre-se em nexusart.com.br",
-                    from_='whatsapp:+14155238886',
-                    to=From
-                )
-            except:
-                pass
-        return {"status": "number_not_registered"}
+    redis_client = get_async_redis()
+    if event["message_sid"]:
+        try:
+            first_delivery = await redis_client.set(
+                _inbound_key(event["message_sid"]), 1,
+                nx=True, ex=settings.WHATSAPP_INBOUND_DEDUP_TTL
+            )
+            if not first_delivery:
+                return Response(content=EMPTY_TWIML, media_type="application/xml")
+        except redis.RedisError:
+            pass  # the worker still dedups on the database row
     
-    # Check if user has credits
-    user = whatsapp_number.user
-    if not user.can_generate():
-        if twilio_client:
+    try:
+        # By name, so the API never imports the task modules (and Whisper);
+        # publishing to the broker is blocking I/O: keep it off the event loop
+        await run_in_threadpool(celery_app.send_task, INBOUND_TASK, args=[event])
+    except Exception as e:
+        print(f"Failed to enqueue inbound message {event['message_sid']}: {e}")
+        # Let Twilio's retry through
+        if event["message_sid"]:
             try:
-                twilio_client.messages.create(
-                    body="❌ Seus créditos acabaram. Atualize seu plano em nexusart.com.br/plans",
-                    from_='whatsapp:+14155238886',
-                    to=From
-                )
-            except:
+                await redis_client.delete(_inbound_key(event["message_sid"]))
+            except redis.RedisError:
                 pass
-        return {"status": "no_credits"}
-    
-    # Process message
-    if NumMedia > 0 and MediaUrl0:
-        # Audio message
-        background_tasks.add_task(
-            process_audio_message,
-            MediaUrl0,
-            user.id,
-            From
-        )
-        response_message = "🎤 Processando seu áudio... Em segundos você receberá a arte!"
-    elif Body:
-        # Text message
-        if Body.strip().lower() in ["menu", "ajuda", "help"]:
-            # Send help menu
-            help_message = """
-🤖 *NexusArt - Menu de Ajuda*
-
-📱 *Como usar:*
-1. Digite ou grave um áudio com sua promoção
-2. Receba a arte pronta em segundos
-3. Compartilhe com seus clientes
-
-⚡ *Comandos rápidos:*
-• *menu* - Ver este menu
-• *creditos* - Ver créditos restantes
-• *plano* - Ver seu plano atual
-
-💡 *Dica:* Grave áudios para ser mais rápido!
-"""
-            if twilio_client:
-                twilio_client.messages.create(
-                    body=help_message,
-                    from_='whatsapp:+14155238886',
-                    to=From
-                )
-            return {"status": "help_sent"}
-        elif Body.strip().lower() in ["creditos", "créditos"]:
-            # Send credits info
-            credits_message = f"""
-💰 *Seus Créditos*
+        raise HTTPException(status_code=503, detail="Message queue unavailable")
+    
+    return Response(content=EMPTY_TWIML, media_type="application/xml")
 
-• Usados: {user.credits_used}
-• Limite: {user.credits_limit}
-• Restantes: {user.remaining_credits}
+def _apply_status_now(update: dict) -> None:
+    db = SessionLocal()
+    try:
+        apply_status_updates(db, [update])
+        db.commit()
+    finally:
+        db.close()
 
-Plano: {user.plan_type.value.capitalize()}
-"""
-            if twilio_client:
-                twilio_client.messages.create(
-                    body=credits_message,
-                    from_='whatsapp:+14155238886',
-                    to=From
-                )
-            return {"status": "credits_sent"}
-        else:
-            # Process text for generation
-            background_tasks.add_task(
-                process_text_message,
-                Body,
-                user.id,
-                From
-            )
-            response_message = "✍️ Processando sua mensagem... Arte chegando em instantes!"
+@router.post("/status")
+async def whatsapp_status_callback(request: Request):
+    """
+    Twilio status callback for outbound messages (StatusCallback URL)
     
-    # Send immediate response
-    if twilio_client and 'response_message' in locals():
-        try:
-            twilio_client.messages.create(
-                body=response_message,
-                from_='whatsapp:+14155238886',
-                to=From
-            )
-        except Exception as e:
-            print(f"Failed to send response: {e}")
+    Callbacks are buffered in Redis and applied to whatsapp_messages in
+    batches by tasks.whatsapp_tasks.flush_delivery_statuses; without
+    Redis the row is updated right away.
+    """
+    validator = RequestValidator(settings.TWILIO_AUTH_TOKEN)
+    params = await request.form()
+    
+    if not validator.validate(str(request.url), params, request.headers.get('X-Twilio-Signature', '')):
+        raise HTTPException(status_code=403, detail="Invalid signature")
     
-    return {"status": "processing"}
+    update = status_update(params)
+    if update is None:
+        return Response(status_code=204)
+    
+    try:
+        await buffer_status_update(update)
+    except redis.RedisError:
+        await run_in_threadpool(_apply_status_now, update)
+    
+    return Response(status_code=204)
 
 @router.get("/numbers", response_model=List[WhatsAppNumberResponse])
-async def get_whatsapp_numbers(
-    current_user: dict = Depends(get_current_user),
+def get_whatsapp_numbers(
+    user: UserSnapshot = Depends(get_authenticated_user),
     db: Session = Depends(get_db)
 ):
     """
     Get all WhatsApp numbers connected to user's account
     """
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    from models.whatsapp import WhatsAppNumber
     
-    return [WhatsAppNumberResponse.from_orm(num) for num in user.whatsapp_numbers]
+    numbers = db.query(WhatsAppNumber).filter(WhatsAppNumber.user_id == user.id).all()
+    return [WhatsAppNumberResponse.from_orm(num) for num in numbers]
 
 @router.post("/test")
-async def send_test_message(
+def send_test_message(
     data: WhatsAppTestRequest,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: UserSnapshot = Depends(get_authenticated_user)
 ):
     """
     Send a test WhatsApp message
     """
-    if not twilio_client:
+    sender = get_whatsapp_sender()
+    if not sender.configured:
         raise HTTPException(status_code=503, detail="WhatsApp service not configured")
     
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    result, = sender.deliver(OutboundMessage(to=data.phone_number, body=data.message))
+    if isinstance(result, WhatsAppSendError):
+        raise HTTPException(status_code=500, detail=f"Failed to send message: {str(result)}")
     
-    try:
-        message = twilio_client.messages.create(
-            body=data.message,
-            from_='whatsapp:+14155238886',
-            to=f'whatsapp:{data.phone_number}'
-        )
-        
-        return {
-            "success": True,
-            "message_sid": message.sid,
-            "status": message.status
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
+    return {
+        "success": True,
+        "message_sid": result.sid,
+        "status": result.status,
+        "latency_ms": round(result.latency_ms, 1)
+    }
 
 @router.delete("/numbers/{number_id}")
-async def disconnect_whatsapp_number(
+def disconnect_whatsapp_number(
     number_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -298,8 +262,10 @@ async def disconnect_whatsapp_number(
         raise HTTPException(status_code=404, detail="WhatsApp number not found")
     
     # Check if this is the last number (user must have at least one)
-    user = db.query(User).filter(User.id == current_user.get("user_id")).first()
-    if len(user.whatsapp_numbers) <= 1:
+    numbers_count = db.query(WhatsAppNumber).filter(
+        WhatsAppNumber.user_id == current_user.get("user_id")
+    ).count()
+    if numbers_count <= 1:
         raise HTTPException(
             status_code=400,
             detail="You must have at least one WhatsApp number connected"
@@ -309,169 +275,3 @@ async def disconnect_whatsapp_number(
     db.commit()
     
     return {"success": True, "message": "WhatsApp number disconnected"}
-
-# Background task functions
-async def process_audio_message(audio_url: str, user_id: int, from_number: str):
-    """
-    Process audio message and generate art
-    """
-    db = next(get_db())
-    
-    try:
-        # Download audio file
-        import aiohttp
-        import asyncio
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(audio_url) as response:
-                audio_data = await response.read()
-        
-        # Transcribe audio using Whisper
-        from services.audio_processor import AudioProcessor
-        audio_processor = AudioProcessor(model_size=settings.WHISPER_MODEL)
-        transcription = audio_processor.transcribe_audio(audio_data)
-        
-        # Generate art using transcription
-        await generate_and_send_art(transcription, user_id, from_number, "audio", db)
-        
-    except Exception as e:
-        print(f"Error processing audio: {e}")
-        # Send error message
-        if twilio_client:
-            try:
-                twilio_client.messages.create(
-                    body="❌ Ocorreu um erro ao processar seu áudio. Tente novamente ou envie um texto.",
-                    from_='whatsapp:+14155238886',
-                    to=from_number
-                )
-            except:
-                pass
-
-async def process_text_message(text: str, user_id: int, from_number: str):
-    """
-    Process text message and generate art
-    """
-    db = next(get_db())
-    
-    try:
-        await generate_and_send_art(text, user_id, from_number, "text", db)
-    except Exception as e:
-        print(f"Error processing text: {e}")
-        if twilio_client:
-            try:
-                twilio_client.messages.create(
-                    body="❌ Ocorreu um erro ao processar sua mensagem. Tente novamente.",
-                    from_='whatsapp:+14155238886',
-                    to=from_number
-                )
-            except:
-                pass
-
-async def generate_and_send_art(
-    prompt: str, 
-    user_id: int, 
-    phone_number: str,
-    input_type: str,
-    db: Session
-):
-    """
-    Generate art and send via WhatsApp
-    """
-    from services.gemini_service import GeminiService
-    from models.generation import Generation
-    from datetime import datetime
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return
-    
-    # Check credits again (in case changed during processing)
-    if not user.can_generate():
-        if twilio_client:
-            twilio_client.messages.create(
-                body="❌ Seus créditos acabaram. Atualize seu plano em nexusart.com.br/plans",
-                from_='whatsapp:+14155238886',
-                to=phone_number
-            )
-        return
-    
-    try:
-        # Generate art using Gemini
-        gemini_service = GeminiService(api_key=settings.GEMINI_API_KEY)
-        
-        # For now, mock the image generation
-        # In production, integrate with actual image generation API
-        image_url = f"https://via.placeholder.com/800x800/3b82f6/ffffff?text={prompt[:30]}"
-        
-        # Create generation record
-        generation = Generation(
-            user_id=user.id,
-            prompt=prompt,
-            input_type=input_type,
-            status="completed",
-            image_url=image_url,
-            credits_used=1
-        )
-        
-        db.add(generation)
-        
-        # Update user credits
-        user.credits_used += 1
-        user.updated_at = datetime.utcnow()
-        
-        db.commit()
-        
-        # Send image via WhatsApp
-        if twilio_client:
-            # First send a message
-            twilio_client.messages.create(
-                body="✅ Sua arte está pronta! Aqui está:",
-                from_='whatsapp:+14155238886',
-                to=phone_number
-            )
-            
-            # Then send the image (Twilio sandbox might have limitations)
-            try:
-                twilio_client.messages.create(
-                    media_url=[image_url],
-                    from_='whatsapp:+14155238886',
-                    to=phone_number
-                )
-            except:
-                # If can't send image, send link
-                twilio_client.messages.create(
-                    body=f"📎 Acesse sua arte: {image_url}",
-                    from_='whatsapp:+14155238886',
-                    to=phone_number
-                )
-            
-            # Send usage info
-            remaining = user.remaining_credits
-            twilio_client.messages.create(
-                body=f"💡 Créditos restantes: {remaining}",
-                from_='whatsapp:+14155238886',
-                to=phone_number
-            )
-        
-    except Exception as e:
-        print(f"Error generating art: {e}")
-        
-        # Update generation as failed
-        generation = Generation(
-            user_id=user.id,
-            prompt=prompt,
-            input_type=input_type,
-            status="failed",
-            error_message=str(e),
-            credits_used=0
-        )
-        db.add(generation)
-        db.commit()
-        
-        # Send error message
-        if twilio_client:
-            twilio_client.messages.create(
-                body="❌ Ocorreu um erro ao gerar sua arte. Tente novamente com um texto mais claro.",
-                from_='whatsapp:+14155238886',
-                to=phone_number
-            )
\ No newline at end of file
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import or_, select, update
+
+from core.config import settings
+from core.current_user import LocalCache
+from core.database import AsyncSessionLocal
+from core.security import hash_api_key
+from models.user import ApiKey
+
+# Chaves maiores que a coluna de origem não existem: rejeitadas sem hash
+API_KEY_MAX_LENGTH = 100
+
+@dataclass(frozen=True)
+class ApiKeyPrincipal:
+    """Chave resolvida: o que a autenticação e o rate limit precisam"""
+    key_id: int
+    user_id: int
+    rate_limit_per_minute: Optional[int]
+    expires_at: Optional[datetime]
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= datetime.utcnow()
+
+# Chaves conhecidas e desconhecidas ficam em LRUs separados, para que uma
+# enxurrada de chaves inválidas não expulse as válidas do cache
+_keys = LocalCache(settings.API_KEY_CACHE_SIZE, settings.API_KEY_CACHE_TTL)
+_unknown_keys = LocalCache(settings.API_KEY_CACHE_SIZE, settings.API_KEY_NEGATIVE_CACHE_TTL)
+
+async def resolve_api_key(api_key: str) -> Optional[ApiKeyPrincipal]:
+    """
+    Resolve uma chave de API pelo hash: cache local, depois o banco
+    (índice único em key_hash).
+
+    Chaves revogadas em outro processo continuam aceitas por até
+    API_KEY_CACHE_TTL segundos; a expiração de uma rotação é checada
+    a cada request.
+
+    Returns:
+        Principal da chave ou None se ela não existir, estiver revogada
+        ou expirada
+    """
+    if not api_key or len(api_key) > API_KEY_MAX_LENGTH:
+        return None
+
+    key_hash = hash_api_key(api_key)
+    principal = _keys.get(key_hash)
+    if principal is not None:
+        return None if principal.expired else principal
+
+    if _unknown_keys.get(key_hash):
+        return None
+
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(ApiKey.id, ApiKey.user_id, ApiKey.rate_limit_per_minute, ApiKey.expires_at)
+            .where(
+                ApiKey.key_hash == key_hash,
+                ApiKey.revoked_at.is_(None),
+                or_(ApiKey.expires_at.is_(None), ApiKey.expires_at > now)
+            )
+        )).first()
+
+        if row is None:
+            _unknown_keys.set(key_hash, True)
+            return None
+
+        # Só em cache miss: no máximo uma escrita por chave a cada API_KEY_CACHE_TTL
+        await db.execute(update(ApiKey).where(ApiKey.id == row.id).values(last_used_at=now))
+        await db.commit()
+
+    principal = ApiKeyPrincipal(
+        key_id=row.id,
+        user_id=row.user_id,
+        rate_limit_per_minute=row.rate_limit_per_minute,
+        expires_at=row.expires_at
+    )
+    _keys.set(key_hash, principal)
+    return principal
+
+def forget_api_key(key_hash: str) -> None:
+    """Descarta a chave do cache deste processo (revogação, rotação)"""
+    _keys.delete(key_hash)
+    _unknown_keys.delete(key_hash)
@@ -1,7 +1,12 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 import os
 
+def _asyncpg_url(url: str) -> str:
+    """Troca o driver de uma URL postgresql:// pelo asyncpg"""
+    scheme, _, rest = url.partition("://")
+    return f"postgresql+asyncpg://{rest}"
+
 class Settings(BaseSettings):
     # App
     APP_NAME: str = "NexusArt"
@@ -12,39 +17,155 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440
+    PASSWORD_HASH_ROUNDS: int = 29000  # pbkdf2_sha256; measure with scripts/benchmark_password_hash.py
+    PASSWORD_HASH_WORKERS: Optional[int] = None  # dedicated hashing threads; defaults to the CPU count
+    PASSWORD_HASH_MAX_PENDING: int = 32  # hashes running or queued before login/register answer 503
+    
+    # Token revocation (core/token_revocation.py)
+    TOKEN_REVOCATION_SYNC_SECONDS: float = 2.0  # a logout reaches the other API processes within this
+    TOKEN_REVOCATION_REBUILD_SECONDS: int = 600  # full Bloom filter rebuild, drops expired revocations
+    TOKEN_REVOCATION_CAPACITY: int = 100000  # revocations expected within ACCESS_TOKEN_EXPIRE_MINUTES
+    TOKEN_REVOCATION_ERROR_RATE: float = 0.001  # Bloom false positives, each costs one Redis lookup
     
     # Database
     DATABASE_URL: str = "postgresql://localhost/nexusart"
+    ASYNC_DATABASE_URL: Optional[str] = None  # defaults to DATABASE_URL with the asyncpg driver
+    ASYNC_DB_POOL_SIZE: int = 10
+    ASYNC_DB_MAX_OVERFLOW: int = 20
+    DATABASE_REPLICA_URL: Optional[str] = None  # read-only replica; reads stay on the primary when unset
+    ASYNC_DATABASE_REPLICA_URL: Optional[str] = None  # defaults to DATABASE_REPLICA_URL with the asyncpg driver
+    READ_YOUR_WRITES_SECONDS: int = 10  # keep a user's reads on the primary this long after they write
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    
+    # Authenticated user cache (core/current_user.py)
+    USER_CACHE_SIZE: int = 1024  # snapshots kept in each process
+    USER_CACHE_LOCAL_TTL: float = 5.0  # seconds; bounds staleness across processes
+    USER_CACHE_REDIS: bool = True  # shared Redis tier
+    USER_CACHE_TTL: int = 300  # seconds in Redis
+    
+    # Integration API keys (X-API-Key, core/api_keys.py)
+    API_KEYS_PER_USER: int = 5  # active keys per user
+    API_KEY_ROTATION_GRACE_HOURS: int = 24  # a rotated key keeps working this long
+    API_KEY_CACHE_SIZE: int = 4096  # resolved keys kept in each process
+    API_KEY_CACHE_TTL: float = 30.0  # seconds; bounds how long a revoked key works in other processes
+    API_KEY_NEGATIVE_CACHE_TTL: float = 10.0  # seconds an unknown key is rejected without a query
+    
+    # Rate limiting (core/rate_limit.py): "requests/seconds" per policy
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: Dict[str, str] = {
+        "auth_login": "10/60",  # per IP
+        "auth_register": "5/600",  # per IP
+        "whatsapp_webhook": "20/60",  # per phone number
+        "generations_create": "30/60",  # per user or API key (api_keys.rate_limit_per_minute overrides)
+    }
+    RATE_LIMIT_LOCAL_BUCKETS: int = 10000  # fallback token buckets kept per process
+    RATE_LIMIT_REDIS_RETRY_SECONDS: float = 5.0  # after a Redis error, stay on local buckets this long
     
     # APIs
     TWILIO_ACCOUNT_SID: Optional[str] = None
     TWILIO_AUTH_TOKEN: Optional[str] = None
+    TWILIO_API_BASE_URL: str = "https://api.twilio.com"  # http://localhost:8900 for scripts/provider_stand_ins.py
+    TWILIO_WHATSAPP_FROM: str = "whatsapp:+14155238886"  # Twilio sandbox number
+    WHATSAPP_SEND_CONCURRENCY: int = 20  # outbound requests in flight per process (also the pool size)
+    WHATSAPP_SEND_TIMEOUT: float = 15.0  # seconds
+    WHATSAPP_CONNECT_TIMEOUT: float = 5.0  # seconds
+    WHATSAPP_OUTBOUND_QUEUE: str = "whatsapp_outbound"  # Celery queue of send_whatsapp_message
+    WHATSAPP_SENDER_MPS: float = 80.0  # messages per second from the sender number
+    WHATSAPP_RECIPIENT_INTERVAL: float = 1.0  # seconds between messages to the same recipient
+    WHATSAPP_PACE_MAX_SLEEP: float = 2.0  # longer waits reschedule the task instead of sleeping
+    WHATSAPP_SEND_MAX_RETRIES: int = 5
+    WHATSAPP_SEND_BACKOFF_BASE: float = 2.0  # seconds, doubled per retry (with jitter)
+    WHATSAPP_SEND_BACKOFF_MAX: float = 300.0  # seconds
+    WHATSAPP_STATUS_CALLBACK_URL: Optional[str] = None  # public URL of /api/whatsapp/status
+    WHATSAPP_STATUS_FLUSH_SECONDS: float = 5.0  # how often buffered status callbacks are applied
+    WHATSAPP_STATUS_BATCH_SIZE: int = 1000  # callbacks per UPDATE
+    WHATSAPP_STATUS_MAX_RETRIES: int = 12  # flushes a callback waits for its message's SID to be stored
+    WHATSAPP_INBOUND_DEDUP_TTL: int = 86400  # seconds a MessageSid is remembered by the webhook
+    WHATSAPP_INBOUND_CLAIM_TIMEOUT: int = 600  # seconds before a message claimed by a dead worker is taken again
+    WHATSAPP_ROUTE_CACHE_SIZE: int = 10000  # sender routes kept in each process
+    WHATSAPP_ROUTE_LOCAL_TTL: float = 30.0  # seconds; bounds staleness across processes
+    WHATSAPP_ROUTE_TTL: int = 3600  # seconds a sender route is kept in Redis
+    WHATSAPP_ROUTE_NEGATIVE_TTL: int = 3600  # seconds an unregistered sender is dropped at the webhook
     GEMINI_API_KEY: Optional[str] = None
+    GEMINI_API_ENDPOINT: Optional[str] = None  # e.g. http://localhost:8900 (scripts/provider_stand_ins.py); REST transport
     
     # AWS S3
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_REGION: str = "sa-east-1"
     AWS_S3_BUCKET: str = "nexusart-media"
+    AWS_S3_ENDPOINT_URL: Optional[str] = None  # e.g. http://minio:9000 for local testing
+    S3_PRESIGNED_URL_EXPIRES: int = 3600  # seconds
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_CONNECT_TIMEOUT: int = 5
+    S3_READ_TIMEOUT: int = 30
+    S3_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE: int = 8 * 1024 * 1024
+    S3_MAX_CONCURRENCY: int = 10
+
+    # Media delivery
+    MEDIA_CACHE_MAX_AGE: int = 31536000  # 1 year, generated images never change
+    MEDIA_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_SHARDING: str = "date"  # "date" (YYYY/MM/DD) or "hash" (ab/cd) subdirectories
+    MEDIA_X_ACCEL_REDIRECT: bool = False  # let nginx serve files via X-Accel-Redirect
+    MEDIA_X_ACCEL_PREFIX: str = "/protected-uploads"
+
+    # Retention
+    RETENTION_DAYS: int = 90  # generations of any status older than this are deleted
+    RETENTION_BATCH_SIZE: int = 1000  # also the S3 DeleteObjects limit
+    RETENTION_TIME_BUDGET: int = 20 * 60  # seconds per task run, then re-enqueue
+    RETENTION_ARCHIVE_PARTITIONS: bool = True  # export expired monthly partitions before dropping them
+    RETENTION_ARCHIVE_PREFIX: str = "archives/generations"  # storage prefix for gzipped NDJSON exports
+    RETENTION_ARCHIVE_BUCKET: Optional[str] = None  # private S3 bucket for exports (default AWS_S3_BUCKET: keep archives/ out of its public policy)
+    PARTITION_MONTHS_AHEAD: int = 3  # generations partitions created ahead of time
+    
+    # Storage integrity
+    INTEGRITY_DELETE_ORPHANS: bool = False
+    INTEGRITY_ORPHAN_GRACE_HOURS: int = 24
+    INTEGRITY_FETCH_SIZE: int = 5000  # rows per server-side cursor fetch
+    INTEGRITY_REPORT_SAMPLE: int = 1000  # keys kept per list in the report
     
     # Stripe
     STRIPE_SECRET_KEY: Optional[str] = None
     STRIPE_WEBHOOK_SECRET: Optional[str] = None
+    STRIPE_API_BASE: Optional[str] = None  # e.g. http://localhost:8900 (scripts/provider_stand_ins.py)
     
     # Whisper
     WHISPER_MODEL: str = "base"
     
     # Paths
     UPLOAD_DIR: str = "uploads"
+    ARCHIVE_DIR: str = "exports"  # local data exports; unlike UPLOAD_DIR never served or swept
+    
+    @property
+    def async_database_url(self):
+        """URL do banco para o driver asyncpg"""
+        if self.ASYNC_DATABASE_URL:
+            return self.ASYNC_DATABASE_URL
+        return _asyncpg_url(self.DATABASE_URL)
+    
+    @property
+    def async_database_replica_url(self):
+        """URL da réplica de leitura para o driver asyncpg (None sem réplica)"""
+        if self.ASYNC_DATABASE_REPLICA_URL:
+            return self.ASYNC_DATABASE_REPLICA_URL
+        if self.DATABASE_REPLICA_URL:
+            return _asyncpg_url(self.DATABASE_REPLICA_URL)
+        return None
     
     @property
     def absolute_upload_dir(self):
         """Retorna o caminho absoluto da pasta de uploads"""
         return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.UPLOAD_DIR)
     
+    @property
+    def absolute_archive_dir(self):
+        """Retorna o caminho absoluto da pasta de exportações (fora de /uploads)"""
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.ARCHIVE_DIR)
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
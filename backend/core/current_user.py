@@ -0,0 +1,234 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import redis
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.redis_client import get_async_redis, get_redis
+from core.security import get_current_user, get_current_user_or_api_key
+from models.user import User
+
+_DATETIME_FIELDS = ("subscription_ends_at", "trial_ends_at", "created_at", "updated_at")
+
+@dataclass
+class UserSnapshot:
+    """
+    Cópia serializável das colunas de User usadas pelas rotas.
+
+    Não está ligada a uma sessão: rotas que alteram o usuário carregam a
+    linha com db.get(User, snapshot.id).
+    """
+    id: int
+    email: str
+    full_name: Optional[str]
+    cpf_cnpj: Optional[str]
+    phone: Optional[str]
+    business_name: Optional[str]
+    business_sector: Optional[str]
+    plan_type: str
+    credits_used: int
+    credits_limit: int
+    whatsapp_numbers_limit: int
+    is_active: bool
+    is_verified: bool
+    is_admin: bool
+    subscription_id: Optional[str]
+    subscription_status: Optional[str]
+    subscription_ends_at: Optional[datetime]
+    trial_ends_at: Optional[datetime]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        values = {field.name: getattr(user, field.name) for field in fields(cls)}
+        values["plan_type"] = user.plan_type.value if user.plan_type else "trial"
+        values["credits_used"] = user.credits_used or 0
+        values["credits_limit"] = user.credits_limit or 0
+        values["whatsapp_numbers_limit"] = user.whatsapp_numbers_limit or 1
+        return cls(**values)
+
+    def to_json(self) -> str:
+        values = asdict(self)
+        for name in _DATETIME_FIELDS:
+            if values[name]:
+                values[name] = values[name].isoformat()
+        return json.dumps(values)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "UserSnapshot":
+        values = json.loads(raw)
+        for name in _DATETIME_FIELDS:
+            if values[name]:
+                values[name] = datetime.fromisoformat(values[name])
+        return cls(**values)
+
+    @property
+    def has_active_subscription(self) -> bool:
+        """Mesma regra de User.has_active_subscription."""
+        if self.plan_type == "trial":
+            if self.trial_ends_at:
+                return datetime.utcnow() < self.trial_ends_at
+            return True
+
+        return self.subscription_status == "active"
+
+    @property
+    def remaining_credits(self) -> int:
+        """Retorna créditos restantes."""
+        return max(0, self.credits_limit - self.credits_used)
+
+class LocalCache:
+    """LRU em memória com TTL, compartilhado pelas threads do processo"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+_local = LocalCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_LOCAL_TTL)
+
+def _redis_key(user_id: int) -> str:
+    return f"user:snapshot:{user_id}"
+
+async def load_user_snapshot(user_id: int) -> Optional[UserSnapshot]:
+    """
+    Snapshot do usuário: LRU local, depois Redis, depois o banco.
+
+    O banco consultado é o primário, para não guardar no cache uma leitura
+    atrasada da réplica logo após uma invalidação.
+
+    Returns:
+        Snapshot ou None se o usuário não existir
+    """
+    snapshot = _local.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    if settings.USER_CACHE_REDIS:
+        try:
+            raw = await get_async_redis().get(_redis_key(user_id))
+            if raw:
+                snapshot = UserSnapshot.from_json(raw)
+                _local.set(user_id, snapshot)
+                return snapshot
+        except redis.RedisError:
+            pass
+
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.id == user_id))
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+
+    _local.set(user_id, snapshot)
+    if settings.USER_CACHE_REDIS:
+        try:
+            await get_async_redis().set(_redis_key(user_id), snapshot.to_json(), ex=settings.USER_CACHE_TTL)
+        except redis.RedisError:
+            pass
+    return snapshot
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Remove o snapshot do usuário dos dois níveis de cache.
+
+    Outros processos ainda podem servir a cópia local por até
+    USER_CACHE_LOCAL_TTL segundos.
+    """
+    _local.delete(user_id)
+    if settings.USER_CACHE_REDIS:
+        try:
+            get_redis().delete(_redis_key(user_id))
+        except redis.RedisError:
+            pass
+
+def invalidate_user_on_commit(db: Session, user_id: Optional[int]) -> None:
+    """
+    Invalida o snapshot quando a sessão fizer commit, para alterações feitas
+    sem o ORM (ex.: UPDATE do Core em users).
+    """
+    if user_id is not None:
+        db.info.setdefault("stale_user_ids", set()).add(user_id)
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    """Usuários alterados ou removidos pelo ORM neste flush"""
+    for obj in (*session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) == "users":
+            invalidate_user_on_commit(session, obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("stale_user_ids", ()):
+        invalidate_user(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("stale_user_ids", None)
+
+async def _snapshot_for(payload: Dict) -> UserSnapshot:
+    snapshot = None
+    if payload.get("user_id") is not None:
+        snapshot = await load_user_snapshot(int(payload["user_id"]))
+
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuário não encontrado"
+        )
+
+    return snapshot
+
+# Dependência: usuário autenticado, resolvido uma vez por request
+async def get_authenticated_user(payload: Dict = Depends(get_current_user)) -> UserSnapshot:
+    """
+    Resolve o usuário do token pelo cache de snapshots.
+
+    Raises:
+        HTTPException: 404 se o usuário do token não existir mais
+    """
+    return await _snapshot_for(payload)
+
+async def get_authenticated_user_or_api_key(payload: Dict = Depends(get_current_user_or_api_key)) -> UserSnapshot:
+    """
+    Como get_authenticated_user, aceitando também uma chave de API
+    (rotas de integração).
+
+    Raises:
+        HTTPException: 404 se o dono do token ou da chave não existir mais
+    """
+    return await _snapshot_for(payload)
@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine
+from typing import Optional
+
+import redis
+from fastapi import Depends
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from core.config import settings
+from core.redis_client import get_redis, get_async_redis
 
 # Criar engine do banco de dados
 engine = create_engine(
@@ -18,6 +24,62 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# Engine assíncrono (asyncpg) para as rotas async, que não bloqueia o event loop
+async_engine = create_async_engine(
+    settings.async_database_url,
+    pool_pre_ping=True,
+    pool_recycle=300,
+    pool_size=settings.ASYNC_DB_POOL_SIZE,
+    max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+    echo=settings.DEBUG
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# Réplica de leitura (opcional). Sem DATABASE_REPLICA_URL, as sessões de
+# leitura usam os engines do primário e nada muda
+REPLICA_ENABLED = bool(settings.DATABASE_REPLICA_URL)
+
+if REPLICA_ENABLED:
+    # postgresql_readonly faz qualquer escrita acidental falhar na réplica
+    replica_engine = create_engine(
+        settings.DATABASE_REPLICA_URL,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        echo=settings.DEBUG,
+        execution_options={"postgresql_readonly": True}
+    )
+    async_replica_engine = create_async_engine(
+        settings.async_database_replica_url,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=settings.ASYNC_DB_POOL_SIZE,
+        max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+        echo=settings.DEBUG,
+        execution_options={"postgresql_readonly": True}
+    )
+else:
+    replica_engine = engine
+    async_replica_engine = async_engine
+
+ReplicaSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=replica_engine
+)
+
+AsyncReplicaSessionLocal = async_sessionmaker(
+    async_replica_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base para os modelos
 Base = declarative_base()
 
@@ -33,6 +95,83 @@ def get_db():
     finally:
         db.close()
 
+# Dependência assíncrona, para rotas `async def`
+async def get_async_db():
+    """
+    Fornece uma AsyncSession para cada request.
+    Rotas síncronas (`def`) continuam usando get_db e rodam no threadpool.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Read-your-writes: usuários que escreveram ficam um tempo no primário
+def _pin_key(user_id: int) -> str:
+    return f"db:primary:user:{user_id}"
+
+def pin_to_primary(user_id: Optional[int]) -> None:
+    """Envia as leituras do usuário ao primário por READ_YOUR_WRITES_SECONDS"""
+    if not REPLICA_ENABLED or user_id is None:
+        return
+    try:
+        get_redis().set(_pin_key(user_id), 1, ex=settings.READ_YOUR_WRITES_SECONDS)
+    except redis.RedisError:
+        pass
+
+async def is_pinned_to_primary(user_id: Optional[int]) -> bool:
+    """Se as leituras do usuário devem ir ao primário (sim, se o Redis falhar)"""
+    if user_id is None:
+        return False
+    try:
+        return bool(await get_async_redis().exists(_pin_key(user_id)))
+    except redis.RedisError:
+        return True
+
+# Dependência de leitura, para rotas `async def` que só consultam dados
+def get_read_db(authenticate):
+    """
+    Fornece uma AsyncSession de leitura para cada request.
+    Usa a réplica, exceto se o usuário escreveu nos últimos
+    READ_YOUR_WRITES_SECONDS segundos (lê as próprias escritas no primário).
+
+    Recebe a mesma dependência de autenticação da rota (ex.:
+    Depends(get_read_db(get_current_user))): o FastAPI a resolve uma vez
+    por request e a sessão só é aberta depois dela aceitar o principal.
+    """
+    async def read_db(current_user: dict = Depends(authenticate)):
+        factory = AsyncReplicaSessionLocal
+        if REPLICA_ENABLED and await is_pinned_to_primary(current_user.get("user_id")):
+            factory = AsyncSessionLocal
+        async with factory() as db:
+            yield db
+
+    return read_db
+
+def mark_user_write(db: Session, user_id: Optional[int]) -> None:
+    """
+    Registra uma escrita feita sem o ORM (ex.: UPDATE do Core) para o
+    usuário ser fixado no primário quando a sessão fizer commit.
+    """
+    if user_id is not None:
+        db.info.setdefault("written_user_ids", set()).add(user_id)
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_users(session, flush_context):
+    """Guarda os usuários cujas linhas (ou dependentes) mudaram no flush"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) == "users":
+            mark_user_write(session, obj.id)
+        else:
+            mark_user_write(session, getattr(obj, "user_id", None))
+
+@event.listens_for(Session, "after_commit")
+def _pin_written_users(session):
+    for user_id in session.info.pop("written_user_ids", ()):
+        pin_to_primary(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written_users(session):
+    session.info.pop("written_user_ids", None)
+
 # Import models to ensure SQLAlchemy mappers are registered
 # This makes sure relationships using string class names
 # (e.g. "WhatsAppNumber") can be resolved when mappers
@@ -42,4 +181,22 @@ try:
 except Exception:
     # Import errors here are non-fatal for environments
     # where models are imported elsewhere.
-    pass
\ No newline at end of file
+    pass
+
+def init_listeners():
+    """
+    Registra os listeners de sessão e de modelo que vivem fora dos modelos
+
+    Chamado uma vez por processo (API, worker Celery, scripts) depois que
+    os modelos foram importados: aqui um import circular não é possível,
+    e uma falha de import deve derrubar o processo em vez de desligar as
+    invalidações de cache em silêncio.
+    """
+    # Registers the generation_daily_stats rollup listeners
+    from services import generation_stats
+    # Creates the generations partitions after create_all
+    from services import generation_partitions
+    # Registers the user snapshot cache invalidation listeners
+    from core import current_user
+    # Registers the WhatsApp sender routing cache invalidation listeners
+    from services import whatsapp_routing
@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+import redis
+from sqlalchemy import Select, func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.redis_client import get_redis, get_async_redis
+
+COUNT_CACHE_TTL = 60  # segundos
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    Codifica a posição (created_at, id) em um cursor opaco.
+
+    Args:
+        created_at: Data de criação do último item da página
+        row_id: ID do último item da página
+
+    Returns:
+        Cursor em base64 url-safe
+    """
+    payload = json.dumps({"c": created_at.isoformat(), "i": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """
+    Decodifica um cursor gerado por encode_cursor.
+
+    Returns:
+        (created_at, id) ou None se o cursor for inválido
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["c"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+async def exact_count(db: AsyncSession, stmt: Select, column) -> int:
+    """Conta as linhas do filtro sem o subselect de um count() genérico"""
+    count_stmt = stmt.order_by(None).with_only_columns(func.count(column))
+    return (await db.execute(count_stmt)).scalar() or 0
+
+async def estimated_count(db: AsyncSession, stmt: Select) -> int:
+    """
+    Estimativa do planejador do Postgres (EXPLAIN), sem varrer a tabela.
+
+    Precisa de ANALYZE recente para ser útil; serve para exibir "~N resultados".
+    """
+    compiled = stmt.order_by(None).compile(dialect=postgresql.dialect(paramstyle="named"))
+    result = (await db.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"), compiled.params)).scalar()
+    plan = json.loads(result) if isinstance(result, str) else result
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def count_cache_key(namespace: str, scope: int, **filters) -> str:
+    """Chave de cache da contagem para um conjunto de filtros"""
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"count:{namespace}:{scope}:{digest}"
+
+async def cached_count(db: AsyncSession, stmt: Select, column, namespace: str, scope: int, **filters) -> int:
+    """
+    Contagem exata guardada no Redis por COUNT_CACHE_TTL segundos.
+
+    As chaves incluem uma versão por escopo (ex.: usuário), incrementada por
+    invalidate_count, então escritas aparecem na próxima leitura. Sem Redis,
+    cai para a contagem exata.
+    """
+    try:
+        client = get_async_redis()
+        version = await client.get(f"count:{namespace}:{scope}:v") or "0"
+        key = f"{count_cache_key(namespace, scope, **filters)}:{version}"
+        cached = await client.get(key)
+        if cached is not None:
+            return int(cached)
+    except redis.RedisError:
+        return await exact_count(db, stmt, column)
+
+    total = await exact_count(db, stmt, column)
+    try:
+        await client.set(key, total, ex=COUNT_CACHE_TTL)
+    except redis.RedisError:
+        pass
+    return total
+
+def invalidate_count(namespace: str, scope: int) -> None:
+    """Invalida todas as contagens em cache de um escopo"""
+    try:
+        get_redis().incr(f"count:{namespace}:{scope}:v")
+    except redis.RedisError:
+        pass
@@ -0,0 +1,269 @@
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import redis
+from jose import JWTError, jwt
+from starlette.requests import Request
+from twilio.request_validator import RequestValidator
+
+from core.api_keys import resolve_api_key
+from core.config import settings
+from core.current_user import LocalCache
+from core.redis_client import get_async_redis
+
+# Janela deslizante aproximada: contador da janela atual + fração da anterior.
+# GET dos dois contadores, decisão e INCR no mesmo script, para que requests
+# concorrentes de vários processos não passem juntos do limite.
+SLIDING_WINDOW = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+
+if previous * (window - elapsed) / window + current + 1 > limit then
+    return {0, previous, current}
+end
+
+current = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], window * 2)
+return {1, previous, current}
+"""
+
+# Corpo máximo lido para achar o telefone (webhooks do Twilio têm poucos KB)
+MAX_FORM_BODY = 64 * 1024
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """
+    Limite de uma rota, aplicado por chave:
+      ip     endereço do cliente (uvicorn --proxy-headers atrás de proxy)
+      user   usuário do token, ou a chave de API; sem credencial, o IP
+      phone  campo From do formulário (webhook do WhatsApp)
+    O limite vem de settings.RATE_LIMITS[name], no formato "requests/segundos".
+    """
+    name: str
+    method: str
+    path: str
+    key: str
+
+    @property
+    def limit(self) -> Tuple[int, int]:
+        requests, seconds = settings.RATE_LIMITS[self.name].split("/")
+        return int(requests), int(seconds)
+
+POLICIES = [
+    RateLimitPolicy("auth_login", "POST", "/api/auth/login", "ip"),
+    RateLimitPolicy("auth_register", "POST", "/api/auth/register", "ip"),
+    RateLimitPolicy("whatsapp_webhook", "POST", "/api/whatsapp/webhook", "phone"),
+    RateLimitPolicy("generations_create", "POST", "/api/generations/", "user"),
+]
+
+class TokenBucket:
+    """Fallback local quando o Redis está fora (limite vale por processo)"""
+
+    def __init__(self, limit: int, window: int):
+        self.capacity = limit
+        self.rate = limit / window
+        self.tokens = float(limit)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> Tuple[bool, int]:
+        """(permitido, segundos até haver uma ficha)"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True, 0
+            return False, max(1, math.ceil((1 - self.tokens) / self.rate))
+
+def retry_after(limit: int, window: int, elapsed: float, previous: int, current: int) -> int:
+    """Segundos até a janela deslizante aceitar mais um request"""
+    if current < limit and previous > 0:
+        # Basta a janela anterior deslizar para fora o suficiente
+        wait = window * (1 - (limit - 1 - current) / previous) - elapsed
+    else:
+        # Janela atual cheia: espera a próxima e parte da atual sair
+        wait = window - elapsed + window * (1 - (limit - 1) / max(current, 1))
+    return max(1, math.ceil(wait))
+
+class RateLimiter:
+    def __init__(self):
+        self._script = None
+        # Balde parado por uma janela inteira estaria cheio de novo: pode sair do cache
+        longest_window = max([60] + [policy.limit[1] for policy in POLICIES])
+        self._buckets = LocalCache(settings.RATE_LIMIT_LOCAL_BUCKETS, longest_window)
+        self._redis_down_until = 0.0
+
+    async def hit(self, policy: RateLimitPolicy, identity: str, limit: int, window: int) -> Tuple[bool, int]:
+        """
+        Conta um request contra o limite.
+
+        Returns:
+            (permitido, Retry-After em segundos)
+        """
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                return await self._hit_redis(policy, identity, limit, window)
+            except redis.RedisError:
+                # Não paga o timeout do Redis em todo request enquanto ele estiver fora
+                self._redis_down_until = time.monotonic() + settings.RATE_LIMIT_REDIS_RETRY_SECONDS
+        return self._hit_local(policy, identity, limit, window)
+
+    async def _hit_redis(self, policy, identity, limit, window):
+        if self._script is None:
+            self._script = get_async_redis().register_script(SLIDING_WINDOW)
+
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        prefix = f"ratelimit:{policy.name}:{identity}"
+        allowed, previous, current = await self._script(
+            keys=[f"{prefix}:{int(index) - 1}", f"{prefix}:{int(index)}"],
+            args=[limit, window, elapsed]
+        )
+        if allowed:
+            return True, 0
+        return False, retry_after(limit, window, elapsed, int(previous), int(current))
+
+    def _hit_local(self, policy, identity, limit, window):
+        key = (policy.name, identity, limit, window)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(limit, window)
+            self._buckets.set(key, bucket)
+        return bucket.take()
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def _client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que recusa com 429 (e Retry-After) requests acima do
+    limite das rotas em POLICIES, antes de chegar em hash de senha, banco
+    ou geração de imagem.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.limiter = RateLimiter()
+        self.policies = {(policy.method, policy.path): policy for policy in POLICIES}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+
+        policy = self.policies.get((scope["method"], scope["path"]))
+        if policy is None:
+            return await self.app(scope, receive, send)
+
+        limit, window = policy.limit
+        if policy.key == "phone":
+            identity, receive = await self._phone_identity(scope, receive)
+        elif policy.key == "user":
+            identity, limit, window = await self._user_identity(scope, limit, window)
+        else:
+            identity = f"ip:{_client_ip(scope)}"
+
+        allowed, wait = await self.limiter.hit(policy, identity, limit, window)
+        if allowed:
+            return await self.app(scope, receive, send)
+
+        body = json.dumps({"detail": f"Muitas requisições, tente novamente em {wait} segundos"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(wait).encode()),
+                (b"x-ratelimit-limit", str(limit).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _user_identity(self, scope, limit: int, window: int) -> Tuple[str, int, int]:
+        """Usuário do token (só a assinatura, a revogação fica com a rota) ou chave de API"""
+        authorization = _header(scope, b"authorization") or ""
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+                if payload.get("user_id") is not None:
+                    return f"user:{payload['user_id']}", limit, window
+            except JWTError:
+                pass
+
+        api_key = _header(scope, b"x-api-key")
+        if api_key:
+            principal = await resolve_api_key(api_key)
+            if principal is not None:
+                if principal.rate_limit_per_minute:
+                    limit, window = principal.rate_limit_per_minute, 60
+                return f"key:{principal.key_id}", limit, window
+
+        return f"ip:{_client_ip(scope)}", limit, window
+
+    async def _phone_identity(self, scope, receive):
+        """
+        Lê o corpo para achar o From e devolve um receive que o entrega de
+        novo à rota.
+
+        Só requests com assinatura válida do Twilio contam para o telefone;
+        os demais contam para o IP, para ninguém esgotar o limite de um
+        número forjando o From.
+        """
+        chunks: List[bytes] = []
+        size = 0
+        more_body = True
+        disconnect = None
+        # Para de ler passado MAX_FORM_BODY, mas a rota recebe o corpo
+        # inteiro: o more_body original vai no replay e o resto vem do receive
+        while more_body and size <= MAX_FORM_BODY:
+            message = await receive()
+            if message["type"] != "http.request":
+                disconnect = message
+                break
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        pending = [{"type": "http.request", "body": body, "more_body": more_body}]
+        if disconnect is not None:
+            pending.append(disconnect)
+
+        async def replay():
+            if pending:
+                return pending.pop(0)
+            return await receive()
+
+        phone = None
+        content_type = _header(scope, b"content-type") or ""
+        if content_type.startswith("application/x-www-form-urlencoded") and size <= MAX_FORM_BODY:
+            params = {name: values[0] for name, values in parse_qs(body.decode("latin-1")).items()}
+            signature = _header(scope, b"x-twilio-signature") or ""
+            validator = RequestValidator(settings.TWILIO_AUTH_TOKEN)
+            if (
+                params.get("From")
+                and settings.TWILIO_AUTH_TOKEN
+                and validator.validate(str(Request(scope).url), params, signature)
+            ):
+                phone = params["From"].removeprefix("whatsapp:").strip()
+
+        identity = f"phone:{phone}" if phone else f"ip:{_client_ip(scope)}"
+        return identity, replay
@@ -0,0 +1,44 @@
+import redis
+import redis.asyncio
+
+from core.config import settings
+
+# Shared connection pool for the process (redis-py resets it after fork)
+_client = None
+_async_client = None
+
+def get_redis() -> redis.Redis:
+    """
+    Retorna o cliente Redis compartilhado.
+    
+    Returns:
+        Cliente Redis com respostas decodificadas como str
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=30
+        )
+    return _client
+
+def get_async_redis() -> redis.asyncio.Redis:
+    """
+    Retorna o cliente Redis assíncrono compartilhado, para rotas `async def`.
+    
+    Returns:
+        Cliente redis.asyncio com respostas decodificadas como str
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=30
+        )
+    return _async_client
@@ -1,20 +1,46 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, HTTPException, status
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, Request, status
 import secrets
 
 from core.config import settings
+from core.token_revocation import is_token_revoked
 
 # Contexto para hash de senhas
 # Prefer a pure-Python scheme (`pbkdf2_sha256`) so hashing
 # works even if the native `bcrypt` wheel is unavailable.
-pwd_context = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
+# min_rounds = default_rounds: hashes com menos rounds (ou em bcrypt) são
+# regravados no login, ver verify_and_update_password
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256", "bcrypt"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=settings.PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=settings.PASSWORD_HASH_ROUNDS
+)
 
-# Scheme para OAuth2
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+# Pool dedicado para hash de senha: um pico de logins ocupa no máximo
+# PASSWORD_HASH_WORKERS threads, sem tomar o threadpool das rotas síncronas
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1,
+    thread_name_prefix="password-hash"
+)
+_hash_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+
+# Scheme para OAuth2; sem auto_error para cair na chave de API
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+# Chave de API para integrações (ver core/api_keys.py)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+API_KEY_PREFIX = "nxa_"
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -34,7 +60,9 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
+    # jti identifica o token para revogação (logout). iat com fração de
+    # segundo: um login logo após "sair de todos" não cai no mesmo corte
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": secrets.token_urlsafe(16)})
     
     encoded_jwt = jwt.encode(
         to_encode, 
@@ -44,9 +72,9 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     
     return encoded_jwt
 
-def verify_token(token: str) -> Dict[str, Any]:
+async def verify_token(token: str) -> Dict[str, Any]:
     """
-    Verifica e decodifica um token JWT.
+    Verifica e decodifica um token JWT, recusando tokens revogados.
     
     Args:
         token: Token JWT
@@ -55,7 +83,7 @@ def verify_token(token: str) -> Dict[str, Any]:
         Dados decodificados do token
     
     Raises:
-        HTTPException: Se o token for inválido ou expirado
+        HTTPException: Se o token for inválido, expirado ou revogado
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -74,10 +102,13 @@ def verify_token(token: str) -> Dict[str, Any]:
         if email is None:
             raise credentials_exception
         
-        return payload
-        
     except JWTError:
         raise credentials_exception
+    
+    if await is_token_revoked(payload):
+        raise credentials_exception
+    
+    return payload
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -104,17 +135,113 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def _run_hash_job(func, *args):
+    """
+    Executa func no pool de hash.
+    
+    Raises:
+        HTTPException: 503 se já houver PASSWORD_HASH_MAX_PENDING hashes
+            em execução ou na fila
+    """
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+    
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_slots.release()
+
+async def hash_password(password: str) -> str:
+    """
+    Versão assíncrona de get_password_hash, fora do event loop.
+    
+    Args:
+        password: Senha em texto claro
+    
+    Returns:
+        Hash da senha
+    """
+    return await _run_hash_job(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica a senha fora do event loop e, se o hash usar parâmetros
+    antigos, gera um novo com os atuais.
+    
+    Args:
+        plain_password: Senha em texto claro
+        hashed_password: Hash armazenado
+    
+    Returns:
+        (senha confere, novo hash ou None se o armazenado continua válido)
+    """
+    return await _run_hash_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)):
     """
     Dependência para obter o usuário atual a partir do token.
     
+    Só aceita login: rotas de conta (perfil, assinatura, WhatsApp, chaves)
+    não podem ser usadas com uma chave de API vazada.
+    
     Args:
         token: Token JWT
     
     Returns:
         Dados do usuário do token
     """
-    return verify_token(token)
+    if not token:
+        raise _credentials_exception()
+    return await verify_token(token)
+
+async def get_current_user_or_api_key(
+    request: Request,
+    token: Optional[str] = Depends(oauth2_scheme),
+    api_key: Optional[str] = Depends(api_key_header)
+):
+    """
+    Como get_current_user, mas sem token aceita a chave de API (header
+    X-API-Key). Só para as rotas de integração (criar, listar e baixar
+    gerações).
+    
+    Para chaves de API o payload traz api_key_id, e o principal da chave
+    fica em request.state.api_key.
+    
+    Args:
+        token: Token JWT
+        api_key: Chave de API
+    
+    Returns:
+        Dados do usuário do token ou do dono da chave
+    """
+    if token:
+        return await verify_token(token)
+    
+    if api_key:
+        from core.api_keys import resolve_api_key
+        
+        principal = await resolve_api_key(api_key)
+        if principal is not None:
+            request.state.api_key = principal
+            return {
+                "sub": f"api_key:{principal.key_id}",
+                "user_id": principal.user_id,
+                "api_key_id": principal.key_id
+            }
+    
+    raise _credentials_exception()
 
 def generate_api_key() -> str:
     """
@@ -123,4 +250,19 @@ def generate_api_key() -> str:
     Returns:
         Chave API gerada
     """
-    return secrets.token_urlsafe(32)
\ No newline at end of file
+    return API_KEY_PREFIX + secrets.token_urlsafe(32)
+
+def hash_api_key(api_key: str) -> str:
+    """
+    Hash gravado no lugar da chave API.
+    
+    As chaves são aleatórias (256 bits), então um SHA-256 simples basta e
+    mantém a busca em O(1) pelo índice único, sem o custo de um hash de senha.
+    
+    Args:
+        api_key: Chave API em texto claro
+    
+    Returns:
+        SHA-256 em hexadecimal
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
\ No newline at end of file
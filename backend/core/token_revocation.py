@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import redis
+
+from core.config import settings
+from core.redis_client import get_async_redis, get_redis
+
+# Revogações no Redis:
+#   auth:revoked             zset  "jti:<jti>" / "user:<id>" -> momento da revogação
+#   auth:revoked:jti:<jti>   "1", expira junto com o token
+#   auth:revoked:user:<id>   iat de corte (tokens emitidos antes dele são inválidos)
+# O zset só serve para os processos sincronizarem seus filtros de Bloom;
+# a resposta definitiva vem das chaves individuais
+REVOKED_SET = "auth:revoked"
+
+# Margem ao buscar revogações recentes (relógios dos nós podem divergir)
+SYNC_OVERLAP_SECONDS = 30
+
+def _entry_key(member: str) -> str:
+    return f"{REVOKED_SET}:{member}"
+
+def _token_lifetime() -> int:
+    return settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+class BloomFilter:
+    """Filtro de Bloom em bytearray (double hashing sobre um blake2b)"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+def _new_filter(entries: int = 0) -> BloomFilter:
+    return BloomFilter(
+        max(settings.TOKEN_REVOCATION_CAPACITY, entries * 2),
+        settings.TOKEN_REVOCATION_ERROR_RATE
+    )
+
+_filter = _new_filter()
+_synced_at: Optional[float] = None  # None até a primeira sincronização
+_rebuilt_at = 0.0
+
+def _members(payload: Dict[str, Any]):
+    members = []
+    if payload.get("jti"):
+        members.append(f"jti:{payload['jti']}")
+    if payload.get("user_id") is not None:
+        members.append(f"user:{payload['user_id']}")
+    return members
+
+async def is_token_revoked(payload: Dict[str, Any]) -> bool:
+    """
+    Verifica se o token foi revogado.
+
+    O caso comum (filtro de Bloom sem ocorrência) não toca o Redis. Antes
+    da primeira sincronização do filtro, toda verificação vai ao Redis.
+
+    Returns:
+        True se o token (jti) ou todos os tokens do usuário foram revogados
+    """
+    synced = _synced_at is not None
+    candidates = [member for member in _members(payload) if not synced or member in _filter]
+    if not candidates:
+        return False
+
+    try:
+        values = await get_async_redis().mget([_entry_key(member) for member in candidates])
+    except redis.RedisError:
+        # Sem Redis, confia no filtro: ocorrência conta como revogado
+        return synced
+
+    for member, value in zip(candidates, values):
+        if value is None:
+            continue
+        if member.startswith("jti:"):
+            return True
+        if float(payload.get("iat") or 0) < float(value):
+            return True
+    return False
+
+def _publish(member: str, value: Any, ttl: int) -> None:
+    now = time.time()
+    pipe = get_redis().pipeline()
+    pipe.set(_entry_key(member), value, ex=max(1, ttl))
+    pipe.zadd(REVOKED_SET, {member: now})
+    # Revogações mais velhas que um token não afetam mais nenhum token
+    pipe.zremrangebyscore(REVOKED_SET, "-inf", now - _token_lifetime())
+    pipe.execute()
+    _filter.add(member)
+
+def revoke_user_tokens(user_id: int, issued_before: Optional[int] = None) -> None:
+    """
+    Revoga todos os tokens do usuário emitidos antes de issued_before
+    (padrão: agora, com fração de segundo, como o iat dos tokens). Logout
+    forçado, troca de senha, conta desativada.
+
+    Raises:
+        redis.RedisError: Revogação não registrada
+    """
+    cutoff = float(issued_before if issued_before is not None else time.time())
+    current = get_redis().get(_entry_key(f"user:{user_id}"))
+    if current is not None and float(current) >= cutoff:
+        return
+    _publish(f"user:{user_id}", cutoff, _token_lifetime())
+
+def revoke_token(payload: Dict[str, Any]) -> None:
+    """
+    Revoga um token (logout) até ele expirar.
+
+    Tokens sem jti (emitidos antes da revogação existir, com iat inteiro)
+    só podem ser revogados junto com os tokens mais antigos do mesmo
+    usuário, incluindo os do mesmo segundo.
+
+    Raises:
+        redis.RedisError: Revogação não registrada
+    """
+    if not payload.get("jti"):
+        revoke_user_tokens(payload["user_id"], issued_before=int(payload.get("iat") or 0) + 1)
+        return
+    ttl = int(payload.get("exp") or 0) - int(time.time())
+    _publish(f"jti:{payload['jti']}", 1, ttl)
+
+async def sync_revocations(full: bool = False) -> None:
+    """
+    Atualiza o filtro deste processo a partir do zset.
+
+    Normalmente busca só as revogações recentes. Refaz o filtro inteiro
+    a cada TOKEN_REVOCATION_REBUILD_SECONDS (um filtro de Bloom não remove
+    itens, então é assim que revogações expiradas saem) ou quando ele
+    passa da capacidade.
+    """
+    global _filter, _synced_at, _rebuilt_at
+    client = get_async_redis()
+    started_at = time.time()
+
+    full = (
+        full
+        or _synced_at is None
+        or started_at - _rebuilt_at >= settings.TOKEN_REVOCATION_REBUILD_SECONDS
+        or _filter.count > _filter.capacity
+    )
+    if full:
+        members = await client.zrangebyscore(REVOKED_SET, started_at - _token_lifetime(), "+inf")
+        rebuilt = _new_filter(len(members))
+        for member in members:
+            rebuilt.add(member)
+        _filter = rebuilt
+        _rebuilt_at = started_at
+    else:
+        members = await client.zrangebyscore(REVOKED_SET, _synced_at - SYNC_OVERLAP_SECONDS, "+inf")
+        for member in members:
+            _filter.add(member)
+
+    _synced_at = started_at
+
+async def revocation_sync_loop() -> None:
+    """Tarefa de fundo da API: sincroniza o filtro periodicamente"""
+    while True:
+        try:
+            await sync_revocations()
+        except redis.RedisError:
+            pass  # mantém o filtro atual até o Redis voltar
+        except Exception as e:
+            # Um erro inesperado não pode encerrar a sincronização para sempre
+            print(f"Falha ao sincronizar revogações de tokens: {e!r}")
+        await asyncio.sleep(settings.TOKEN_REVOCATION_SYNC_SECONDS)
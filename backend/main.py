@@ -2,17 +2,22 @@ from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
 from starlette.requests import Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
 
 from core.config import settings
-from core.database import engine, Base, get_db
-from api.routes import auth, whatsapp, generations, subscriptions, users
+from core.database import engine, async_engine, async_replica_engine, Base, get_db, get_async_db, init_listeners
+from core.rate_limit import RateLimitMiddleware
+from core.token_revocation import revocation_sync_loop
+from api.routes import auth, whatsapp, generations, subscriptions, users, media
 from models.user import User, PlanType
 
+init_listeners()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 Starting NexusArt API...")
@@ -42,10 +47,17 @@ async def lifespan(app: FastAPI):
         finally:
             db.close()
     
+    # Filtro de revogação de tokens deste processo
+    revocation_sync = asyncio.create_task(revocation_sync_loop())
+    
     yield
     
     # Shutdown
     print("👋 Shutting down NexusArt API...")
+    revocation_sync.cancel()
+    await async_engine.dispose()
+    if async_replica_engine is not async_engine:
+        await async_replica_engine.dispose()
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -56,6 +68,9 @@ app = FastAPI(
     redoc_url="/redoc" if settings.DEBUG else None
 )
 
+# Rate limit por rota (antes do CORS na lista, para o 429 também levar os headers de CORS)
+app.add_middleware(RateLimitMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -72,8 +87,8 @@ app.include_router(generations.router, prefix="/api/generations", tags=["Generat
 app.include_router(subscriptions.router, prefix="/api/subscriptions", tags=["Subscriptions"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
 
-# Servir arquivos estáticos
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Servir arquivos estáticos (sharded, com ETag e cache imutável)
+app.include_router(media.router, prefix="/uploads", tags=["Media"], include_in_schema=False)
 
 # Rotas básicas
 @app.get("/")
@@ -86,10 +101,10 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     try:
         # Testar conexão com banco de dados
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
@@ -1,18 +1,24 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, JSON
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, Float, JSON, Index, Computed, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, column_property, deferred
 
 from core.database import Base
 
 class Generation(Base):
     __tablename__ = "generations"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     template_id = Column(Integer, ForeignKey("templates.id"), nullable=True)
     
     # Content
     prompt = Column(Text, nullable=False)
+    # Portuguese full-text vector, maintained by Postgres (generated column)
+    prompt_tsv = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('portuguese'::regconfig, coalesce(prompt, ''))", persisted=True)
+    ))
     input_type = Column(String(20), nullable=False)  # 'text', 'audio', 'web'
     style = Column(String(50), nullable=True)
     
@@ -22,12 +28,13 @@ class Generation(Base):
     thumbnail_url = Column(String(500), nullable=True)
     
     # Status
-    status = Column(String(20), default="pending")  # pending, processing, completed, failed
+    # active_history keeps the previous value for the daily stats rollup
+    status = column_property(Column(String(20), default="pending"), active_history=True)  # pending, processing, completed, failed
     error_message = Column(Text, nullable=True)
     
     # Usage
-    credits_used = Column(Integer, default=1)
-    processing_time = Column(Float, nullable=True)  # in seconds
+    credits_used = column_property(Column(Integer, default=1), active_history=True)
+    processing_time = column_property(Column(Float, nullable=True), active_history=True)  # in seconds
     file_size = Column(Integer, nullable=True)  # in bytes
     
     # Engagement
@@ -37,24 +44,90 @@ class Generation(Base):
     
     # Metadata (attribute named `meta` to avoid collision with SQLAlchemy internals)
     # Database column is `generation_metadata` in the existing schema, map to that name.
-    meta = Column('generation_metadata', JSON, nullable=True)  # Store additional data like AI parameters
+    # Deferred: it holds the full prompt data (LLM output), only the detail view needs it
+    meta = deferred(Column('generation_metadata', JSON, nullable=True))  # Store additional data like AI parameters
     tags = Column(JSON, nullable=True)  # Array of tags
     
     # Timestamps
-    created_at = Column(DateTime, server_default=func.now())
+    # Partition key, so part of the table's primary key (see alembic 006)
+    created_at = Column(DateTime, primary_key=True, nullable=False, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
     completed_at = Column(DateTime, nullable=True)
     
+    # Rows are identified by id alone; created_at is only in the database key
+    __mapper_args__ = {"primary_key": [id]}
+    
+    # Indexes (see alembic 002)
+    __table_args__ = (
+        Index('ix_generations_user_id_created_at', user_id, created_at.desc(), id.desc()),
+        Index('ix_generations_user_id_status', 'user_id', 'status'),
+        # Retention sweep, every status (see alembic 010)
+        Index('ix_generations_created_at_id', created_at, id),
+        # Prompt search (see alembic 004)
+        Index(
+            'ix_generations_prompt_trgm', 'prompt',
+            postgresql_using='gin',
+            postgresql_ops={'prompt': 'gin_trgm_ops'}
+        ),
+        Index('ix_generations_prompt_tsv', 'prompt_tsv', postgresql_using='gin'),
+        # Monthly range partitions (services.generation_partitions)
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    
     # Relationships
     user = relationship("User", back_populates="generations")
     template = relationship("Template", back_populates="generations")
-    whatsapp_messages = relationship("WhatsAppMessage", back_populates="generation")
+    # No foreign key: a partitioned table's unique keys must include created_at
+    whatsapp_messages = relationship(
+        "WhatsAppMessage",
+        primaryjoin="Generation.id == foreign(WhatsAppMessage.generation_id)",
+        back_populates="generation"
+    )
     
     def __repr__(self):
         return f"<Generation {self.id} ({self.status})>"
 
     
 
+# gin_trgm_ops needs pg_trgm before create_all builds the indexes
+event.listen(
+    Generation.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
+class GenerationDailyStats(Base):
+    """
+    Per-user, per-day rollup of generations (by creation day)
+
+    Maintained incrementally by services.generation_stats; rebuild with
+    scripts/backfill_generation_stats.py. Deleting generations does not
+    decrement it, so it keeps the usage history after retention cleanup.
+    """
+    __tablename__ = "generation_daily_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    
+    # Counts by status
+    generations = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+    failed = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    # Counts by input type
+    text_count = Column(Integer, nullable=False, default=0, server_default="0")
+    audio_count = Column(Integer, nullable=False, default=0, server_default="0")
+    web_count = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    # Usage
+    credits_used = Column(Integer, nullable=False, default=0, server_default="0")
+    processing_time_sum = Column(Float, nullable=False, default=0, server_default="0")
+    processing_time_count = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    def __repr__(self):
+        return f"<GenerationDailyStats {self.user_id} {self.day}>"
+
+
 class Template(Base):
     __tablename__ = "templates"
     
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Enum, Text, Index, DDL, event, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import enum
@@ -42,14 +42,20 @@ class User(Base):
     subscription_ends_at = Column(DateTime, nullable=True)
     trial_ends_at = Column(DateTime, nullable=True)
     
-    # API Key para integração
-    api_key = Column(String(100), unique=True, index=True, nullable=True)
-    
     # Timestamps
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
     last_login_at = Column(DateTime, nullable=True)
     
+    # Índices (ver alembic 002)
+    __table_args__ = (
+        Index(
+            'ix_users_subscription_id', subscription_id,
+            postgresql_where=text('subscription_id IS NOT NULL')
+        ),
+        Index('ix_users_plan_type_trial_ends_at', plan_type, trial_ends_at),
+    )
+    
     # Relacionamentos
     whatsapp_numbers = relationship("WhatsAppNumber", back_populates="user", cascade="all, delete-orphan")
     generations = relationship("Generation", back_populates="user", cascade="all, delete-orphan")
@@ -79,4 +85,83 @@ class User(Base):
     
     def can_generate(self) -> bool:
         """Verifica se o usuário pode gerar mais conteúdo."""
-        return self.has_active_subscription and self.remaining_credits > 0
\ No newline at end of file
+        return self.has_active_subscription and self.remaining_credits > 0
+
+class CreditLedgerEntry(Base):
+    """
+    Movimentação de créditos (append-only).
+    
+    Cada reserva, estorno ou ajuste de `users.credits_used` gera uma linha,
+    gravada na mesma transação do UPDATE (ver services/credit_service.py).
+    """
+    __tablename__ = "credit_ledger"
+    
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Sem FK: gerações podem ser removidas pela retenção, o histórico fica
+    generation_id = Column(Integer, nullable=True)
+    
+    kind = Column(String(20), nullable=False)  # reserve, refund, adjust
+    amount = Column(Integer, nullable=False)  # variação de credits_used (+ consome, - devolve)
+    credits_used_after = Column(Integer, nullable=False)
+    credits_limit = Column(Integer, nullable=False)
+    reason = Column(String(200), nullable=True)
+    
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_credit_ledger_user_id_created_at', user_id, created_at),
+    )
+    
+    def __repr__(self):
+        return f"<CreditLedgerEntry {self.user_id} {self.kind} {self.amount:+d}>"
+
+class ApiKey(Base):
+    """
+    Chave de API para integrações (header X-API-Key).
+    
+    Só o SHA-256 da chave é gravado; o valor em claro é mostrado uma única
+    vez, na criação. Rotação cria uma chave nova e dá prazo (expires_at)
+    para a antiga (ver core/api_keys.py).
+    """
+    __tablename__ = "api_keys"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    name = Column(String(100), nullable=False)
+    prefix = Column(String(16), nullable=False)  # início da chave, para o usuário reconhecê-la
+    key_hash = Column(String(64), nullable=False)
+    rate_limit_per_minute = Column(Integer, nullable=True)  # None = limite padrão
+    
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    last_used_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_api_keys_key_hash', key_hash, unique=True),
+        Index('ix_api_keys_user_id', user_id),
+    )
+    
+    def __repr__(self):
+        return f"<ApiKey {self.prefix}... ({self.user_id})>"
+
+# Ledger é append-only: UPDATE é rejeitado pelo banco (DELETE só via cascade do usuário)
+CREDIT_LEDGER_APPEND_ONLY = """
+CREATE OR REPLACE FUNCTION credit_ledger_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'credit_ledger is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER credit_ledger_no_update
+    BEFORE UPDATE ON credit_ledger
+    FOR EACH ROW EXECUTE FUNCTION credit_ledger_append_only();
+"""
+
+event.listen(
+    CreditLedgerEntry.__table__,
+    "after_create",
+    DDL(CREDIT_LEDGER_APPEND_ONLY).execute_if(dialect="postgresql")
+)
+
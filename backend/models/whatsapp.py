@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -9,7 +9,7 @@ class WhatsAppNumber(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    phone_number = Column(String(20), nullable=False)
+    phone_number = Column(String(20), nullable=False, index=True)
     is_verified = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
     verification_code = Column(String(6), nullable=True)
@@ -40,7 +40,7 @@ class WhatsAppMessage(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     whatsapp_number_id = Column(Integer, ForeignKey("whatsapp_numbers.id"), nullable=False)
-    generation_id = Column(Integer, ForeignKey("generations.id"), nullable=True)
+    generation_id = Column(Integer, nullable=True)  # generations.id (partitioned, so no foreign key)
     
     # Message info
     message_sid = Column(String(100), nullable=True)  # Twilio SID
@@ -50,8 +50,9 @@ class WhatsAppMessage(Base):
     media_url = Column(String(500), nullable=True)
     
     # Status
-    status = Column(String(20), default="received")  # received, processed, sent, delivered, failed
+    status = Column(String(20), default="received")  # inbound: received, processed, failed; outbound: pending, then Twilio's status
     error_message = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)  # outbound send attempts
     
     # Timestamps
     received_at = Column(DateTime, nullable=True)
@@ -62,9 +63,18 @@ class WhatsAppMessage(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
     
+    # Inbound dedup (see alembic 008)
+    __table_args__ = (
+        Index('ix_whatsapp_messages_message_sid', message_sid, unique=True),
+    )
+    
     # Relationships
     whatsapp_number = relationship("WhatsAppNumber")
-    generation = relationship("Generation", back_populates="whatsapp_messages")
+    generation = relationship(
+        "Generation",
+        primaryjoin="foreign(WhatsAppMessage.generation_id) == Generation.id",
+        back_populates="whatsapp_messages"
+    )
     
     def __repr__(self):
         return f"<WhatsAppMessage {self.message_sid or self.id} ({self.direction})>"
\ No newline at end of file
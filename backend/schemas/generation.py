@@ -38,6 +38,46 @@ class GenerationResponse(GenerationBase):
     created_at: datetime
     updated_at: Optional[datetime]
     completed_at: Optional[datetime]
+    highlight: Optional[str] = None  # search results only; HTML with <mark> around matches
+    
+    @validator('image_url')
+    def ensure_full_url(cls, v):
+        if v and v.startswith('/'):
+            # In production, prepend CDN URL
+            return f"https://cdn.nexusart.com.br{v}"
+        return v
+    
+    class Config:
+        from_attributes = True
+
+class GenerationListItem(BaseModel):
+    """
+    Generation card in list responses
+
+    Only the columns a card needs; the extra fields below are filled in
+    (and serialized) only when requested with ``fields=``.
+    """
+    id: int
+    prompt: str
+    template_id: Optional[int] = None
+    style: Optional[str] = None
+    input_type: GenerationInputType
+    status: GenerationStatus
+    image_url: Optional[str]
+    thumbnail_url: Optional[str]
+    downloads: int
+    shares: int
+    created_at: datetime
+    completed_at: Optional[datetime]
+    highlight: Optional[str] = None  # search results only; HTML with <mark> around matches
+    
+    # Extra fields (fields=meta,error_message,...)
+    user_id: Optional[int] = None
+    credits_used: Optional[int] = None
+    processing_time: Optional[float] = None
+    error_message: Optional[str] = None
+    meta: Optional[Dict[str, Any]] = None
+    updated_at: Optional[datetime] = None
     
     @validator('image_url')
     def ensure_full_url(cls, v):
@@ -54,11 +94,14 @@ class GenerationUpdate(BaseModel):
     tags: Optional[List[str]] = None
 
 class GenerationListResponse(BaseModel):
-    generations: List[GenerationResponse]
-    total: int
-    page: int
+    generations: List[GenerationListItem]
+    total: Optional[int] = None  # None when count="none"
+    total_is_estimate: bool = False
+    page: Optional[int] = None  # offset pagination only
     page_size: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None  # cursor pagination only
+    has_more: bool = False
 
 class GenerationStats(BaseModel):
     total_generations: int
@@ -98,4 +98,23 @@ class UserList(BaseModel):
     users: List[UserResponse]
     total: int
     page: int
-    page_size: int
\ No newline at end of file
+    page_size: int
+
+# API keys
+class ApiKeyCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+
+class ApiKeyResponse(BaseModel):
+    id: int
+    name: str
+    prefix: str
+    rate_limit_per_minute: Optional[int] = None
+    created_at: datetime
+    last_used_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class ApiKeyCreated(ApiKeyResponse):
+    key: str  # shown only once
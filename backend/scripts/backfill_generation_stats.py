@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Rebuild the generation_daily_stats rollup from the generations table
+
+Usage: python scripts/backfill_generation_stats.py [--user-id ID] [--since YYYY-MM-DD]
+"""
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from datetime import date
+
+from core.database import SessionLocal
+from services.generation_stats import rebuild_daily_stats
+
+def backfill_generation_stats(user_id=None, since=None):
+    db = SessionLocal()
+    
+    try:
+        rows = rebuild_daily_stats(db, user_id=user_id, since=since)
+        db.commit()
+        print(f"Daily stats rebuilt: {rows} rows")
+        
+    except Exception as e:
+        db.rollback()
+        print(f"Error rebuilding stats: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--since", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+    
+    backfill_generation_stats(user_id=args.user_id, since=args.since)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Pick PASSWORD_HASH_ROUNDS for this host
+
+Times pbkdf2_sha256 on this machine and prints the rounds that make one
+hash take about --target-ms. Run it on the production hardware; existing
+users are moved to the new rounds the next time they log in.
+
+Usage: python scripts/benchmark_password_hash.py [--target-ms 250] [--samples 5]
+"""
+import sys
+import os
+import argparse
+import time
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from passlib.hash import pbkdf2_sha256
+
+from core.config import settings
+
+PROBE_ROUNDS = 10000
+
+def time_hash(rounds, samples):
+    """Median seconds for one hash at the given rounds"""
+    handler = pbkdf2_sha256.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash("benchmark-password")
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+def benchmark_password_hash(target_ms, samples):
+    # pbkdf2 cost is linear in rounds: scale from a probe, then check
+    per_round = time_hash(PROBE_ROUNDS, samples) / PROBE_ROUNDS
+    rounds = max(1000, int(target_ms / 1000 / per_round) // 1000 * 1000)
+    seconds = time_hash(rounds, samples)
+
+    workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+    print(f"Current:  PASSWORD_HASH_ROUNDS={settings.PASSWORD_HASH_ROUNDS} "
+          f"({time_hash(settings.PASSWORD_HASH_ROUNDS, samples) * 1000:.0f} ms)")
+    print(f"Measured: {rounds} rounds = {seconds * 1000:.0f} ms per hash")
+    print(f"Capacity: ~{workers / seconds:.0f} logins/s with {workers} hashing worker(s)")
+    print()
+    print(f"PASSWORD_HASH_ROUNDS={rounds}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pbkdf2_sha256 rounds")
+    parser.add_argument("--target-ms", type=float, default=250, help="Desired time per hash")
+    parser.add_argument("--samples", type=int, default=5, help="Hashes timed per measurement")
+    args = parser.parse_args()
+
+    benchmark_password_hash(args.target_ms, args.samples)
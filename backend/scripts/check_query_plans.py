@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for hot query paths
+
+Runs EXPLAIN on the queries behind the dashboard, webhooks and periodic
+tasks and fails if any of them stops using its index. Sequential scans are
+disabled for the session so the result does not depend on table size.
+
+Usage: python scripts/check_query_plans.py
+"""
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from datetime import datetime
+from sqlalchemy import func, text, tuple_
+
+from core.database import SessionLocal, engine
+from models.user import User, PlanType, ApiKey
+from models.generation import Generation
+from models.whatsapp import WhatsAppNumber
+
+def hot_queries(db):
+    """(name, query, expected index) for every hot path"""
+    now = datetime.utcnow()
+    return [
+        (
+            "generations list",
+            db.query(Generation.id, Generation.prompt, Generation.image_url, Generation.status)
+            .filter(Generation.user_id == 1)
+            .order_by(Generation.created_at.desc(), Generation.id.desc()).limit(20),
+            "ix_generations_user_id_created_at",
+        ),
+        (
+            "generations by status",
+            db.query(func.count(Generation.id)).filter(
+                Generation.user_id == 1,
+                Generation.status == "processing"
+            ),
+            "ix_generations_user_id_status",
+        ),
+        (
+            "retention sweep",
+            db.query(Generation.id, Generation.created_at, Generation.file_key).filter(
+                Generation.created_at < now,
+                tuple_(Generation.created_at, Generation.id) > tuple_(now, 0)
+            ).order_by(Generation.created_at, Generation.id).limit(1000),
+            "ix_generations_created_at_id",
+        ),
+        (
+            "webhook sender lookup",
+            db.query(WhatsAppNumber).filter(
+                WhatsAppNumber.phone_number == "+5511999999999",
+                WhatsAppNumber.is_active == True,
+                WhatsAppNumber.is_verified == True
+            ),
+            "ix_whatsapp_numbers_phone_number",
+        ),
+        (
+            "stripe customer lookup",
+            db.query(User).filter(User.subscription_id == "cus_test"),
+            "ix_users_subscription_id",
+        ),
+        (
+            "expired trials",
+            db.query(User).filter(
+                User.plan_type == PlanType.TRIAL,
+                User.trial_ends_at < now,
+                User.is_active == True
+            ),
+            "ix_users_plan_type_trial_ends_at",
+        ),
+        (
+            "api key lookup",
+            db.query(ApiKey.id, ApiKey.user_id).filter(
+                ApiKey.key_hash == "0" * 64,
+                ApiKey.revoked_at.is_(None)
+            ),
+            "ix_api_keys_key_hash",
+        ),
+    ]
+
+def plan_indexes(plan: dict) -> set:
+    """Collect every index name used in a JSON plan tree"""
+    found = set()
+    if "Index Name" in plan:
+        found.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found |= plan_indexes(child)
+    return found
+
+def with_parent_indexes(db, names: set) -> set:
+    """Add the partitioned-table index each partition index belongs to"""
+    if not names:
+        return names
+    parents = db.execute(text(
+        """
+        SELECT parent.relname
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE child.relkind = 'i' AND child.relname = ANY(:names)
+        """
+    ), {"names": list(names)}).scalars()
+    return names | set(parents)
+
+def check_query_plans() -> bool:
+    db = SessionLocal()
+    ok = True
+
+    try:
+        db.execute(text("SET enable_seqscan = off"))
+
+        for name, query, expected_index in hot_queries(db):
+            sql = query.statement.compile(
+                dialect=engine.dialect,
+                compile_kwargs={"literal_binds": True}
+            )
+            result = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+            # generations is partitioned: plans name the per-partition indexes
+            used = with_parent_indexes(db, plan_indexes(plan))
+
+            if expected_index in used:
+                print(f"OK    {name}: {expected_index}")
+            else:
+                ok = False
+                print(f"FAIL  {name}: expected {expected_index}, plan used {sorted(used) or 'no index'}")
+
+    finally:
+        db.rollback()
+        db.close()
+
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
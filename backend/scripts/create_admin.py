@@ -6,11 +6,13 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from core.database import SessionLocal
-from core.security import get_password_hash
-from models.user import User, PlanType
+from core.database import SessionLocal, init_listeners
+from core.security import get_password_hash, generate_api_key, hash_api_key
+from models.user import User, PlanType, ApiKey
 from datetime import datetime, timedelta
 
+init_listeners()
+
 def create_admin_user():
     db = SessionLocal()
     
@@ -35,18 +37,27 @@ def create_admin_user():
             is_active=True,
             is_verified=True,
             is_admin=True,
-            api_key="admin_key_" + datetime.utcnow().strftime("%Y%m%d%H%M%S"),
             trial_ends_at=datetime.utcnow() + timedelta(days=365)
         )
         
         db.add(admin)
+        db.flush()
+        
+        # Only the hash is stored: print the key now or never
+        api_key = generate_api_key()
+        db.add(ApiKey(
+            user_id=admin.id,
+            name="admin",
+            prefix=api_key[:12],
+            key_hash=hash_api_key(api_key)
+        ))
         db.commit()
         db.refresh(admin)
         
         print("Admin user created successfully:")
         print(f"Email: {admin.email}")
         print(f"Password: Admin@123")
-        print(f"API Key: {admin.api_key}")
+        print(f"API Key: {api_key}")
         
         return admin
         
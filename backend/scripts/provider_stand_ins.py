@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for Twilio, Gemini and Stripe
+
+One HTTP server that answers the calls the backend makes, with the same
+request and response shapes, so the pipeline can be load-tested and
+benchmarked offline. Latency, errors and rate limits are injected per
+provider:
+
+    --latency twilio=120:600     median:p99 in ms (log-normal)
+    --error-rate gemini=0.02     share of 500/503 responses
+    --rate-limit stripe=25       requests per second, then 429
+
+Point the backend at it with:
+
+    TWILIO_API_BASE_URL=http://localhost:8900
+    GEMINI_API_ENDPOINT=http://localhost:8900
+    STRIPE_API_BASE=http://localhost:8900
+
+Twilio status callbacks (queued -> sent -> delivered) are posted, signed
+with --twilio-auth-token, to each message's StatusCallback. Stripe
+subscriptions post a signed invoice.payment_succeeded to --stripe-webhook-url.
+Inbound WhatsApp traffic is simulated with:
+
+    POST /_stand_ins/twilio/inbound  {"from": "+5511999999999", "body": "Pizza 20% off", "count": 100}
+
+Usage: python scripts/provider_stand_ins.py [--port 8900] [--latency twilio=120:600] ...
+"""
+import os
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from twilio.request_validator import RequestValidator
+
+PROVIDERS = ("twilio", "gemini", "stripe")
+
+# Error bodies in each provider's own format
+ERRORS = {
+    "twilio": {
+        429: {"code": 20429, "message": "Too Many Requests", "status": 429},
+        500: {"code": 20500, "message": "Internal Server Error", "status": 500},
+        503: {"code": 20503, "message": "Service Unavailable", "status": 503},
+    },
+    "gemini": {
+        429: {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}},
+        500: {"error": {"code": 500, "message": "An internal error has occurred.", "status": "INTERNAL"}},
+        503: {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}},
+    },
+    "stripe": {
+        429: {"error": {"type": "rate_limit_error", "message": "Too many requests hit the API too quickly."}},
+        500: {"error": {"type": "api_error", "message": "An unknown error occurred."}},
+        503: {"error": {"type": "api_error", "message": "Service temporarily unavailable."}},
+    },
+}
+
+class RateLimit:
+    """Token bucket: rps requests per second, bursts of up to one second's worth"""
+
+    def __init__(self, rps: float):
+        self.rps = rps
+        self.tokens = self.capacity = max(1.0, rps)
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """(allowed, seconds until a token is free)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rps)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0
+        return False, max(1, math.ceil((1 - self.tokens) / self.rps))
+
+class Faults:
+    """Latency, error and rate-limit injection for one provider"""
+
+    def __init__(self, median_ms: float = 0, p99_ms: float = 0, error_rate: float = 0,
+                 rate_limit: Optional[float] = None):
+        self.median_ms = median_ms
+        # Log-normal: p99 is exp(2.326 * sigma) times the median
+        self.sigma = math.log(p99_ms / median_ms) / 2.326 if median_ms and p99_ms > median_ms else 0
+        self.error_rate = error_rate
+        self.bucket = RateLimit(rate_limit) if rate_limit else None
+
+    async def apply(self, provider: str) -> Optional[JSONResponse]:
+        """Sleep for the drawn latency; return an error response to send instead, if any"""
+        if self.bucket is not None:
+            allowed, wait = self.bucket.take()
+            if not allowed:
+                stats[f"{provider}.429"] += 1
+                return JSONResponse(ERRORS[provider][429], status_code=429, headers={"Retry-After": str(wait)})
+
+        if self.median_ms:
+            await asyncio.sleep(self.median_ms * math.exp(random.gauss(0, self.sigma)) / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            status_code = random.choice((500, 503))
+            stats[f"{provider}.{status_code}"] += 1
+            return JSONResponse(ERRORS[provider][status_code], status_code=status_code)
+
+        stats[f"{provider}.ok"] += 1
+        return None
+
+app = FastAPI(title="NexusArt provider stand-ins")
+faults: Dict[str, Faults] = {provider: Faults() for provider in PROVIDERS}
+stats: Counter = Counter()
+options = argparse.Namespace()
+background = set()
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    background.add(task)
+    task.add_done_callback(background.discard)
+
+def _sid(prefix: str) -> str:
+    return prefix + uuid.uuid4().hex
+
+# Twilio
+
+async def _post_twilio_form(url: str, params: Dict[str, str]) -> None:
+    signature = RequestValidator(options.twilio_auth_token).compute_signature(url, params)
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await client.post(url, data=params, headers={"X-Twilio-Signature": signature})
+    except httpx.HTTPError as e:
+        stats["twilio.callback_errors"] += 1
+        print(f"Callback to {url} failed: {e!r}")
+
+async def _status_callbacks(url: str, message: Dict[str, str]) -> None:
+    statuses = ["sent", "delivered"]
+    if random.random() < options.undelivered_rate:
+        statuses = ["sent", "undelivered"]
+    for status in statuses:
+        await asyncio.sleep(options.delivery_delay_ms / 1000 * random.uniform(0.5, 1.5))
+        params = {
+            "MessageSid": message["sid"],
+            "MessageStatus": status,
+            "AccountSid": message["account_sid"],
+            "From": message["from"],
+            "To": message["to"],
+        }
+        if status == "undelivered":
+            params["ErrorCode"] = "63016"
+        await _post_twilio_form(url, params)
+
+@app.post("/2010-04-01/Accounts/{account_sid}/Messages.json")
+async def twilio_create_message(account_sid: str, request: Request):
+    error = await faults["twilio"].apply("twilio")
+    if error is not None:
+        return error
+
+    form = await request.form()
+    if not form.get("To") or not form.get("From"):
+        return JSONResponse(
+            {"code": 21604, "message": "A 'To' and 'From' phone number is required.", "status": 400},
+            status_code=400
+        )
+
+    now = time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())
+    sid = _sid("SM")
+    message = {
+        "sid": sid,
+        "account_sid": account_sid,
+        "from": form["From"],
+        "to": form["To"],
+        "body": form.get("Body", ""),
+        "num_media": "1" if form.get("MediaUrl") else "0",
+        "num_segments": "1",
+        "status": "queued",
+        "direction": "outbound-api",
+        "date_created": now,
+        "date_updated": now,
+        "date_sent": None,
+        "error_code": None,
+        "error_message": None,
+        "price": None,
+        "uri": f"/2010-04-01/Accounts/{account_sid}/Messages/{sid}.json",
+    }
+
+    if form.get("StatusCallback"):
+        _spawn(_status_callbacks(form["StatusCallback"], message))
+    return JSONResponse(message, status_code=201)
+
+@app.post("/_stand_ins/twilio/inbound")
+async def twilio_simulate_inbound(request: Request):
+    """
+    Send signed inbound WhatsApp webhooks to the backend
+
+    Body: {"from", "body", "media_url", "media_type", "count", "url"}
+    """
+    data = await request.json()
+    url = data.get("url") or options.twilio_webhook_url
+    count = int(data.get("count", 1))
+    for _ in range(count):
+        params = {
+            "MessageSid": _sid("SM"),
+            "AccountSid": "AC" + "0" * 32,
+            "From": f"whatsapp:{data['from']}",
+            "To": options.twilio_whatsapp_from,
+            "Body": data.get("body", ""),
+            "NumMedia": "1" if data.get("media_url") else "0",
+        }
+        if data.get("media_url"):
+            params["MediaUrl0"] = data["media_url"]
+            params["MediaContentType0"] = data.get("media_type", "audio/ogg")
+        _spawn(_post_twilio_form(url, params))
+    return {"queued": count}
+
+# Gemini
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def gemini_generate_content(model: str, request: Request):
+    error = await faults["gemini"].apply("gemini")
+    if error is not None:
+        return error
+
+    data = await request.json()
+    prompt = " ".join(
+        part.get("text", "")
+        for content in data.get("contents", [])
+        for part in content.get("parts", [])
+    )
+    text = (
+        "Professional promotional poster, vibrant colors, bold headline, "
+        f"clean layout with price highlight. Based on: {prompt[-200:].strip()}"
+    )
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+            "safetyRatings": [],
+        }],
+        "promptFeedback": {"safetyRatings": []},
+    }
+
+# Stripe
+
+def _subscription(subscription_id: str, customer: str, form) -> Dict:
+    now = int(time.time())
+    return {
+        "id": subscription_id,
+        "object": "subscription",
+        "customer": customer,
+        "status": "active",
+        "cancel_at_period_end": (form.get("cancel_at_period_end") or "").lower() == "true",
+        "current_period_start": now,
+        "current_period_end": now + 30 * 86400,
+        "metadata": {},
+        "latest_invoice": {
+            "id": _sid("in_"),
+            "object": "invoice",
+            "customer": customer,
+            "payment_intent": {
+                "id": _sid("pi_"),
+                "object": "payment_intent",
+                "client_secret": _sid("pi_") + "_secret_" + uuid.uuid4().hex[:16],
+                "status": "requires_payment_method",
+            },
+        },
+    }
+
+async def _stripe_webhook(event_type: str, data_object: Dict) -> None:
+    payload = json.dumps({
+        "id": _sid("evt_"),
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": data_object},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(
+        options.stripe_webhook_secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    await asyncio.sleep(options.delivery_delay_ms / 1000)
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await client.post(
+                options.stripe_webhook_url,
+                content=payload,
+                headers={"Content-Type": "application/json", "Stripe-Signature": f"t={timestamp},v1={signature}"}
+            )
+    except httpx.HTTPError as e:
+        stats["stripe.callback_errors"] += 1
+        print(f"Stripe webhook failed: {e!r}")
+
+@app.post("/v1/customers")
+async def stripe_create_customer(request: Request):
+    error = await faults["stripe"].apply("stripe")
+    if error is not None:
+        return error
+
+    form = await request.form()
+    return {
+        "id": _sid("cus_"),
+        "object": "customer",
+        "email": form.get("email"),
+        "name": form.get("name"),
+        "created": int(time.time()),
+        "metadata": {},
+    }
+
+@app.post("/v1/subscriptions")
+async def stripe_create_subscription(request: Request):
+    error = await faults["stripe"].apply("stripe")
+    if error is not None:
+        return error
+
+    form = await request.form()
+    subscription = _subscription(_sid("sub_"), form.get("customer"), form)
+    if options.stripe_webhook_url:
+        invoice = {
+            "id": subscription["latest_invoice"]["id"],
+            "object": "invoice",
+            "customer": subscription["customer"],
+            "subscription": subscription["id"],
+            "lines": {"data": [{"period": {
+                "start": subscription["current_period_start"],
+                "end": subscription["current_period_end"],
+            }}]},
+        }
+        _spawn(_stripe_webhook("invoice.payment_succeeded", invoice))
+    return subscription
+
+@app.post("/v1/subscriptions/{subscription_id}")
+async def stripe_update_subscription(subscription_id: str, request: Request):
+    error = await faults["stripe"].apply("stripe")
+    if error is not None:
+        return error
+
+    form = await request.form()
+    return _subscription(subscription_id, form.get("customer") or _sid("cus_"), form)
+
+@app.get("/_stand_ins/stats")
+async def stand_in_stats():
+    """Responses served per provider and outcome"""
+    return dict(stats)
+
+def _per_provider(values, parse):
+    """['twilio=120:600', ...] -> {'twilio': parse('120:600')}; a bare value applies to all"""
+    parsed = {}
+    for value in values or []:
+        provider, _, setting = value.rpartition("=")
+        for name in ([provider] if provider else PROVIDERS):
+            if name not in PROVIDERS:
+                raise SystemExit(f"Unknown provider: {name}")
+            parsed[name] = parse(setting)
+    return parsed
+
+def _latency(value: str):
+    median, _, p99 = value.partition(":")
+    return float(median), float(p99 or median)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Twilio, Gemini and Stripe stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", action="append", metavar="[PROVIDER=]MEDIAN[:P99]",
+                        help="Response latency in ms, log-normal (repeatable)")
+    parser.add_argument("--error-rate", action="append", metavar="[PROVIDER=]RATE",
+                        help="Share of requests answered with 500/503 (repeatable)")
+    parser.add_argument("--rate-limit", action="append", metavar="[PROVIDER=]RPS",
+                        help="Requests per second before 429 (repeatable)")
+    parser.add_argument("--delivery-delay-ms", type=float, default=500,
+                        help="Mean delay between Twilio statuses / before Stripe webhooks")
+    parser.add_argument("--undelivered-rate", type=float, default=0.0,
+                        help="Share of Twilio messages that end up undelivered")
+    parser.add_argument("--twilio-auth-token", default=os.environ.get("TWILIO_AUTH_TOKEN", "test"))
+    parser.add_argument("--twilio-webhook-url", default="http://localhost:8000/api/whatsapp/webhook")
+    parser.add_argument("--twilio-whatsapp-from", default="whatsapp:+14155238886")
+    parser.add_argument("--stripe-webhook-secret", default=os.environ.get("STRIPE_WEBHOOK_SECRET", "whsec_test"))
+    parser.add_argument("--stripe-webhook-url", default="http://localhost:8000/api/subscriptions/webhook")
+    args = parser.parse_args()
+    options.__dict__.update(vars(args))
+
+    latencies = _per_provider(args.latency, _latency)
+    error_rates = _per_provider(args.error_rate, float)
+    rate_limits = _per_provider(args.rate_limit, float)
+    for provider in PROVIDERS:
+        median_ms, p99_ms = latencies.get(provider, (0, 0))
+        faults[provider] = Faults(median_ms, p99_ms, error_rates.get(provider, 0), rate_limits.get(provider))
+        print(f"{provider:7} latency {median_ms:.0f}/{p99_ms:.0f}ms  errors {error_rates.get(provider, 0):.1%}  "
+              f"rate limit {rate_limits.get(provider) or '-'}")
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
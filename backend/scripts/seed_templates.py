@@ -6,9 +6,11 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from core.database import SessionLocal
+from core.database import SessionLocal, init_listeners
 from models.generation import Template
 
+init_listeners()
+
 def seed_templates():
     db = SessionLocal()
     
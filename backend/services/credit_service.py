@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+
+from core.current_user import invalidate_user_on_commit
+from core.database import mark_user_write
+from models.user import User, CreditLedgerEntry
+
+# Core table, so the UPDATE is not routed through ORM session synchronization
+# (loaded User objects keep their old credits_used; use the returned balance)
+users = User.__table__
+
+
+class InsufficientCredits(Exception):
+    """The user's credit limit does not cover the reservation"""
+
+
+@dataclass
+class CreditBalance:
+    credits_used: int
+    credits_limit: int
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.credits_limit - self.credits_used)
+
+
+class CreditService:
+    """
+    Atomic credit accounting
+
+    Every movement is a single conditional ``UPDATE users ... RETURNING``
+    plus an insert into the append-only ``credit_ledger``, both on the
+    caller's transaction. Callers should commit right away so the user row
+    is locked for one statement, not for the whole generation.
+
+    Usage::
+
+        balance = CreditService(db).reserve(user.id, generation_id=generation.id)
+        db.commit()
+        try:
+            ...generate...
+        except Exception:
+            CreditService(db).refund(user.id, generation_id=generation.id)
+            db.commit()
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def reserve(self, user_id: int, amount: int = 1, generation_id: Optional[int] = None,
+                reason: Optional[str] = None) -> CreditBalance:
+        """
+        Consume credits if the limit allows it
+
+        Args:
+            user_id: User ID
+            amount: Credits to consume
+            generation_id: Generation the credits pay for
+            reason: Free-text note for the ledger
+
+        Returns:
+            Balance after the reservation
+
+        Raises:
+            InsufficientCredits: The limit would be exceeded (nothing changes)
+        """
+        used = func.coalesce(users.c.credits_used, 0)
+        row = self.db.execute(
+            update(users)
+            .where(users.c.id == user_id, used + amount <= users.c.credits_limit)
+            .values(credits_used=used + amount, updated_at=func.now())
+            .returning(users.c.credits_used, users.c.credits_limit)
+        ).first()
+
+        if row is None:
+            raise InsufficientCredits(f"User {user_id} cannot reserve {amount} credit(s)")
+
+        return self._record(user_id, "reserve", amount, row, generation_id, reason)
+
+    def refund(self, user_id: int, amount: int = 1, generation_id: Optional[int] = None,
+               reason: Optional[str] = None) -> Optional[CreditBalance]:
+        """
+        Give back reserved credits (never below zero)
+
+        Returns:
+            Balance after the refund, or None if the user no longer exists
+        """
+        used = func.coalesce(users.c.credits_used, 0)
+        row = self.db.execute(
+            update(users)
+            .where(users.c.id == user_id)
+            .values(credits_used=func.greatest(used - amount, 0), updated_at=func.now())
+            .returning(users.c.credits_used, users.c.credits_limit)
+        ).first()
+
+        if row is None:
+            return None
+
+        return self._record(user_id, "refund", -amount, row, generation_id, reason)
+
+    def _record(self, user_id: int, kind: str, amount: int, row, generation_id: Optional[int],
+                reason: Optional[str]) -> CreditBalance:
+        credits_used, credits_limit = row
+        mark_user_write(self.db, user_id)
+        invalidate_user_on_commit(self.db, user_id)
+        self.db.execute(
+            insert(CreditLedgerEntry).values(
+                user_id=user_id,
+                generation_id=generation_id,
+                kind=kind,
+                amount=amount,
+                credits_used_after=credits_used,
+                credits_limit=credits_limit or 0,
+                reason=reason,
+            )
+        )
+
+        return CreditBalance(credits_used=credits_used, credits_limit=credits_limit or 0)
@@ -4,6 +4,8 @@ import json
 import re
 from datetime import datetime
 
+from core.config import settings
+
 class GeminiService:
     def __init__(self, api_key: str):
         """
@@ -12,7 +14,15 @@ class GeminiService:
         Args:
             api_key: Google AI API key
         """
-        genai.configure(api_key=api_key)
+        if settings.GEMINI_API_ENDPOINT:
+            # Local stand-in (or proxy): plain REST instead of gRPC
+            genai.configure(
+                api_key=api_key,
+                transport="rest",
+                client_options={"api_endpoint": settings.GEMINI_API_ENDPOINT}
+            )
+        else:
+            genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-pro')
         self.vision_model = genai.GenerativeModel('gemini-pro-vision')
         
@@ -0,0 +1,209 @@
+import gzip
+import re
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional, Tuple, Union
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.generation import Generation
+from services.storage_service import StorageService
+
+# generations is range-partitioned by created_at month (see alembic 006):
+# generations_y2026m10 holds October 2026, generations_default catches rows
+# no monthly partition covers yet
+PARENT = Generation.__tablename__
+DEFAULT_PARTITION = f"{PARENT}_default"
+_PARTITION_NAME = re.compile(rf"^{PARENT}_y(\d{{4}})m(\d{{2}})$")
+
+DETACH_LOCK_TIMEOUT = "5s"
+
+Bind = Union[Session, Connection]
+
+
+def month_start(value: Union[date, datetime]) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_y{month.year:04d}m{month.month:02d}"
+
+
+@dataclass
+class MonthPartition:
+    name: str
+    month: date
+    attached: bool
+
+    @property
+    def end(self) -> date:
+        """Exclusive upper bound"""
+        return add_months(self.month, 1)
+
+
+def create_partition(db: Bind, month: date) -> bool:
+    """
+    Create the partition for a month if it does not exist
+
+    Postgres refuses to attach a range the default partition already has
+    rows for, so such months are skipped instead of failing.
+
+    Returns:
+        False if the month was skipped
+    """
+    start, end = month_start(month), add_months(month_start(month), 1)
+    stranded = db.execute(
+        text(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= :start AND created_at < :end)'),
+        {"start": start, "end": end}
+    ).scalar()
+    if stranded:
+        return False
+
+    db.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" PARTITION OF "{PARENT}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return True
+
+
+def ensure_partitions(db: Bind, months_ahead: Optional[int] = None, today: Optional[date] = None) -> List[date]:
+    """
+    Create the default partition and monthly partitions from the current
+    month through ``months_ahead`` months ahead (caller commits)
+
+    Returns:
+        Months skipped because the default partition holds rows for them
+    """
+    if months_ahead is None:
+        months_ahead = settings.PARTITION_MONTHS_AHEAD
+    current = month_start(today or datetime.utcnow())
+
+    db.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{PARENT}" DEFAULT'))
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    return [month for month in months if not create_partition(db, month)]
+
+
+def list_partitions(db: Bind) -> List[MonthPartition]:
+    """
+    Monthly partitions, oldest first, including ones already detached
+    (a retention run that stopped between detach and drop)
+    """
+    rows = db.execute(text(
+        """
+        SELECT c.relname, i.inhparent IS NOT NULL
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.relkind = 'r'
+          AND c.relnamespace = current_schema()::regnamespace
+          AND c.relname LIKE :pattern
+        """
+    ), {"pattern": f"{PARENT}\\_y%"}).all()
+
+    partitions = []
+    for name, attached in rows:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append(MonthPartition(name=name, month=month, attached=attached))
+    return sorted(partitions, key=lambda partition: partition.month)
+
+
+def expired_partitions(db: Bind, cutoff: datetime) -> List[MonthPartition]:
+    """Partitions whose whole month is older than the cutoff"""
+    return [
+        partition for partition in list_partitions(db)
+        if datetime.combine(partition.end, datetime.min.time()) <= cutoff
+    ]
+
+
+def archive_key(partition: MonthPartition) -> str:
+    return f"{settings.RETENTION_ARCHIVE_PREFIX}/{partition.name}.ndjson.gz"
+
+
+def export_partition(db: Session, partition: MonthPartition, storage: StorageService) -> Tuple[Optional[str], int]:
+    """
+    Export a partition to storage as gzipped NDJSON (one generation per line)
+
+    Rows are streamed with a server-side cursor into a spooled temp file,
+    so memory stays bounded. The generated prompt_tsv column is left out.
+
+    Returns:
+        (storage key, number of rows); the key is None for an empty partition
+    """
+    key = archive_key(partition)
+    rows = 0
+
+    result = db.execute(
+        text(f"SELECT (to_jsonb(p) - 'prompt_tsv')::text FROM \"{partition.name}\" p ORDER BY p.created_at, p.id")
+        .execution_options(yield_per=settings.INTEGRITY_FETCH_SIZE)
+    )
+
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as buffer:
+        with gzip.GzipFile(fileobj=buffer, mode="wb") as archive:
+            for (line,) in result:
+                archive.write(line.encode())
+                archive.write(b"\n")
+                rows += 1
+        if not rows:
+            return None, 0
+        buffer.seek(0)
+        storage.upload_archive(key, buffer)
+
+    return key, rows
+
+
+def drop_partition(db: Session, partition: MonthPartition, storage: StorageService) -> Tuple[int, List[str]]:
+    """
+    Remove a month of generations: detach, unlink messages, delete files, drop
+
+    The partition is detached (and committed) first, so the app stops
+    seeing its rows before their files disappear. Each step is safe to
+    repeat if the run is interrupted.
+
+    Returns:
+        (number of rows dropped, file keys that could not be deleted)
+    """
+    if partition.attached:
+        # Plain DETACH (CONCURRENTLY is not allowed while a default partition
+        # exists) takes an exclusive lock on generations; give up rather than
+        # queue behind a long transaction and block every query meanwhile
+        db.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+        db.execute(text(f'ALTER TABLE "{PARENT}" DETACH PARTITION "{partition.name}"'))
+        db.commit()
+
+    # Messages keep their history, they just lose the link
+    db.execute(text(
+        f'UPDATE whatsapp_messages SET generation_id = NULL '
+        f'WHERE generation_id IN (SELECT id FROM "{partition.name}")'
+    ))
+    db.commit()
+
+    rows = db.execute(text(f'SELECT count(*) FROM "{partition.name}"')).scalar()
+    failed: List[str] = []
+    result = db.execute(
+        text(f'SELECT file_key FROM "{partition.name}" WHERE file_key IS NOT NULL')
+        .execution_options(yield_per=settings.RETENTION_BATCH_SIZE)
+    )
+    for batch in result.partitions():
+        failed.extend(storage.delete_images([file_key for (file_key,) in batch]))
+
+    db.execute(text(f'DROP TABLE "{partition.name}"'))
+    db.commit()
+
+    return rows, failed
+
+
+@event.listens_for(Generation.__table__, "after_create")
+def _create_initial_partitions(target, connection, **kw) -> None:
+    """create_all: a partitioned table cannot take rows until it has partitions"""
+    if connection.dialect.name == "postgresql":
+        ensure_partitions(connection)
@@ -0,0 +1,71 @@
+import html
+import re
+from typing import Optional
+
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.sql.elements import ColumnElement
+
+from models.generation import Generation
+
+# Same configuration as the prompt_tsv generated column, inlined so the
+# asyncpg driver does not cast it to VARCHAR
+SEARCH_CONFIG = literal_column("'portuguese'::regconfig")
+
+# Control characters never appear in prompts, so they can mark matches
+# before the text is HTML-escaped
+_START, _STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = f"StartSel={_START}, StopSel={_STOP}, MaxWords=35, MinWords=15"
+
+
+class PromptSearch:
+    """
+    Prompt search for the generation list
+
+    Matches a row if the Portuguese full-text vector matches the
+    web-search style query (stemmed words, "quoted phrases", -exclusions),
+    if the prompt contains the text (trigram index), or, for digits, if the
+    id matches.
+    """
+
+    def __init__(self, search: str):
+        self.search = search
+        self.tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, search)
+
+    def condition(self) -> ColumnElement:
+        conditions = [
+            Generation.prompt_tsv.op("@@")(self.tsquery),
+            Generation.prompt.icontains(self.search, autoescape=True),
+        ]
+        if self.search.isdigit():
+            conditions.append(Generation.id == int(self.search))
+        return or_(*conditions)
+
+    def rank(self) -> ColumnElement:
+        """Cover-density rank (0 for substring-only matches)"""
+        return func.ts_rank_cd(Generation.prompt_tsv, self.tsquery)
+
+    def headline(self) -> ColumnElement:
+        """Prompt fragments with word matches marked (computed only for returned rows)"""
+        return func.ts_headline(SEARCH_CONFIG, Generation.prompt, self.tsquery, HEADLINE_OPTIONS)
+
+    def highlight(self, prompt: str, headline: Optional[str]) -> Optional[str]:
+        """
+        HTML-safe highlight with matches wrapped in <mark>
+
+        Uses the full-text headline when it marked a word, otherwise marks
+        literal substring matches in the prompt.
+        """
+        if headline and _START in headline:
+            return html.escape(headline).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+        pattern = re.compile(re.escape(self.search), re.IGNORECASE)
+        parts = []
+        last = 0
+        for match in pattern.finditer(prompt or ""):
+            parts.append(html.escape(prompt[last:match.start()]))
+            parts.append(f"<mark>{html.escape(match.group())}</mark>")
+            last = match.end()
+        if not parts:
+            return None
+        parts.append(html.escape(prompt[last:]))
+        return "".join(parts)
@@ -0,0 +1,180 @@
+from datetime import date
+from typing import Any, Dict, Optional
+
+from sqlalchemy import Date, case, cast, event, func, inspect, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.generation import Generation, GenerationDailyStats
+
+STATUS_COLUMNS = {"completed": "completed", "failed": "failed"}
+INPUT_TYPE_COLUMNS = {"text": "text_count", "audio": "audio_count", "web": "web_count"}
+COUNTER_COLUMNS = [
+    "generations", "completed", "failed",
+    "text_count", "audio_count", "web_count",
+    "credits_used", "processing_time_sum", "processing_time_count",
+]
+
+
+def _history(target: Generation, attr: str):
+    """(old, new) values of an attribute in the current flush"""
+    history = inspect(target).attrs[attr].history
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new, history.has_changes()
+
+
+def _apply(connection, generation_id: int, deltas: Dict[str, Any]) -> None:
+    """
+    Add deltas to the rollup row of a generation's (user, creation day)
+
+    The day comes from the stored row, so server-side created_at defaults
+    are honoured.
+    """
+    deltas = {column: value for column, value in deltas.items() if value}
+    if not deltas:
+        return
+
+    columns = list(deltas)
+    source = select(
+        Generation.user_id,
+        cast(Generation.created_at, Date),
+        *[literal(deltas[column]) for column in columns]
+    ).where(Generation.id == generation_id)
+
+    stmt = insert(GenerationDailyStats).from_select(["user_id", "day", *columns], source)
+    table = GenerationDailyStats.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day],
+        set_={column: table.c[column] + stmt.excluded[column] for column in columns},
+    )
+    connection.execute(stmt)
+
+
+@event.listens_for(Generation, "after_insert")
+def _generation_inserted(mapper, connection, target: Generation) -> None:
+    deltas: Dict[str, Any] = {"generations": 1, "credits_used": target.credits_used or 0}
+
+    if target.status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[target.status]] = 1
+    if target.input_type in INPUT_TYPE_COLUMNS:
+        deltas[INPUT_TYPE_COLUMNS[target.input_type]] = 1
+    if target.processing_time is not None:
+        deltas["processing_time_sum"] = target.processing_time
+        deltas["processing_time_count"] = 1
+
+    _apply(connection, target.id, deltas)
+
+
+@event.listens_for(Generation, "after_update")
+def _generation_updated(mapper, connection, target: Generation) -> None:
+    deltas: Dict[str, Any] = {}
+
+    old, new, changed = _history(target, "status")
+    if changed and old != new:
+        if old in STATUS_COLUMNS:
+            deltas[STATUS_COLUMNS[old]] = -1
+        if new in STATUS_COLUMNS:
+            deltas[STATUS_COLUMNS[new]] = deltas.get(STATUS_COLUMNS[new], 0) + 1
+
+    old, new, changed = _history(target, "credits_used")
+    if changed:
+        deltas["credits_used"] = (new or 0) - (old or 0)
+
+    old, new, changed = _history(target, "processing_time")
+    if changed:
+        deltas["processing_time_sum"] = (new or 0) - (old or 0)
+        deltas["processing_time_count"] = (new is not None) - (old is not None)
+
+    _apply(connection, target.id, deltas)
+
+
+def rebuild_daily_stats(db: Session, user_id: Optional[int] = None, since: Optional[date] = None) -> int:
+    """
+    Recompute rollup rows from the generations table (backfill / repair)
+
+    Days with no remaining generations (e.g. purged by retention) are left
+    untouched.
+
+    Args:
+        db: Database session (caller commits)
+        user_id: Limit to one user
+        since: Limit to days on or after this date
+
+    Returns:
+        Number of (user, day) rows written
+    """
+    day = cast(Generation.created_at, Date)
+
+    def count_if(condition):
+        return func.count().filter(condition)
+
+    source = select(
+        Generation.user_id,
+        day,
+        func.count(),
+        count_if(Generation.status == "completed"),
+        count_if(Generation.status == "failed"),
+        count_if(Generation.input_type == "text"),
+        count_if(Generation.input_type == "audio"),
+        count_if(Generation.input_type == "web"),
+        func.coalesce(func.sum(Generation.credits_used), 0),
+        func.coalesce(func.sum(Generation.processing_time), 0),
+        func.count(Generation.processing_time),
+    ).where(Generation.created_at.isnot(None)).group_by(Generation.user_id, day)
+
+    if user_id is not None:
+        source = source.where(Generation.user_id == user_id)
+    if since is not None:
+        source = source.where(Generation.created_at >= since)
+
+    stmt = insert(GenerationDailyStats).from_select(["user_id", "day", *COUNTER_COLUMNS], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={column: stmt.excluded[column] for column in COUNTER_COLUMNS},
+    )
+    return db.execute(stmt).rowcount
+
+
+async def get_user_stats(db: AsyncSession, user_id: int, start_date: date) -> Dict[str, Any]:
+    """
+    All-time and period totals for a user in one scan of their rollup rows
+
+    Returns:
+        Dict of summed counters plus ``period_generations``
+    """
+    stats = GenerationDailyStats
+    stmt = select(
+        func.coalesce(func.sum(stats.generations), 0),
+        func.coalesce(func.sum(case((stats.day >= start_date, stats.generations), else_=0)), 0),
+        func.coalesce(func.sum(stats.completed), 0),
+        func.coalesce(func.sum(stats.failed), 0),
+        func.coalesce(func.sum(stats.text_count), 0),
+        func.coalesce(func.sum(stats.audio_count), 0),
+        func.coalesce(func.sum(stats.web_count), 0),
+        func.coalesce(func.sum(stats.credits_used), 0),
+        func.coalesce(func.sum(stats.processing_time_sum), 0),
+        func.coalesce(func.sum(stats.processing_time_count), 0),
+    ).where(stats.user_id == user_id)
+    row = (await db.execute(stmt)).one()
+
+    (total, period, completed, failed, text_count, audio_count, web_count,
+     credits_used, processing_time_sum, processing_time_count) = row
+
+    return {
+        "total_generations": int(total),
+        "period_generations": int(period),
+        "successful_generations": int(completed),
+        "failed_generations": int(failed),
+        "total_credits_used": int(credits_used),
+        "avg_processing_time": (
+            float(processing_time_sum) / processing_time_count
+            if processing_time_count else 0.0
+        ),
+        "input_type_stats": {
+            input_type: int(value)
+            for input_type, value in (("text", text_count), ("audio", audio_count), ("web", web_count))
+            if value
+        },
+    }
@@ -0,0 +1,224 @@
+from typing import Dict, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, status
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from core.config import settings
+from services.storage_service import StorageService
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against the current ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison is allowed for If-None-Match
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class RangeNotSatisfiable(Exception):
+    """A valid byte range that lies entirely outside the file (416)"""
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header
+
+    Per RFC 9110 an invalid or unsupported Range (other units, multiple
+    ranges, malformed positions) is ignored and the full file is served.
+
+    Returns:
+        (start, end) inclusive offsets, or None to ignore the header
+
+    Raises:
+        RangeNotSatisfiable: The range is valid but no byte of the file is in it
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_str, sep, end_str = spec.strip().partition("-")
+    start_str, end_str = start_str.strip(), end_str.strip()
+    if not sep or not (start_str or end_str):
+        return None
+    if not all(part.isdigit() for part in (start_str, end_str) if part):
+        return None
+
+    if start_str:
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+        if end_str and end < start:
+            return None
+        if start >= size:
+            raise RangeNotSatisfiable()
+    else:
+        # Suffix range: last N bytes
+        length = int(end_str)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        start = max(0, size - length)
+        end = size - 1
+
+    return start, min(end, size - 1)
+
+
+class MediaFileResponse(Response):
+    """
+    Send a byte range of a local file
+
+    Uses the ASGI ``http.response.zerocopysend`` extension (sendfile) when the
+    server offers it, and falls back to chunked reads otherwise.
+    """
+
+    chunk_size = settings.MEDIA_CHUNK_SIZE
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.path = path
+        self.start = start
+        self.length = max(0, end - start + 1)
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        headers = dict(headers or {})
+        headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as f:
+                await f.seek(self.start)
+                remaining = self.length
+                while remaining > 0:
+                    chunk = await f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+
+class MediaService:
+    """
+    Serves locally stored media with HTTP caching
+
+    Every response carries a strong ETag and ``Cache-Control: immutable``
+    (keys are never rewritten). With ``MEDIA_X_ACCEL_REDIRECT`` enabled the
+    app only authorizes the request and nginx streams the file, e.g.::
+
+        location /protected-uploads/ {
+            internal;
+            alias /app/uploads/;
+            sendfile on;
+        }
+    """
+
+    def __init__(self, storage: Optional[StorageService] = None):
+        self.storage = storage or StorageService()
+
+    def serve(
+        self,
+        request: Request,
+        file_key: str,
+        cache_control: Optional[str] = None,
+        download_name: Optional[str] = None,
+    ) -> Response:
+        """
+        Build the response for a stored file
+
+        Args:
+            request: Incoming request (conditional and Range headers are honoured)
+            file_key: Storage key
+            cache_control: Cache-Control value, public/immutable by default
+            download_name: If set, sent as an attachment with this filename
+
+        Returns:
+            200, 206, 304 or 416 response (or an X-Accel-Redirect hand-off)
+        """
+        stored = self.storage.stat(file_key)
+        if not stored:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+        headers = {
+            "ETag": stored.etag,
+            "Cache-Control": cache_control or f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable",
+            "Accept-Ranges": "bytes",
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), stored.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if download_name:
+            headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+
+        if settings.MEDIA_X_ACCEL_REDIRECT:
+            # nginx handles Range and sendfile itself
+            headers["X-Accel-Redirect"] = f"{settings.MEDIA_X_ACCEL_PREFIX.rstrip('/')}/{stored.key}"
+            return Response(status_code=status.HTTP_200_OK, headers=headers, media_type=stored.content_type)
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range.strip() == stored.etag):
+            try:
+                byte_range = parse_range(range_header, stored.size)
+            except RangeNotSatisfiable:
+                headers["Content-Range"] = f"bytes */{stored.size}"
+                return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        else:
+            byte_range = None
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+        else:
+            start, end = 0, stored.size - 1
+            status_code = status.HTTP_200_OK
+
+        return MediaFileResponse(
+            self.storage.local_path(stored.key),
+            start,
+            end,
+            status_code=status_code,
+            headers=headers,
+            media_type=stored.content_type,
+        )
@@ -0,0 +1,203 @@
+import io
+import os
+import threading
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from core.config import settings
+
+# One client per process. boto3 clients are thread-safe, but they must not
+# be shared across fork() (Celery prefork workers), so the cache is keyed on
+# the pid that created it.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client with a tuned connection pool
+
+    Returns:
+        boto3 S3 client
+    """
+    global _client, _client_pid
+
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            config = Config(
+                region_name=settings.AWS_REGION,
+                signature_version="s3v4",
+                max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=settings.S3_CONNECT_TIMEOUT,
+                read_timeout=settings.S3_READ_TIMEOUT,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+                # Local stand-ins (MinIO, LocalStack) need path-style URLs
+                s3={"addressing_style": "path" if settings.AWS_S3_ENDPOINT_URL else "auto"},
+            )
+            _client = boto3.session.Session().client(
+                "s3",
+                endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                config=config,
+            )
+            _client_pid = os.getpid()
+
+    return _client
+
+
+class S3Transfer:
+    """
+    Thin transfer layer over the shared S3 client
+
+    Small objects go out in a single PutObject; anything above
+    ``S3_MULTIPART_THRESHOLD`` is uploaded as a concurrent multipart upload
+    straight from memory, without temp files.
+    """
+
+    def __init__(self, bucket: Optional[str] = None):
+        self.bucket = bucket or settings.AWS_S3_BUCKET
+        self.client = get_s3_client()
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+
+    def _extra_args(self, content_type: str, cache_control: Optional[str]) -> Dict[str, str]:
+        extra = {"ContentType": content_type}
+        if cache_control:
+            extra["CacheControl"] = cache_control
+        return extra
+
+    def upload_bytes(self, key: str, data: bytes, content_type: str = "image/jpeg",
+                     cache_control: Optional[str] = None) -> None:
+        """
+        Upload an in-memory object
+
+        Args:
+            key: Object key
+            data: Object bytes
+            content_type: MIME type
+            cache_control: Cache-Control header stored with the object
+        """
+        if len(data) < settings.S3_MULTIPART_THRESHOLD:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=data,
+                **self._extra_args(content_type, cache_control),
+            )
+        else:
+            self.upload_fileobj(key, io.BytesIO(data), content_type, cache_control)
+
+    def upload_fileobj(self, key: str, fileobj: BinaryIO, content_type: str = "image/jpeg",
+                       cache_control: Optional[str] = None) -> None:
+        """Upload a file-like object, using multipart above the threshold"""
+        self.client.upload_fileobj(
+            fileobj,
+            self.bucket,
+            key,
+            ExtraArgs=self._extra_args(content_type, cache_control),
+            Config=self.transfer_config,
+        )
+
+    def download_bytes(self, key: str) -> bytes:
+        """Download an object into memory (ranged GETs run concurrently)"""
+        buffer = io.BytesIO()
+        self.client.download_fileobj(self.bucket, key, buffer, Config=self.transfer_config)
+        return buffer.getvalue()
+
+    def iter_object(self, key: str, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """Stream an object body in chunks"""
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        body = response["Body"]
+        try:
+            for chunk in body.iter_chunks(chunk_size or settings.MEDIA_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def delete(self, key: str) -> None:
+        """Delete a single object"""
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys: List[str]) -> List[str]:
+        """
+        Delete objects with DeleteObjects, 1000 keys per request
+
+        Args:
+            keys: Object keys
+
+        Returns:
+            Keys that could not be deleted
+        """
+        failed: List[str] = []
+        for i in range(0, len(keys), 1000):
+            batch = keys[i:i + 1000]
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            failed.extend(error["Key"] for error in response.get("Errors", []))
+        return failed
+
+    def iter_keys(self, prefix: str = "") -> Iterator[Tuple[str, datetime]]:
+        """
+        List keys page by page with ListObjectsV2
+
+        S3 returns keys in UTF-8 binary order, so the stream is sorted.
+
+        Yields:
+            (key, last_modified) tuples
+        """
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, PaginationConfig={"PageSize": 1000}):
+            for obj in page.get("Contents", []):
+                yield obj["Key"], obj["LastModified"].replace(tzinfo=None)
+
+    def presigned_get_url(self, key: str, expires_in: Optional[int] = None,
+                          download_name: Optional[str] = None) -> str:
+        """
+        Create a presigned GET URL so clients fetch bytes directly from S3
+
+        Args:
+            key: Object key
+            expires_in: Validity in seconds
+            download_name: Optional filename for Content-Disposition
+
+        Returns:
+            Presigned URL
+        """
+        params = {"Bucket": self.bucket, "Key": key}
+        if download_name:
+            params["ResponseContentDisposition"] = f'attachment; filename="{download_name}"'
+
+        # Signing is local (no network call), so this is cheap per request
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params=params,
+            ExpiresIn=expires_in or settings.S3_PRESIGNED_URL_EXPIRES,
+        )
+
+    def object_url(self, key: str) -> str:
+        """Canonical (unsigned) URL of an object"""
+        if settings.AWS_S3_ENDPOINT_URL:
+            return f"{settings.AWS_S3_ENDPOINT_URL.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{settings.AWS_REGION}.amazonaws.com/{key}"
+
+    def ensure_bucket(self) -> None:
+        """Create the bucket if missing (local stand-ins start empty)"""
+        existing: List[str] = [b["Name"] for b in self.client.list_buckets().get("Buckets", [])]
+        if self.bucket not in existing:
+            self.client.create_bucket(Bucket=self.bucket)
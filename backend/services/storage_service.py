@@ -1,6 +1,15 @@
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_init
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, date
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+import hashlib
+import io
 import os
+import shutil
+import uuid
 from core.config import settings
 
 # Create Celery instance
@@ -12,7 +21,8 @@ celery_app = Celery(
         'tasks.transcription_tasks',
         'tasks.generation_tasks',
         'tasks.notification_tasks',
-        'tasks.cleanup_tasks'
+        'tasks.cleanup_tasks',
+        'tasks.whatsapp_tasks'
     ]
 )
 
@@ -29,6 +39,13 @@ celery_app.conf.update(
     worker_max_tasks_per_child=1000,
     worker_prefetch_multiplier=1,
     
+    # Outbound WhatsApp sends get their own queue, so a backlog of paced or
+    # retried messages never delays transcription or generation. Workers
+    # must consume it: celery worker -Q celery,whatsapp_outbound
+    task_routes={
+        'tasks.transcription_tasks.send_whatsapp_message': {'queue': settings.WHATSAPP_OUTBOUND_QUEUE},
+    },
+    
     # Beat schedule for periodic tasks
     beat_schedule={
         # Clean up old temporary files every day at 3 AM
@@ -43,12 +60,36 @@ celery_app.conf.update(
             'schedule': crontab(hour=8, minute=0),
         },
         
+        # Create upcoming generations partitions every day at 1 AM
+        'ensure-generation-partitions': {
+            'task': 'tasks.cleanup_tasks.ensure_generation_partitions',
+            'schedule': crontab(hour=1, minute=0),
+        },
+        
+        # Delete generations past the retention period every day at 4 AM
+        'cleanup-old-generations': {
+            'task': 'tasks.cleanup_tasks.cleanup_old_generations',
+            'schedule': crontab(hour=4, minute=0),
+        },
+        
+        # Reconcile database file keys with storage every Sunday at 5 AM
+        'validate-storage-integrity': {
+            'task': 'tasks.cleanup_tasks.validate_storage_integrity',
+            'schedule': crontab(day_of_week=0, hour=5, minute=0),
+        },
+        
         # Check for expired trials every 6 hours
         'check-expired-trials': {
             'task': 'tasks.notification_tasks.check_expired_trials',
             'schedule': crontab(hour='*/6', minute=0),
         },
         
+        # Apply buffered WhatsApp status callbacks in batches
+        'flush-whatsapp-statuses': {
+            'task': 'tasks.whatsapp_tasks.flush_delivery_statuses',
+            'schedule': settings.WHATSAPP_STATUS_FLUSH_SECONDS,
+        },
+        
         # Backup database every Sunday at 2 AM
         'backup-database': {
             'task': 'tasks.cleanup_tasks.backup_database',
@@ -57,5 +98,267 @@ celery_app.conf.update(
     }
 )
 
+
+@worker_init.connect
+def register_session_listeners(sender=None, **kwargs):
+    """Register the cache and stats listeners before the pool forks"""
+    from core.database import init_listeners
+    init_listeners()
+
+
+def build_media_key(extension: str = "jpg", prefix: str = "generations") -> str:
+    """
+    Build a sharded storage key for a new file
+
+    ``date`` layout: generations/2024/05/31/<id>.jpg
+    ``hash`` layout: generations/3f/a2/<id>.jpg
+
+    Either way no directory ends up holding more than a day's worth (or
+    1/65536th) of the files, and old date directories can be dropped whole.
+    """
+    name = uuid.uuid4().hex
+    if settings.MEDIA_SHARDING == "hash":
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        shard = f"{digest[:2]}/{digest[2:4]}"
+    else:
+        shard = datetime.utcnow().strftime("%Y/%m/%d")
+    return f"{prefix}/{shard}/{name}.{extension}"
+
+
+def iter_date_shards(base_dir: str, prefix: str = "generations") -> Iterator[Tuple[date, str]]:
+    """
+    Yield (day, path) for every date-sharded directory under the upload dir
+
+    Used by cleanup to drop whole days instead of stat'ing every file.
+    """
+    root = os.path.join(base_dir, prefix)
+    for year in _numeric_subdirs(root, 4):
+        for month in _numeric_subdirs(os.path.join(root, year), 2):
+            for day in _numeric_subdirs(os.path.join(root, year, month), 2):
+                try:
+                    shard_date = date(int(year), int(month), int(day))
+                except ValueError:
+                    continue
+                yield shard_date, os.path.join(root, year, month, day)
+
+
+def _numeric_subdirs(path: str, width: int):
+    try:
+        with os.scandir(path) as entries:
+            return sorted(
+                e.name for e in entries
+                if e.is_dir() and e.name.isdigit() and len(e.name) == width
+            )
+    except FileNotFoundError:
+        return []
+
+
+@dataclass
+class StoredObject:
+    """Basic information about a stored file, used for HTTP caching."""
+    key: str
+    size: int
+    etag: str  # strong validator, already quoted
+    content_type: str = "image/jpeg"
+
+
+class StorageService:
+    """
+    Storage backend for generated images.
+
+    Uses S3 when AWS credentials are configured, otherwise files are kept
+    under ``settings.UPLOAD_DIR`` and served from ``/uploads``.
+    """
+
+    def __init__(self):
+        self.use_s3 = bool(settings.AWS_ACCESS_KEY_ID)
+        self.bucket = settings.AWS_S3_BUCKET
+        self.base_dir = settings.absolute_upload_dir
+        self._s3 = None
+
+    @property
+    def s3(self):
+        """Lazy S3 transfer layer (only needed when S3 is enabled)"""
+        if self._s3 is None:
+            from services.s3_transfer import S3Transfer
+            self._s3 = S3Transfer(self.bucket)
+        return self._s3
+
+    def local_path(self, file_key: str, base_dir: Optional[str] = None) -> str:
+        """Resolve a storage key to a path inside the upload dir (or base_dir)"""
+        base_dir = base_dir or self.base_dir
+        path = os.path.realpath(os.path.join(base_dir, file_key))
+        if not path.startswith(os.path.realpath(base_dir) + os.sep):
+            raise ValueError(f"Invalid file key: {file_key}")
+        return path
+
+    def optimize_image(self, image_data: bytes, max_size: int = 1080, quality: int = 85) -> bytes:
+        """
+        Resize and re-encode an image as JPEG for WhatsApp
+
+        Args:
+            image_data: Original image bytes
+            max_size: Maximum width/height in pixels
+            quality: JPEG quality
+
+        Returns:
+            Optimized JPEG bytes
+        """
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image_data))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((max_size, max_size))
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+    def upload_image(self, image_data: bytes, user_id: int, content_type: str = "image/jpeg") -> Tuple[str, str]:
+        """
+        Store an image
+
+        Args:
+            image_data: Image bytes
+            user_id: Owner of the image
+            content_type: MIME type
+
+        Returns:
+            Tuple of (file_url, file_key)
+        """
+        extension = "png" if content_type == "image/png" else "jpg"
+        file_key = build_media_key(extension)
+
+        if self.use_s3:
+            self.s3.upload_bytes(
+                file_key,
+                image_data,
+                content_type=content_type,
+                cache_control=f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable",
+            )
+            file_url = self.s3.object_url(file_key)
+        else:
+            path = self.local_path(file_key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(image_data)
+            file_url = f"/uploads/{file_key}"
+
+        return file_url, file_key
+
+    def upload_archive(self, file_key: str, fileobj: BinaryIO, content_type: str = "application/gzip") -> None:
+        """
+        Store a data export (e.g. an archived partition) from a file object
+
+        Archives hold every column of users' generations, so they are kept
+        away from what is public: on S3 in RETENTION_ARCHIVE_BUCKET when
+        set, and no URL is ever built for them; locally under ARCHIVE_DIR,
+        which /uploads does not serve and cleanup does not sweep.
+        """
+        if self.use_s3:
+            transfer = self.s3
+            if settings.RETENTION_ARCHIVE_BUCKET:
+                from services.s3_transfer import S3Transfer
+                transfer = S3Transfer(settings.RETENTION_ARCHIVE_BUCKET)
+            transfer.upload_fileobj(file_key, fileobj, content_type=content_type)
+        else:
+            path = self.local_path(file_key, settings.absolute_archive_dir)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(fileobj, f)
+
+    def delete_image(self, file_key: str) -> None:
+        """Delete a stored image (missing files are ignored)"""
+        if self.use_s3:
+            self.s3.delete(file_key)
+        else:
+            try:
+                os.unlink(self.local_path(file_key))
+            except FileNotFoundError:
+                pass
+
+    def delete_images(self, file_keys: List[str], max_workers: int = 16) -> List[str]:
+        """
+        Delete many images at once
+
+        S3 uses batched DeleteObjects calls; local files are unlinked in
+        parallel since each unlink is a blocking syscall.
+
+        Returns:
+            Keys that could not be deleted
+        """
+        if not file_keys:
+            return []
+
+        if self.use_s3:
+            return self.s3.delete_many(file_keys)
+
+        def _unlink(file_key: str) -> Optional[str]:
+            try:
+                os.unlink(self.local_path(file_key))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                return file_key
+            return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [key for key in executor.map(_unlink, file_keys) if key]
+
+    def iter_keys(self, prefix: str = "generations") -> Iterator[Tuple[str, datetime]]:
+        """
+        List stored keys in byte order, one directory in memory at a time
+
+        Yields:
+            (file_key, modified_at) tuples, modified_at in UTC
+        """
+        if self.use_s3:
+            yield from self.s3.iter_keys(prefix.rstrip("/") + "/")
+            return
+
+        root = os.path.join(self.base_dir, prefix)
+        if os.path.isdir(root):
+            yield from self._walk_sorted(root, prefix.rstrip("/"))
+
+    def _walk_sorted(self, path: str, key_prefix: str) -> Iterator[Tuple[str, datetime]]:
+        with os.scandir(path) as it:
+            entries = list(it)
+
+        # Sort directories as "name/" so the flattened keys come out in
+        # plain string order, matching S3 listings and COLLATE "C"
+        entries.sort(key=lambda e: e.name + "/" if e.is_dir() else e.name)
+
+        for entry in entries:
+            key = f"{key_prefix}/{entry.name}"
+            if entry.is_dir():
+                yield from self._walk_sorted(entry.path, key)
+            elif entry.is_file():
+                yield key, datetime.utcfromtimestamp(entry.stat().st_mtime)
+
+    def stat(self, file_key: str) -> Optional[StoredObject]:
+        """
+        Get size and a strong ETag for a local file
+
+        Keys are never rewritten, so key + size + mtime identifies the bytes.
+
+        Returns:
+            StoredObject or None if the file does not exist
+        """
+        try:
+            st = os.stat(self.local_path(file_key))
+        except (FileNotFoundError, ValueError):
+            return None
+
+        digest = hashlib.sha1(f"{file_key}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+        content_type = "image/png" if file_key.endswith(".png") else "image/jpeg"
+        return StoredObject(key=file_key, size=st.st_size, etag=f'"{digest}"', content_type=content_type)
+
+    def get_presigned_url(self, file_key: str, expires_in: Optional[int] = None,
+                          download_name: Optional[str] = None) -> str:
+        """Create a temporary GET URL for an S3 object"""
+        return self.s3.presigned_get_url(file_key, expires_in, download_name)
+
+
 if __name__ == '__main__':
     celery_app.start()
\ No newline at end of file
@@ -0,0 +1,260 @@
+import json
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+import redis
+from sqlalchemy import DateTime, Integer, String, Text, case, column, func, select, update, values
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.redis_client import get_async_redis, get_redis
+from models.whatsapp import WhatsAppMessage, WhatsAppNumber
+from services.whatsapp_routing import lookup_sender
+from services.whatsapp_sender import SendResult, WhatsAppSendError
+
+# Reserve the next free slot on each pacing key (sender number, recipient)
+# atomically, so concurrent workers queue up behind each other instead of
+# sending together. Keys are reserved independently: a recipient that must
+# wait does not hold back the sender's other recipients.
+# Returns the longest wait in seconds (as a string: Lua numbers become integers).
+RESERVE_SLOT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local slot = math.max(now, tonumber(redis.call('GET', key) or '0'))
+    local next_at = slot + tonumber(ARGV[i + 1])
+    redis.call('SET', key, tostring(next_at), 'PX', math.ceil((next_at - now) * 1000) + 1000)
+    wait = math.max(wait, slot - now)
+end
+return tostring(wait)
+"""
+
+# Twilio message statuses in delivery order. A callback never moves a row
+# backwards (callbacks arrive out of order); failures are terminal.
+STATUS_RANK = {
+    "pending": -1,
+    "accepted": 0,
+    "queued": 0,
+    "sending": 1,
+    "sent": 2,
+    "delivered": 3,
+    "read": 4,
+    "undelivered": 5,
+    "failed": 5,
+}
+DELIVERED_RANKS = (3, 4)
+
+STATUS_CALLBACKS = "whatsapp:status_callbacks"
+# Callbacks that arrived before their message's SID was stored, retried
+# on the next flushes
+DEFERRED_STATUS_CALLBACKS = "whatsapp:status_callbacks:deferred"
+
+_reserve_slot = None
+
+
+def reserve_send_slot(recipient: str) -> float:
+    """
+    Take the next send slot for the sender number and the recipient
+
+    The sender is held to WHATSAPP_SENDER_MPS messages per second and
+    each recipient to one message every WHATSAPP_RECIPIENT_INTERVAL
+    seconds, which also keeps a recipient's messages in order.
+
+    Returns:
+        Seconds to wait before sending (0 if Redis is unavailable)
+    """
+    global _reserve_slot
+    try:
+        if _reserve_slot is None:
+            _reserve_slot = get_redis().register_script(RESERVE_SLOT)
+        wait = _reserve_slot(
+            keys=[
+                f"whatsapp:pace:sender:{settings.TWILIO_WHATSAPP_FROM}",
+                f"whatsapp:pace:recipient:{recipient}",
+            ],
+            args=[time.time(), 1 / settings.WHATSAPP_SENDER_MPS, settings.WHATSAPP_RECIPIENT_INTERVAL],
+        )
+    except redis.RedisError:
+        return 0.0
+    return max(0.0, float(wait))
+
+
+def retry_delay(retries: int) -> float:
+    """Exponential backoff with jitter: half fixed, half random, capped"""
+    backoff = min(settings.WHATSAPP_SEND_BACKOFF_MAX, settings.WHATSAPP_SEND_BACKOFF_BASE * 2 ** retries)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def record_outbound_message(db: Session, phone_number: str, body: str, media_url: Optional[str]) -> Optional[int]:
+    """
+    Create the whatsapp_messages row of a queued outbound message
+
+    Returns:
+        Message ID, or None for recipients without a registered number
+        (e.g. the welcome message), which are sent without a row
+    """
+    route = lookup_sender(db, phone_number)
+    if route is None:
+        return None
+
+    message = WhatsAppMessage(
+        whatsapp_number_id=route.number_id,
+        direction="outbound",
+        message_type="image" if media_url else "text",
+        body=body,
+        media_url=media_url,
+        status="pending",
+        attempts=0
+    )
+    db.add(message)
+    db.commit()
+    return message.id
+
+
+def record_send_attempt(db: Session, message_id: Optional[int],
+                        result: Union[SendResult, WhatsAppSendError], final: bool = True) -> None:
+    """
+    Count one attempt on the outbound row
+
+    A success stores the Twilio SID (what status callbacks match on) and
+    sent_at. A failure keeps the row "pending" while retries remain.
+    """
+    if message_id is None:
+        return
+
+    changes = {"attempts": WhatsAppMessage.attempts + 1}
+    if isinstance(result, SendResult):
+        changes.update(message_sid=result.sid, status=result.status or "queued",
+                       sent_at=datetime.utcnow(), error_message=None)
+        db.execute(
+            update(WhatsAppNumber)
+            .where(WhatsAppNumber.id == select(WhatsAppMessage.whatsapp_number_id)
+                   .where(WhatsAppMessage.id == message_id).scalar_subquery())
+            .values(messages_sent=func.coalesce(WhatsAppNumber.messages_sent, 0) + 1)
+        )
+    else:
+        changes["error_message"] = str(result)
+        if final:
+            changes["status"] = "failed"
+
+    db.execute(update(WhatsAppMessage).where(WhatsAppMessage.id == message_id).values(**changes))
+    db.commit()
+
+
+def status_update(params) -> Optional[Dict[str, str]]:
+    """Compact status update from a Twilio status callback form"""
+    status = (params.get("MessageStatus") or params.get("SmsStatus") or "").lower()
+    if not params.get("MessageSid") or status not in STATUS_RANK:
+        return None
+    error_code = params.get("ErrorCode")
+    return {
+        "sid": params["MessageSid"],
+        "status": status,
+        "at": datetime.utcnow().isoformat(),
+        "error": f"Twilio error {error_code}" if error_code else None,
+    }
+
+
+async def buffer_status_update(item: Dict[str, str]) -> None:
+    """
+    Queue a callback for the next batch
+
+    Raises:
+        redis.RedisError: Not queued
+    """
+    await get_async_redis().rpush(STATUS_CALLBACKS, json.dumps(item))
+
+
+def drain_status_updates(limit: int, key: str = STATUS_CALLBACKS) -> List[Dict[str, str]]:
+    """Take up to limit buffered callbacks, oldest first (limit 0: all)"""
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.lrange(key, 0, limit - 1)
+    if limit:
+        pipe.ltrim(key, limit, -1)
+    else:
+        pipe.delete(key)
+    raw, _ = pipe.execute()
+    return [json.loads(item) for item in raw]
+
+
+def requeue_status_updates(updates: List[Dict[str, str]]) -> None:
+    """Put a batch that could not be applied back at the head of the buffer"""
+    if updates:
+        get_redis().lpush(STATUS_CALLBACKS, *[json.dumps(item) for item in reversed(updates)])
+
+
+def defer_status_updates(updates: List[Dict[str, str]]) -> int:
+    """
+    Keep callbacks that matched no message for a later flush
+
+    Twilio can call back before record_send_attempt commits the SID. Each
+    callback is retried on up to WHATSAPP_STATUS_MAX_RETRIES flushes,
+    then dropped (the SID belongs to no message of ours).
+
+    Returns:
+        Callbacks dropped
+    """
+    kept = [{**item, "tries": item.get("tries", 0) + 1} for item in updates]
+    kept = [item for item in kept if item["tries"] <= settings.WHATSAPP_STATUS_MAX_RETRIES]
+    if kept:
+        get_redis().rpush(DEFERRED_STATUS_CALLBACKS, *[json.dumps(item) for item in kept])
+    return len(updates) - len(kept)
+
+
+def apply_status_updates(db: Session, updates: List[Dict[str, str]]) -> Tuple[int, List[Dict[str, str]]]:
+    """
+    Apply status callbacks with a single UPDATE ... FROM (VALUES ...)
+
+    Only the furthest status per message is kept. Callbacks for rows
+    that have moved further along are ignored. (Caller commits.)
+
+    Returns:
+        (rows updated, callbacks whose SID matched no message yet)
+    """
+    latest: Dict[str, Dict[str, str]] = {}
+    for item in updates:
+        current = latest.get(item["sid"])
+        if current is None or STATUS_RANK[item["status"]] > STATUS_RANK[current["status"]]:
+            latest[item["sid"]] = item
+    if not latest:
+        return 0, []
+
+    batch = values(
+        column("sid", String), column("status", String), column("rank", Integer),
+        column("at", DateTime), column("error", Text),
+        name="callbacks"
+    ).data([
+        (item["sid"], item["status"], STATUS_RANK[item["status"]],
+         datetime.fromisoformat(item["at"]), item["error"])
+        for item in latest.values()
+    ])
+    current_rank = case(STATUS_RANK, value=WhatsAppMessage.status, else_=-1)
+
+    result = db.execute(
+        update(WhatsAppMessage)
+        .where(
+            WhatsAppMessage.message_sid == batch.c.sid,
+            WhatsAppMessage.direction == "outbound",
+            current_rank < batch.c.rank
+        )
+        .values(
+            status=batch.c.status,
+            delivered_at=case(
+                (batch.c.rank.in_(DELIVERED_RANKS), func.coalesce(WhatsAppMessage.delivered_at, batch.c.at)),
+                else_=WhatsAppMessage.delivered_at
+            ),
+            error_message=func.coalesce(batch.c.error, WhatsAppMessage.error_message)
+        )
+        .returning(WhatsAppMessage.message_sid)
+        .execution_options(synchronize_session=False)
+    )
+    updated = set(result.scalars())
+
+    # Not updated: either already further along, or no such SID (yet)
+    missing = [sid for sid in latest if sid not in updated]
+    if missing:
+        known = set(db.scalars(select(WhatsAppMessage.message_sid).where(WhatsAppMessage.message_sid.in_(missing))))
+        missing = [sid for sid in missing if sid not in known]
+    return len(updated), [latest[sid] for sid in missing]
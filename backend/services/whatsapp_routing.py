@@ -0,0 +1,235 @@
+import json
+from dataclasses import astuple, dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+import redis
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.current_user import LocalCache
+from core.redis_client import get_async_redis, get_redis
+from models.user import User
+from models.whatsapp import WhatsAppNumber
+
+# Redis value for a sender with no active, verified number
+UNREGISTERED = "-"
+
+# Routes per Redis pipeline when warming
+WARM_BATCH_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class SenderRoute:
+    """
+    Where an inbound sender goes: its number, user and a credit snapshot
+
+    The snapshot only lets messages through. A sender it says is out of
+    credits is checked against the database, and generate_art_task
+    reserves the credit atomically anyway.
+    """
+    user_id: int
+    number_id: int
+    plan_type: str
+    credits_used: int
+    credits_limit: int
+    subscription_status: Optional[str]
+    trial_ends_at: Optional[datetime]
+
+    @property
+    def remaining_credits(self) -> int:
+        return max(0, self.credits_limit - self.credits_used)
+
+    @property
+    def can_generate(self) -> bool:
+        """Same rule as User.can_generate"""
+        if self.plan_type == "trial":
+            active = self.trial_ends_at is None or datetime.utcnow() < self.trial_ends_at
+        else:
+            active = self.subscription_status == "active"
+        return active and self.remaining_credits > 0
+
+    def to_json(self) -> str:
+        values = list(astuple(self))
+        if self.trial_ends_at:
+            values[-1] = self.trial_ends_at.isoformat()
+        return json.dumps(values)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "SenderRoute":
+        values = json.loads(raw)
+        if values[-1]:
+            values[-1] = datetime.fromisoformat(values[-1])
+        return cls(*values)
+
+
+def normalize_phone(address: Optional[str]) -> str:
+    """'whatsapp:+55 11 99999-9999' -> '+5511999999999' (how numbers are stored)"""
+    phone = (address or "").removeprefix("whatsapp:").strip()
+    return "".join(char for char in phone if char.isdigit() or char == "+")
+
+
+# Known and unregistered senders live in separate LRUs, so a burst from
+# unknown numbers cannot evict the routes of real customers
+_routes = LocalCache(settings.WHATSAPP_ROUTE_CACHE_SIZE, settings.WHATSAPP_ROUTE_LOCAL_TTL)
+_unregistered = LocalCache(settings.WHATSAPP_ROUTE_CACHE_SIZE, settings.WHATSAPP_ROUTE_LOCAL_TTL)
+
+
+def _redis_key(phone: str) -> str:
+    return f"whatsapp:route:{phone}"
+
+
+def _route_query():
+    return (
+        select(
+            WhatsAppNumber.phone_number,
+            WhatsAppNumber.user_id,
+            WhatsAppNumber.id,
+            User.plan_type,
+            User.credits_used,
+            User.credits_limit,
+            User.subscription_status,
+            User.trial_ends_at,
+        )
+        .join(User, User.id == WhatsAppNumber.user_id)
+        .where(WhatsAppNumber.is_active == True, WhatsAppNumber.is_verified == True)
+    )
+
+
+def _route_from_row(row) -> SenderRoute:
+    return SenderRoute(
+        user_id=row.user_id,
+        number_id=row.id,
+        plan_type=row.plan_type.value if row.plan_type else "trial",
+        credits_used=row.credits_used or 0,
+        credits_limit=row.credits_limit or 0,
+        subscription_status=row.subscription_status,
+        trial_ends_at=row.trial_ends_at,
+    )
+
+
+def _remember(phone: str, route: Optional[SenderRoute]) -> None:
+    if route is None:
+        _unregistered.set(phone, True)
+        ttl, value = settings.WHATSAPP_ROUTE_NEGATIVE_TTL, UNREGISTERED
+    else:
+        _routes.set(phone, route)
+        ttl, value = settings.WHATSAPP_ROUTE_TTL, route.to_json()
+    try:
+        get_redis().set(_redis_key(phone), value, ex=ttl)
+    except redis.RedisError:
+        pass
+
+
+def lookup_sender(db: Session, phone: str) -> Optional[SenderRoute]:
+    """
+    Route an inbound sender: local LRU, then Redis, then one joined query
+
+    Both answers are cached, including "not registered".
+
+    Returns:
+        Route, or None if the phone has no active, verified number
+    """
+    route = _routes.get(phone)
+    if route is not None:
+        return route
+    if _unregistered.get(phone):
+        return None
+
+    try:
+        raw = get_redis().get(_redis_key(phone))
+    except redis.RedisError:
+        raw = None
+    if raw == UNREGISTERED:
+        _unregistered.set(phone, True)
+        return None
+    if raw:
+        route = SenderRoute.from_json(raw)
+        _routes.set(phone, route)
+        return route
+
+    row = db.execute(_route_query().where(WhatsAppNumber.phone_number == phone)).first()
+    route = _route_from_row(row) if row else None
+    _remember(phone, route)
+    return route
+
+
+async def is_unregistered(phone: str) -> bool:
+    """
+    Whether the sender is known to have no number (webhook, no database)
+
+    A sender not seen yet is not "unregistered": the worker decides.
+    """
+    if not phone:
+        return False
+    if _unregistered.get(phone):
+        return True
+    try:
+        raw = await get_async_redis().get(_redis_key(phone))
+    except redis.RedisError:
+        return False
+    if raw == UNREGISTERED:
+        _unregistered.set(phone, True)
+        return True
+    return False
+
+
+def forget_senders(phones: Iterable[str]) -> None:
+    """
+    Drop senders from both cache tiers
+
+    Other processes may still use their local copy for up to
+    WHATSAPP_ROUTE_LOCAL_TTL seconds.
+    """
+    phones = [phone for phone in phones if phone]
+    if not phones:
+        return
+    for phone in phones:
+        _routes.delete(phone)
+        _unregistered.delete(phone)
+    try:
+        get_redis().delete(*[_redis_key(phone) for phone in phones])
+    except redis.RedisError:
+        pass
+
+
+def warm_routes(db: Session) -> int:
+    """
+    Load every active, verified number into Redis
+
+    Returns:
+        Number of routes written
+    """
+    client = get_redis()
+    count = 0
+    pipe = client.pipeline(transaction=False)
+    for row in db.execute(_route_query().execution_options(yield_per=WARM_BATCH_SIZE)):
+        pipe.set(_redis_key(row.phone_number), _route_from_row(row).to_json(), ex=settings.WHATSAPP_ROUTE_TTL)
+        count += 1
+        if count % WARM_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    return count
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_numbers(session, flush_context):
+    """Phones whose number was connected, changed (verified, deactivated) or removed"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, WhatsAppNumber):
+            continue
+        phones = session.info.setdefault("stale_sender_phones", set())
+        phones.add(obj.phone_number)
+        # A renumbered row also invalidates its previous phone
+        phones.update(inspect(obj).attrs.phone_number.history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_changed_numbers(session):
+    forget_senders(session.info.pop("stale_sender_phones", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_changed_numbers(session):
+    session.info.pop("stale_sender_phones", None)
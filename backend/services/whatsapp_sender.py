@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import httpx
+
+from core.config import settings
+
+MESSAGES_PATH = "/2010-04-01/Accounts/{account_sid}/Messages.json"
+
+
+@dataclass(frozen=True)
+class OutboundMessage:
+    """One WhatsApp message; with media_url the body is sent as its caption"""
+    to: str
+    body: str
+    media_url: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SendResult:
+    to: str
+    sid: str
+    status: str
+    latency_ms: float
+
+
+class WhatsAppSendError(Exception):
+    """Twilio refused the message, or could not be reached"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+    @property
+    def retryable(self) -> bool:
+        """Network errors, throttling (429) and server errors are worth another try"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+def whatsapp_address(phone_number: str) -> str:
+    return phone_number if phone_number.startswith("whatsapp:") else f"whatsapp:{phone_number}"
+
+
+class WhatsAppSender:
+    """
+    Outbound WhatsApp messages over the Twilio REST API
+
+    Each process has one pooled async HTTP client running on its own
+    event-loop thread. Synchronous callers (Celery tasks, sync routes)
+    block on ``deliver`` while the loop multiplexes every in-flight send.
+    At most ``WHATSAPP_SEND_CONCURRENCY`` requests are in flight per
+    process.
+    """
+
+    def __init__(self):
+        self.configured = bool(settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN)
+        self.url = settings.TWILIO_API_BASE_URL.rstrip("/") + MESSAGES_PATH.format(
+            account_sid=settings.TWILIO_ACCOUNT_SID
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="whatsapp-sender", daemon=True)
+        self._thread.start()
+        self._in_flight = asyncio.Semaphore(settings.WHATSAPP_SEND_CONCURRENCY)
+        self._client = httpx.AsyncClient(
+            auth=(settings.TWILIO_ACCOUNT_SID or "", settings.TWILIO_AUTH_TOKEN or ""),
+            timeout=httpx.Timeout(settings.WHATSAPP_SEND_TIMEOUT, connect=settings.WHATSAPP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.WHATSAPP_SEND_CONCURRENCY,
+                max_keepalive_connections=settings.WHATSAPP_SEND_CONCURRENCY,
+            ),
+        )
+
+    async def send(self, message: OutboundMessage) -> SendResult:
+        """
+        Send one message (must run on this sender's loop)
+
+        Raises:
+            WhatsAppSendError: Twilio rejected the message or was unreachable
+        """
+        data = {
+            "To": whatsapp_address(message.to),
+            "From": settings.TWILIO_WHATSAPP_FROM,
+            "Body": message.body,
+        }
+        if message.media_url:
+            data["MediaUrl"] = message.media_url
+        if settings.WHATSAPP_STATUS_CALLBACK_URL:
+            data["StatusCallback"] = settings.WHATSAPP_STATUS_CALLBACK_URL
+
+        async with self._in_flight:
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(self.url, data=data)
+            except httpx.HTTPError as e:
+                raise WhatsAppSendError(f"Twilio unreachable: {e!r}") from e
+            latency_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code >= 400:
+            raise WhatsAppSendError(
+                payload.get("message") or f"Twilio returned HTTP {response.status_code}",
+                status_code=response.status_code,
+                code=payload.get("code"),
+            )
+        return SendResult(
+            to=message.to,
+            sid=payload.get("sid", ""),
+            status=payload.get("status", ""),
+            latency_ms=latency_ms,
+        )
+
+    async def send_many(self, messages: List[OutboundMessage]) -> List[Union[SendResult, WhatsAppSendError]]:
+        """Send concurrently; each slot holds the result or the error of that message"""
+        return await asyncio.gather(*(self.send(message) for message in messages), return_exceptions=True)
+
+    def deliver(self, *messages: OutboundMessage) -> List[Union[SendResult, WhatsAppSendError]]:
+        """Blocking entry point: send on the process loop and wait for every result"""
+        future = asyncio.run_coroutine_threadsafe(self.send_many(list(messages)), self._loop)
+        return future.result()
+
+
+# One sender per process. The loop thread does not survive fork() (Celery
+# prefork workers), so the cache is keyed on the pid that created it.
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+
+def get_whatsapp_sender() -> WhatsAppSender:
+    """
+    Return the process-wide WhatsApp sender
+
+    Returns:
+        WhatsAppSender
+    """
+    global _sender, _sender_pid
+
+    if _sender is not None and _sender_pid == os.getpid():
+        return _sender
+
+    with _sender_lock:
+        if _sender is None or _sender_pid != os.getpid():
+            _sender = WhatsAppSender()
+            _sender_pid = os.getpid()
+
+    return _sender
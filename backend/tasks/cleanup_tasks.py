@@ -1,14 +1,20 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from sqlalchemy.orm import Session
+from sqlalchemy import tuple_, text, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
 from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 import os
 import shutil
+import time
 from pathlib import Path
 
-from core.database import SessionLocal
+from core.database import SessionLocal, ReplicaSessionLocal
+from core.redis_client import get_redis
 from models.generation import Generation
-from services.storage_service import StorageService
+from services.storage_service import StorageService, iter_date_shards
+from services.generation_partitions import ensure_partitions, expired_partitions, export_partition, drop_partition
 from core.config import settings
 
 logger = get_task_logger(__name__)
@@ -27,8 +33,24 @@ def cleanup_temp_files():
             # Remove files older than 7 days
             cutoff_time = datetime.now() - timedelta(days=7)
             
-            for item in Path(temp_dir).rglob("*"):
-                if item.is_file():
+            # Date-sharded directories are dropped whole, no per-file stat
+            cutoff_date = datetime.utcnow().date() - timedelta(days=7)
+            for shard_date, shard_dir in iter_date_shards(temp_dir):
+                if shard_date < cutoff_date:
+                    shutil.rmtree(shard_dir, ignore_errors=True)
+                    logger.debug(f"Removed old shard: {shard_dir}")
+            
+            # Legacy flat and hash-sharded files still need an mtime check.
+            # Partition archives written here before ARCHIVE_DIR are data
+            # exports, not temp files: never swept
+            dated_root = os.path.join(temp_dir, "generations")
+            archive_root = os.path.normpath(os.path.join(temp_dir, settings.RETENTION_ARCHIVE_PREFIX))
+            for root, dirs, files in os.walk(temp_dir):
+                if root == dated_root:
+                    dirs[:] = [d for d in dirs if not (d.isdigit() and len(d) == 4)]
+                dirs[:] = [d for d in dirs if os.path.join(root, d) != archive_root]
+                for name in files:
+                    item = Path(root) / name
                     file_time = datetime.fromtimestamp(item.stat().st_mtime)
                     if file_time < cutoff_time:
                         try:
@@ -39,48 +61,197 @@ def cleanup_temp_files():
     
     logger.info("Temp files cleanup completed")
 
+RETENTION_CURSOR_KEY = "retention:generations:cursor"
+RETENTION_LOCK_KEY = "retention:generations:lock"
+
 @shared_task
 def cleanup_old_generations():
     """
     Clean up old generation records and associated files
+    
+    Every generation older than RETENTION_DAYS goes, whatever its status:
+    a dropped partition cannot keep some of its rows, and the row-by-row
+    path follows the same rule so the outcome does not depend on the path.
+    
+    Monthly partitions that are entirely past the retention period are
+    exported to storage (RETENTION_ARCHIVE_PARTITIONS), detached and
+    dropped whole, so there is no row-by-row delete and no table bloat.
+    
+    The rest (the month straddling the cutoff, the default partition) is
+    walked in (created_at, id) order, one batch at a time: a set-based
+    DELETE for the rows followed by a bulk delete of their files.
+    Progress is stored in Redis so an interrupted run resumes where it
+    stopped, and the task re-enqueues itself until the backlog is cleared.
+    
+    Only one run at a time: the re-enqueued task and the nightly beat
+    share the cursor, so a run that finds the lock held does nothing.
     """
+    redis_client = get_redis()
+    
+    # Expires on its own if the worker dies; the budget is only checked
+    # between batches and partitions, hence the margin
+    lock = redis_client.lock(RETENTION_LOCK_KEY, timeout=settings.RETENTION_TIME_BUDGET * 2, blocking=False)
+    try:
+        acquired = lock.acquire()
+    except Exception as e:
+        logger.warning(f"Could not take retention lock, skipping run: {e}")
+        return
+    if not acquired:
+        logger.info("Another cleanup_old_generations run holds the lock, skipping")
+        return
+    
     db = SessionLocal()
     storage_service = StorageService()
     
+    started = time.monotonic()
+    deleted_count = 0
+    failed_files = 0
+    finished = False
+    
     try:
-        # Find generations older than 90 days
-        cutoff_date = datetime.utcnow() - timedelta(days=90)
-        
-        old_generations = db.query(Generation).filter(
-            Generation.created_at < cutoff_date,
-            Generation.status == "completed"
-        ).limit(1000).all()  # Limit to avoid memory issues
-        
-        deleted_count = 0
-        
-        for generation in old_generations:
-            try:
-                # Delete associated file if exists
-                if generation.file_key:
-                    storage_service.delete_image(generation.file_key)
-                
-                # Delete database record
-                db.delete(generation)
-                deleted_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error deleting generation {generation.id}: {e}")
+        cutoff_date = datetime.utcnow() - timedelta(days=settings.RETENTION_DAYS)
         
-        db.commit()
-        logger.info(f"Cleaned up {deleted_count} old generations")
+        for partition in expired_partitions(db, cutoff_date):
+            if time.monotonic() - started >= settings.RETENTION_TIME_BUDGET:
+                break
+            
+            if settings.RETENTION_ARCHIVE_PARTITIONS:
+                archive, archived_rows = export_partition(db, partition, storage_service)
+                if archive:
+                    logger.info(f"Archived {archived_rows} generations from {partition.name} to {archive}")
+            
+            dropped, failed = drop_partition(db, partition, storage_service)
+            if failed:
+                failed_files += len(failed)
+                logger.warning(f"Could not delete {len(failed)} files, e.g. {failed[:5]}")
+            
+            deleted_count += dropped
+            logger.info(f"Dropped partition {partition.name} ({dropped} generations)")
+        
+        cursor = _load_retention_cursor(redis_client)
+        
+        while time.monotonic() - started < settings.RETENTION_TIME_BUDGET:
+            batch = _fetch_expired_batch(db, cutoff_date, cursor, settings.RETENTION_BATCH_SIZE)
+            if not batch:
+                finished = True
+                break
+            
+            ids = [row.id for row in batch]
+            file_keys = [row.file_key for row in batch if row.file_key]
+            
+            # Rows first: a file left behind is an orphan the integrity job
+            # can clean up, a row without its file is a broken download
+            _delete_generation_rows(db, ids)
+            db.commit()
+            
+            failed = storage_service.delete_images(file_keys)
+            if failed:
+                failed_files += len(failed)
+                logger.warning(f"Could not delete {len(failed)} files, e.g. {failed[:5]}")
+            
+            deleted_count += len(ids)
+            cursor = (batch[-1].created_at, batch[-1].id)
+            _save_retention_cursor(redis_client, cursor)
+            
+            if len(batch) < settings.RETENTION_BATCH_SIZE:
+                finished = True
+                break
+        
+        if finished:
+            redis_client.delete(RETENTION_CURSOR_KEY)
+        else:
+            # Time budget used up, continue in a fresh task from the saved cursor
+            cleanup_old_generations.apply_async(countdown=5)
+        
+        logger.info(
+            f"Cleaned up {deleted_count} old generations "
+            f"({failed_files} files failed, {'done' if finished else 'continuing'})"
+        )
         
     except Exception as e:
         logger.error(f"Error in cleanup_old_generations: {e}")
         db.rollback()
     
+    finally:
+        db.close()
+        try:
+            lock.release()
+        except Exception as e:
+            logger.warning(f"Could not release retention lock: {e}")
+
+@shared_task
+def ensure_generation_partitions():
+    """
+    Create upcoming monthly partitions of the generations table
+    
+    Runs daily so partitions exist PARTITION_MONTHS_AHEAD months before
+    rows arrive; months the default partition already has rows for are
+    reported instead of created.
+    """
+    db = SessionLocal()
+    
+    try:
+        skipped = ensure_partitions(db)
+        db.commit()
+        
+        for month in skipped:
+            logger.error(
+                f"generations_default has rows for {month:%Y-%m}; "
+                f"move them out before that month's partition can be created"
+            )
+        
+        logger.info("Generation partitions checked")
+        
+    except Exception as e:
+        logger.error(f"Error ensuring generation partitions: {e}")
+        db.rollback()
+    
     finally:
         db.close()
 
+def _fetch_expired_batch(db: Session, cutoff_date: datetime, cursor: Optional[Tuple[datetime, int]], limit: int):
+    """Keyset page of expired generations, oldest first"""
+    query = db.query(Generation.id, Generation.created_at, Generation.file_key).filter(
+        Generation.created_at < cutoff_date
+    )
+    
+    if cursor:
+        query = query.filter(tuple_(Generation.created_at, Generation.id) > tuple_(*cursor))
+    
+    return query.order_by(Generation.created_at, Generation.id).limit(limit).all()
+
+def _delete_generation_rows(db: Session, ids: List[int]):
+    """Set-based delete of a batch of generations"""
+    id_list = bindparam("ids", value=ids, type_=ARRAY(Integer))
+    
+    # Messages keep their history, they just lose the link
+    db.execute(
+        text("UPDATE whatsapp_messages SET generation_id = NULL WHERE generation_id = ANY(:ids)")
+        .bindparams(id_list)
+    )
+    db.execute(
+        text("DELETE FROM generations WHERE id = ANY(:ids)").bindparams(id_list)
+    )
+
+def _load_retention_cursor(redis_client) -> Optional[Tuple[datetime, int]]:
+    try:
+        raw = redis_client.get(RETENTION_CURSOR_KEY)
+    except Exception as e:
+        logger.warning(f"Could not load retention cursor: {e}")
+        return None
+    
+    if not raw:
+        return None
+    
+    created_at, generation_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(generation_id)
+
+def _save_retention_cursor(redis_client, cursor: Tuple[datetime, int]):
+    try:
+        redis_client.set(RETENTION_CURSOR_KEY, f"{cursor[0].isoformat()}|{cursor[1]}")
+    except Exception as e:
+        logger.warning(f"Could not save retention cursor: {e}")
+
 @shared_task
 def backup_database():
     """
@@ -118,7 +289,7 @@ def update_usage_statistics():
     """
     Update usage statistics for reporting
     """
-    db = SessionLocal()
+    db = ReplicaSessionLocal()
     
     try:
         # Get current date info
@@ -136,39 +307,115 @@ def update_usage_statistics():
         db.close()
 
 @shared_task
-def validate_storage_integrity():
+def validate_storage_integrity(delete_orphans: Optional[bool] = None):
     """
-    Validate storage integrity by checking if all database records have corresponding files
+    Reconcile generation file keys with the storage backend
+    
+    Both sides are streamed in the same sort order (server-side cursor on
+    the database, paged listing on storage) and merge-joined in one pass,
+    so memory stays bounded no matter how many files exist.
+    
+    Args:
+        delete_orphans: Delete stored files no generation points to
+            (defaults to settings.INTEGRITY_DELETE_ORPHANS)
+    
+    Returns:
+        Report with counts and a sample of missing and orphaned keys
     """
-    db = SessionLocal()
+    if delete_orphans is None:
+        delete_orphans = settings.INTEGRITY_DELETE_ORPHANS
+    
+    # Long read-only scan, kept off the primary; replica lag is covered by the grace period
+    db = ReplicaSessionLocal()
     storage_service = StorageService()
+    sample_size = settings.INTEGRITY_REPORT_SAMPLE
+    # Files newer than this may belong to a generation that is not committed yet
+    grace_cutoff = datetime.utcnow() - timedelta(hours=settings.INTEGRITY_ORPHAN_GRACE_HOURS)
+    
+    report = {
+        "checked_records": 0,
+        "checked_files": 0,
+        "missing_count": 0,
+        "orphan_count": 0,
+        "orphans_deleted": 0,
+        "missing_files": [],
+        "orphan_files": [],
+    }
+    pending_deletes: List[str] = []
+    
+    def flush_deletes():
+        failed = storage_service.delete_images(pending_deletes)
+        report["orphans_deleted"] += len(pending_deletes) - len(failed)
+        pending_deletes.clear()
     
     try:
-        # Get all generations with file keys
-        generations = db.query(Generation).filter(
-            Generation.file_key.isnot(None),
-            Generation.status == "completed"
-        ).limit(100).all()  # Limit to avoid performance issues
+        # COLLATE "C" sorts by bytes, the same order S3 and the local walk use
+        db_keys = (
+            row.file_key for row in
+            db.query(Generation.file_key)
+            .filter(Generation.file_key.isnot(None))
+            .order_by(Generation.file_key.collate("C"))
+            .execution_options(yield_per=settings.INTEGRITY_FETCH_SIZE)
+        )
+        stored_files = storage_service.iter_keys()
         
-        missing_files = []
+        db_key = next(db_keys, None)
+        stored = next(stored_files, None)
         
-        for generation in generations:
-            try:
-                # Check if file exists (this is simplified)
-                # In production, implement actual file existence check
-                pass
-                
-            except Exception as e:
-                missing_files.append(generation.id)
-                logger.warning(f"File missing for generation {generation.id}: {e}")
+        while db_key is not None or stored is not None:
+            if stored is None or (db_key is not None and db_key < stored[0]):
+                # Referenced by the database but not in storage
+                report["checked_records"] += 1
+                report["missing_count"] += 1
+                if len(report["missing_files"]) < sample_size:
+                    report["missing_files"].append(db_key)
+                db_key = _next_distinct(db_keys, db_key, report)
+            elif db_key is None or stored[0] < db_key:
+                # In storage but unknown to the database
+                stored_key, modified_at = stored
+                report["checked_files"] += 1
+                report["orphan_count"] += 1
+                if len(report["orphan_files"]) < sample_size:
+                    report["orphan_files"].append(stored_key)
+                if delete_orphans and modified_at < grace_cutoff:
+                    pending_deletes.append(stored_key)
+                    if len(pending_deletes) >= settings.RETENTION_BATCH_SIZE:
+                        flush_deletes()
+                stored = next(stored_files, None)
+            else:
+                report["checked_records"] += 1
+                report["checked_files"] += 1
+                db_key = _next_distinct(db_keys, db_key, report)
+                stored = next(stored_files, None)
         
-        if missing_files:
-            logger.warning(f"Found {len(missing_files)} generations with missing files")
+        if pending_deletes:
+            flush_deletes()
         
-        logger.info(f"Storage integrity check completed. Checked {len(generations)} files")
+        if report["missing_count"]:
+            logger.warning(f"Found {report['missing_count']} generations with missing files")
+        if report["orphan_count"]:
+            logger.warning(
+                f"Found {report['orphan_count']} orphaned files "
+                f"({report['orphans_deleted']} deleted)"
+            )
+        
+        logger.info(
+            f"Storage integrity check completed. Checked {report['checked_records']} records "
+            f"and {report['checked_files']} files"
+        )
         
     except Exception as e:
         logger.error(f"Error in storage integrity check: {e}")
     
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+    
+    return report
+
+def _next_distinct(db_keys, current: str, report: dict) -> Optional[str]:
+    """Advance past duplicate keys (several rows may share one file)"""
+    for key in db_keys:
+        if key != current:
+            return key
+        report["checked_records"] += 1
+    return None
@@ -3,8 +3,10 @@ from celery.utils.log import get_task_logger
 from sqlalchemy.orm import Session
 import asyncio
 from datetime import datetime
+from typing import Optional, Tuple
 import requests
 import io
+import time
 from PIL import Image
 
 from core.database import SessionLocal
@@ -13,6 +15,7 @@ from services.storage_service import StorageService
 from core.config import settings
 from models.generation import Generation
 from models.user import User
+from services.credit_service import CreditService, InsufficientCredits
 
 logger = get_task_logger(__name__)
 
@@ -28,6 +31,7 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
         phone_number: Optional phone number for WhatsApp notifications
     """
     db = SessionLocal()
+    reserved = False
     
     try:
         logger.info(f"Starting art generation for generation {generation_id}")
@@ -38,17 +42,30 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
             logger.error(f"Generation {generation_id} not found")
             return
         
+        # A retry after the completed commit must not reserve another credit
+        if generation.status == "completed":
+            logger.info(f"Generation {generation_id} already completed, skipping")
+            return
+        
         # Get user
         user = db.query(User).filter(User.id == user_id).first()
         if not user:
             logger.error(f"User {user_id} not found")
             return
         
-        # Check credits again
-        if not user.can_generate():
+        # Reserve the credit up front (one conditional UPDATE), refunded on failure
+        try:
+            if not user.has_active_subscription:
+                raise InsufficientCredits("Subscription inactive")
+            balance = CreditService(db).reserve(user.id, generation_id=generation.id, reason="generate_art_task")
+            db.commit()
+            reserved = True
+        except InsufficientCredits:
             logger.warning(f"User {user_id} has no credits")
+            db.rollback()
             generation.status = "failed"
             generation.error_message = "No credits available"
+            generation.credits_used = 0
             db.commit()
             
             if phone_number:
@@ -74,9 +91,11 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
             style=style
         )
         
+        started = time.monotonic()
+        
         # Update generation with prompt data
-        generation.metadata = {
-            **generation.metadata,
+        generation.meta = {
+            **(generation.meta or {}),
             "prompt_data": prompt_data,
             "generation_started_at": datetime.utcnow().isoformat()
         }
@@ -106,9 +125,10 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
         generation.image_url = file_url
         generation.file_key = file_key
         generation.credits_used = 1
+        generation.processing_time = time.monotonic() - started
         generation.completed_at = datetime.utcnow()
-        generation.metadata = {
-            **generation.metadata,
+        generation.meta = {
+            **(generation.meta or {}),
             "generation_completed_at": datetime.utcnow().isoformat(),
             "image_specs": {
                 "url": file_url,
@@ -117,10 +137,6 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
             }
         }
         
-        # Update user credits
-        user.credits_used += 1
-        user.updated_at = datetime.utcnow()
-        
         db.commit()
         
         logger.info(f"Art generation completed for generation {generation.id}")
@@ -129,31 +145,28 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
         if phone_number:
             from tasks.transcription_tasks import send_whatsapp_message
             
-            # Send success message
-            send_whatsapp_message.delay(
-                phone_number,
-                f"✅ Sua arte está pronta!\n\n📝 *Sua promoção:*\n{prompt}\n\n"
-                f"🖼️ *Arte gerada:*\n{file_url}\n\n"
-                f"💡 Créditos restantes: {user.remaining_credits}"
-            )
-            
-            # Try to send image (Twilio sandbox may have limitations)
+            # One media message: the art, with the text as its caption. The art
+            # is already committed: a failure here must not report an error
+            # to the user nor retry the task
+            message, media_url = art_ready_message(prompt, file_url, balance.remaining)
             try:
-                # In production, use Twilio Media API
-                pass
-            except:
-                pass
-        
+                send_whatsapp_message.delay(phone_number, message, media_url=media_url)
+            except Exception as e:
+                logger.error(f"Could not queue art notification for generation {generation.id}: {e}")
+    
     except Exception as exc:
         logger.error(f"Error in generate_art_task: {exc}")
         
-        # Update generation as failed
+        # Update generation as failed and refund this attempt's reservation
         try:
+            db.rollback()
             generation = db.query(Generation).filter(Generation.id == generation_id).first()
-            if generation:
+            if generation and generation.status != "completed":
                 generation.status = "failed"
                 generation.error_message = str(exc)
                 generation.credits_used = 0
+                if reserved:
+                    CreditService(db).refund(user_id, generation_id=generation_id, reason="generate_art_task failed")
                 db.commit()
         except:
             pass
@@ -172,6 +185,23 @@ def generate_art_task(self, generation_id: int, prompt: str, user_id: int, phone
     finally:
         db.close()
 
+def art_ready_message(prompt: str, file_url: str, remaining_credits: int) -> Tuple[str, Optional[str]]:
+    """
+    WhatsApp notification for a finished art
+    
+    Twilio can only attach media from a public URL; local storage URLs
+    (/uploads/...) go in the text instead.
+    
+    Returns:
+        (message text, media URL or None)
+    """
+    message = f"✅ Sua arte está pronta!\n\n📝 *Sua promoção:*\n{prompt}\n\n"
+    media_url = file_url if file_url.startswith(("http://", "https://")) else None
+    if media_url is None:
+        message += f"🖼️ *Arte gerada:*\n{file_url}\n\n"
+    message += f"💡 Créditos restantes: {remaining_credits}"
+    return message, media_url
+
 def generate_mock_image(prompt_data: dict, business_name: str) -> str:
     """
     Generate a mock image URL (replace with actual AI image generation)
@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import List
 
-from core.database import SessionLocal
+from core.database import SessionLocal, ReplicaSessionLocal
 from models.user import User
 from models.generation import Generation
 
@@ -15,7 +15,7 @@ def send_daily_reports():
     """
     Send daily usage reports to users
     """
-    db = SessionLocal()
+    db = ReplicaSessionLocal()
     
     try:
         # Get all active users
@@ -132,7 +132,7 @@ def send_low_credit_notifications():
     """
     Send notifications to users with low credits
     """
-    db = SessionLocal()
+    db = ReplicaSessionLocal()
     
     try:
         # Get users with less than 20% credits remaining
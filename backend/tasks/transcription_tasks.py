@@ -3,21 +3,27 @@ from celery.utils.log import get_task_logger
 from sqlalchemy.orm import Session
 import aiohttp
 import asyncio
+import time
 from datetime import datetime
 from typing import Optional
 
 from core.database import SessionLocal
+from core.pagination import invalidate_count
 from services.audio_processor import AudioProcessor
 from services.gemini_service import GeminiService
 from services.storage_service import StorageService
+from services.whatsapp_delivery import record_outbound_message, record_send_attempt, reserve_send_slot, retry_delay
+from services.whatsapp_sender import OutboundMessage, WhatsAppSendError, get_whatsapp_sender
 from core.config import settings
 from models.generation import Generation
 from models.user import User
+from models.whatsapp import WhatsAppMessage
 
 logger = get_task_logger(__name__)
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def transcribe_audio_task(self, audio_url: str, user_id: int, phone_number: str):
+def transcribe_audio_task(self, audio_url: str, user_id: int, phone_number: str,
+                          inbound_message_id: Optional[int] = None):
     """
     Transcribe audio from WhatsApp and generate art
     
@@ -25,6 +31,7 @@ def transcribe_audio_task(self, audio_url: str, user_id: int, phone_number: str)
         audio_url: URL of the audio file from Twilio
         user_id: User ID
         phone_number: User's phone number for sending result
+        inbound_message_id: whatsapp_messages row of the voice note, linked to the generation
     """
     db = SessionLocal()
     
@@ -76,14 +83,20 @@ def transcribe_audio_task(self, audio_url: str, user_id: int, phone_number: str)
             prompt=transcription,
             input_type="audio",
             status="processing",
-            metadata={
+            meta={
                 "audio_info": audio_info,
                 "transcription_metadata": metadata
             }
         )
         db.add(generation)
+        db.flush()
+        if inbound_message_id:
+            db.query(WhatsAppMessage).filter(WhatsAppMessage.id == inbound_message_id).update(
+                {"generation_id": generation.id}, synchronize_session=False
+            )
         db.commit()
         db.refresh(generation)
+        invalidate_count("generations", user_id)
         
         # Send processing message
         send_whatsapp_message.delay(
@@ -116,6 +129,7 @@ def transcribe_audio_task(self, audio_url: str, user_id: int, phone_number: str)
             )
             db.add(generation)
             db.commit()
+            invalidate_count("generations", user_id)
         except:
             pass
         
@@ -153,31 +167,69 @@ def download_file(url: str) -> Optional[bytes]:
         logger.error(f"Failed to download file {url}: {e}")
         return None
 
-@shared_task
-def send_whatsapp_message(phone_number: str, message: str):
+@shared_task(bind=True, max_retries=settings.WHATSAPP_SEND_MAX_RETRIES)
+def send_whatsapp_message(self, phone_number: str, message: str, media_url: Optional[str] = None,
+                          outbound_message_id: Optional[int] = None, paced: bool = False):
     """
     Send WhatsApp message using Twilio
     
+    Runs on the outbound queue through the process-wide pooled sender.
+    Each send waits for its slot (per sender number and per recipient),
+    transient errors are retried with jittered exponential backoff, and
+    every attempt is counted on the message's whatsapp_messages row.
+    
     Args:
         phone_number: Recipient phone number
-        message: Message text
+        message: Message text (the caption when media_url is set)
+        media_url: Optional public URL of an image to attach
+        outbound_message_id: whatsapp_messages row (set on retries)
+        paced: The send slot was already reserved (rescheduled sends)
     """
+    sender = get_whatsapp_sender()
+    if not sender.configured:
+        logger.warning("Twilio not configured, skipping WhatsApp message")
+        return
+    
+    db = SessionLocal()
+    
     try:
-        from twilio.rest import Client
-        
-        if not all([settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN]):
-            logger.warning("Twilio not configured, skipping WhatsApp message")
+        if outbound_message_id is None:
+            outbound_message_id = record_outbound_message(db, phone_number, message, media_url)
+        
+        retry_kwargs = {"media_url": media_url, "outbound_message_id": outbound_message_id}
+        
+        if not paced:
+            wait = reserve_send_slot(phone_number)
+            if wait > settings.WHATSAPP_PACE_MAX_SLEEP:
+                # Come back when the slot opens instead of holding the worker
+                send_whatsapp_message.apply_async(
+                    args=[phone_number, message],
+                    kwargs={**retry_kwargs, "paced": True},
+                    countdown=wait
+                )
+                return "deferred"
+            time.sleep(wait)
+        
+        result, = sender.deliver(OutboundMessage(to=phone_number, body=message, media_url=media_url))
+        
+        if isinstance(result, WhatsAppSendError):
+            retrying = result.retryable and self.request.retries < self.max_retries
+            record_send_attempt(db, outbound_message_id, result, final=not retrying)
+            logger.warning(
+                f"WhatsApp message to {phone_number} failed (attempt {self.request.retries + 1}): {result}"
+            )
+            if retrying:
+                raise self.retry(
+                    exc=result,
+                    countdown=retry_delay(self.request.retries),
+                    args=[phone_number, message],
+                    kwargs=retry_kwargs
+                )
             return
         
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-        
-        message = client.messages.create(
-            body=message,
-            from_='whatsapp:+14155238886',
-            to=f'whatsapp:{phone_number}'
-        )
-        
-        logger.info(f"WhatsApp message sent to {phone_number}: {message.sid}")
-        
-    except Exception as e:
-        logger.error(f"Failed to send WhatsApp message: {e}")
\ No newline at end of file
+        record_send_attempt(db, outbound_message_id, result)
+        logger.info(f"WhatsApp message sent to {phone_number}: {result.sid} ({result.latency_ms:.0f}ms)")
+        return result.sid
+    
+    finally:
+        db.close()
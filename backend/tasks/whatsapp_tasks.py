@@ -0,0 +1,357 @@
+from celery import shared_task
+from celery.signals import worker_ready
+from celery.utils.log import get_task_logger
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+
+from core.config import settings
+from core.database import SessionLocal
+from core.pagination import invalidate_count
+from models.generation import Generation
+from models.user import User
+from models.whatsapp import WhatsAppNumber, WhatsAppMessage
+from services.whatsapp_delivery import (
+    DEFERRED_STATUS_CALLBACKS, apply_status_updates, defer_status_updates, drain_status_updates, requeue_status_updates
+)
+from services.whatsapp_routing import SenderRoute, forget_senders, lookup_sender, warm_routes
+from tasks.generation_tasks import generate_art_task
+from tasks.transcription_tasks import transcribe_audio_task, send_whatsapp_message
+
+logger = get_task_logger(__name__)
+
+WELCOME_MESSAGE = "Olá! Para usar o NexusArt, primeiro registre-se em nexusart.com.br"
+NO_CREDITS_MESSAGE = "❌ Seus créditos acabaram. Atualize seu plano em nexusart.com.br/plans"
+AUDIO_ACK_MESSAGE = "🎤 Processando seu áudio... Em segundos você receberá a arte!"
+TEXT_ACK_MESSAGE = "✍️ Processando sua mensagem... Arte chegando em instantes!"
+
+HELP_COMMANDS = {"menu", "ajuda", "help"}
+CREDITS_COMMANDS = {"creditos", "créditos"}
+
+HELP_MESSAGE = """
+🤖 *NexusArt - Menu de Ajuda*
+
+📱 *Como usar:*
+1. Digite ou grave um áudio com sua promoção
+2. Receba a arte pronta em segundos
+3. Compartilhe com seus clientes
+
+⚡ *Comandos rápidos:*
+• *menu* - Ver este menu
+• *creditos* - Ver créditos restantes
+• *plano* - Ver seu plano atual
+
+💡 *Dica:* Grave áudios para ser mais rápido!
+"""
+
+@worker_ready.connect
+def warm_sender_routes(sender=None, **kwargs):
+    """Load the sender routing cache before the first webhook burst"""
+    db = SessionLocal()
+    try:
+        logger.info(f"Warmed {warm_routes(db)} WhatsApp sender routes")
+    except Exception as e:
+        logger.warning(f"Could not warm WhatsApp sender routes: {e}")
+    finally:
+        db.close()
+
+def message_type(event: dict) -> str:
+    """whatsapp_messages.message_type for an inbound event"""
+    if not event.get("num_media"):
+        return "text"
+    media_type = event.get("media_type") or ""
+    for kind in ("audio", "image"):
+        if media_type.startswith(f"{kind}/"):
+            return kind
+    return "document"
+
+def claim_inbound_message(db: Session, number_id: int, event: dict) -> Optional[int]:
+    """
+    Record an inbound message and take it for processing
+    
+    The row, unique on message_sid, is the source of truth: a redelivered
+    webhook or task finds it already taken ("received") or done
+    ("processed") and stops. A "failed" attempt is taken again, and so is
+    one left "received" for WHATSAPP_INBOUND_CLAIM_TIMEOUT seconds (the
+    worker that claimed it died).
+    
+    Returns:
+        Message ID, or None if another delivery already has it
+    """
+    message_id = db.execute(
+        insert(WhatsAppMessage)
+        .values(
+            whatsapp_number_id=number_id,
+            message_sid=event.get("message_sid"),
+            direction="inbound",
+            message_type=message_type(event),
+            body=event.get("body"),
+            media_url=event.get("media_url"),
+            status="received",
+            received_at=datetime.fromisoformat(event["received_at"])
+        )
+        .on_conflict_do_nothing(index_elements=["message_sid"])
+        .returning(WhatsAppMessage.id)
+    ).scalar()
+    
+    if message_id is not None:
+        db.execute(
+            update(WhatsAppNumber)
+            .where(WhatsAppNumber.id == number_id)
+            .values(
+                messages_received=func.coalesce(WhatsAppNumber.messages_received, 0) + 1,
+                last_used_at=datetime.utcnow()
+            )
+        )
+    else:
+        # updated_at moves on every claim (onupdate), created_at on the first
+        claimed_at = func.coalesce(WhatsAppMessage.updated_at, WhatsAppMessage.created_at)
+        abandoned = (WhatsAppMessage.status == "received") & (
+            claimed_at < func.now() - timedelta(seconds=settings.WHATSAPP_INBOUND_CLAIM_TIMEOUT)
+        )
+        message_id = db.execute(
+            update(WhatsAppMessage)
+            .where(
+                WhatsAppMessage.message_sid == event.get("message_sid"),
+                (WhatsAppMessage.status == "failed") | abandoned
+            )
+            .values(status="received", error_message=None)
+            .returning(WhatsAppMessage.id)
+        ).scalar()
+    
+    db.commit()
+    return message_id
+
+def finish_inbound_message(db: Session, message_id: int, status: str = "processed",
+                           generation_id: Optional[int] = None, error: Optional[str] = None) -> None:
+    """Close the inbound row (caller commits)"""
+    values = {"status": status, "processed_at": datetime.utcnow(), "error_message": error}
+    if generation_id is not None:
+        values["generation_id"] = generation_id
+    db.execute(update(WhatsAppMessage).where(WhatsAppMessage.id == message_id).values(**values))
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=10)
+def handle_inbound_message(self, event: dict, generation_id: Optional[int] = None):
+    """
+    Handle a WhatsApp message accepted by the webhook
+    
+    The webhook only validates the signature and enqueues; routing, the
+    credit check, commands and acknowledgements all happen here.
+    Transcription and generation are chained as their own tasks.
+    
+    Args:
+        event: Compact inbound event built by the webhook
+            (message_sid, phone, body, num_media, media_url, media_type, received_at)
+        generation_id: Set on a retry after the generation was committed;
+            only its hand-off to generate_art_task is retried
+    """
+    db = SessionLocal()
+    phone = event["phone"]
+    message_id = None
+    
+    try:
+        if generation_id is not None:
+            generation = db.get(Generation, generation_id)
+            if generation is None or generation.status != "processing":
+                return "duplicate"
+            _start_generation(generation, phone)
+            return "text_queued"
+        
+        route = lookup_sender(db, phone)
+        
+        if route is None:
+            # No row without a number to attach it to. The sender is now cached
+            # as unregistered, so the webhook drops its next messages
+            send_whatsapp_message.delay(phone, WELCOME_MESSAGE)
+            return "number_not_registered"
+        
+        try:
+            message_id = claim_inbound_message(db, route.number_id, event)
+        except IntegrityError:
+            # The cached route outlived its number (and maybe its user)
+            db.rollback()
+            if db.get(WhatsAppNumber, route.number_id) is not None:
+                raise
+            return _unregistered_sender(phone)
+        if message_id is None:
+            logger.info(f"Inbound message {event.get('message_sid')} already handled, skipping")
+            return "duplicate"
+        
+        result, generation = _handle_claimed_message(db, route, event, message_id)
+        if generation is None:
+            finish_inbound_message(db, message_id)
+            db.commit()
+        else:
+            # The generation and the processed row are committed together:
+            # from here on a failure retries the hand-off, never the message
+            generation_id = generation.id
+            _start_generation(generation, phone)
+        
+        lag = datetime.utcnow() - datetime.fromisoformat(event["received_at"])
+        logger.info(f"Inbound message {event.get('message_sid')}: {result} ({lag.total_seconds():.2f}s after webhook)")
+        return result
+    
+    except Exception as exc:
+        logger.error(f"Error handling inbound message {event.get('message_sid')}: {exc}")
+        db.rollback()
+        if generation_id is not None:
+            raise self.retry(exc=exc, kwargs={"generation_id": generation_id})
+        if message_id is not None:
+            # Lets the retry (or a later redelivery) take the message again
+            finish_inbound_message(db, message_id, status="failed", error=str(exc))
+            db.commit()
+        raise self.retry(exc=exc)
+    
+    finally:
+        db.close()
+
+def _handle_claimed_message(db: Session, route: SenderRoute, event: dict, message_id: int):
+    """
+    Credit check, commands and hand-off to transcription, or the
+    generation record (committed, with the message marked processed)
+    
+    Returns:
+        (result, generation to start if one was created)
+    """
+    phone = event["phone"]
+    user_id = route.user_id
+    if not route.can_generate:
+        # The cached snapshot may predate an upgrade: confirm before refusing
+        user = db.get(User, user_id)
+        if user is None:
+            return _unregistered_sender(phone), None
+        if not user.can_generate():
+            send_whatsapp_message.delay(phone, NO_CREDITS_MESSAGE)
+            return "no_credits", None
+        forget_senders([phone])
+    
+    body = (event.get("body") or "").strip()
+    
+    if event.get("num_media") and event.get("media_url"):
+        # Whisper runs on the worker that picks this up, never on the API
+        transcribe_audio_task.delay(event["media_url"], user_id, phone, inbound_message_id=message_id)
+        _acknowledge(phone, AUDIO_ACK_MESSAGE)
+        return "audio_queued", None
+    
+    if body.lower() in HELP_COMMANDS:
+        send_whatsapp_message.delay(phone, HELP_MESSAGE)
+        return "help_sent", None
+    
+    if body.lower() in CREDITS_COMMANDS:
+        user = db.get(User, user_id)
+        if user is None:
+            return _unregistered_sender(phone), None
+        send_whatsapp_message.delay(
+            phone,
+            f"""
+💰 *Seus Créditos*
+
+• Usados: {user.credits_used}
+• Limite: {user.credits_limit}
+• Restantes: {user.remaining_credits}
+
+Plano: {user.plan_type.value.capitalize()}
+"""
+        )
+        return "credits_sent", None
+    
+    if not body:
+        return "ignored", None
+    
+    # The credit is reserved by generate_art_task
+    generation = Generation(
+        user_id=user_id,
+        prompt=body,
+        input_type="text",
+        status="processing",
+        credits_used=0
+    )
+    db.add(generation)
+    try:
+        db.flush()
+    except IntegrityError:
+        # A route cached with credits can still point at a deleted user
+        db.rollback()
+        if db.get(User, user_id) is None:
+            return _unregistered_sender(phone), None
+        raise
+    finish_inbound_message(db, message_id, generation_id=generation.id)
+    db.commit()
+    invalidate_count("generations", user_id)
+    return "text_queued", generation
+
+def _unregistered_sender(phone: str) -> str:
+    """The cached route outlived its number or user (deleted): drop it, answer as unregistered"""
+    forget_senders([phone])
+    send_whatsapp_message.delay(phone, WELCOME_MESSAGE)
+    return "number_not_registered"
+
+def _start_generation(generation: Generation, phone: str) -> None:
+    """Queue generate_art_task for a committed generation, then acknowledge"""
+    generate_art_task.delay(
+        generation_id=generation.id,
+        prompt=generation.prompt,
+        user_id=generation.user_id,
+        phone_number=phone
+    )
+    _acknowledge(phone, TEXT_ACK_MESSAGE)
+
+def _acknowledge(phone: str, text: str) -> None:
+    """Best effort: once work is handed off, retrying for the ack would hand it off twice"""
+    try:
+        send_whatsapp_message.delay(phone, text)
+    except Exception as e:
+        logger.warning(f"Could not queue acknowledgement to {phone}: {e}")
+
+@shared_task
+def flush_delivery_statuses():
+    """
+    Apply buffered Twilio status callbacks to whatsapp_messages
+    
+    One UPDATE per batch of WHATSAPP_STATUS_BATCH_SIZE callbacks; a batch
+    that fails goes back to the buffer for the next run. Callbacks that
+    beat their message's SID to the database (deferred by an earlier run)
+    go first, and are deferred again if still unmatched.
+    """
+    db = SessionLocal()
+    updated = 0
+    dropped = 0
+    
+    try:
+        # Taken whole at the start, so callbacks deferred now wait for the next run
+        deferred = drain_status_updates(0, DEFERRED_STATUS_CALLBACKS)
+        while True:
+            from_buffer = not deferred
+            if deferred:
+                updates, deferred = deferred[:settings.WHATSAPP_STATUS_BATCH_SIZE], deferred[settings.WHATSAPP_STATUS_BATCH_SIZE:]
+            else:
+                updates = drain_status_updates(settings.WHATSAPP_STATUS_BATCH_SIZE)
+                if not updates:
+                    break
+            try:
+                applied, unmatched = apply_status_updates(db, updates)
+                db.commit()
+            except Exception:
+                db.rollback()
+                requeue_status_updates(updates + deferred)
+                raise
+            updated += applied
+            dropped += defer_status_updates(unmatched)
+            if from_buffer and len(updates) < settings.WHATSAPP_STATUS_BATCH_SIZE:
+                break
+        
+        if updated:
+            logger.info(f"Applied {updated} WhatsApp delivery statuses")
+        if dropped:
+            logger.warning(f"Dropped {dropped} WhatsApp status callbacks that matched no message")
+        return updated
+    
+    except Exception as e:
+        logger.error(f"Error flushing WhatsApp delivery statuses: {e}")
+        raise
+    
+    finally:
+        db.close()
@@ -81,6 +81,10 @@ export const generationsApi = {
     limit?: number;
     status?: string;
     search?: string;
+    cursor?: string;
+    pagination?: 'offset' | 'cursor';
+    count?: 'exact' | 'cached' | 'estimated' | 'none';
+    fields?: string;
   }) => {
     return api.get('/api/generations', { params });
   },